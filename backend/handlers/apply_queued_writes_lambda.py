@@ -0,0 +1,57 @@
+import json
+import os
+
+import boto3
+
+from lib.ddb_metrics import instrument_client, instrument_table
+from lib.observability import instrument_handler
+from lib.outbox import open_outbox
+from lib.preference_store import open_preference_store
+from lib.queued_writes import apply_queued_writes
+from lib.tracing import span
+from lib.write_coalescing import open_write_coalescer
+from lib.write_queue import open_write_queue
+
+dynamodb = boto3.resource("dynamodb")
+client = instrument_client(dynamodb.meta.client)
+preferences_table = instrument_table(dynamodb.Table(os.environ["PREFERENCES_TABLE"]))
+preference_store = open_preference_store(dynamodb, preferences_table)
+versions_table = instrument_table(dynamodb.Table(os.environ["PREFERENCE_VERSIONS_TABLE"]))
+# Flushes of the coalescing window; re-queued flushes go back onto the same queue.
+write_coalescer = open_write_coalescer(dynamodb, open_write_queue())
+outbox = open_outbox(dynamodb)
+
+
+@instrument_handler("apply_queued_writes")
+def handler(event, context):
+    """
+    PREFERENCE_WRITE_QUEUE (SQS) consumer: applies the writes accepted with
+    ``Prefer: respond-async`` and the flushes of ``Prefer: coalesce`` windows as
+    one coalesced batch. Unparseable messages are dropped; if the batch fails,
+    every message is reported for retry (ReportBatchItemFailures).
+    """
+    records = event.get("Records") or []
+    messages = []
+    for record in records:
+        try:
+            messages.append(json.loads(record["body"]))
+        except (KeyError, ValueError) as exc:
+            print("Dropping malformed queued write:", repr(exc), json.dumps(record, default=str))
+
+    try:
+        with span("queued_writes.apply"):
+            report = apply_queued_writes(
+                messages,
+                preference_store,
+                client,
+                versions_table,
+                effective_table_name=os.environ.get("EFFECTIVE_PREFERENCES_TABLE"),
+                coalescer=write_coalescer,
+                outbox=outbox,
+            )
+    except Exception as exc:
+        print("Error applying queued writes:", repr(exc))
+        return {"batchItemFailures": [{"itemIdentifier": record["messageId"]} for record in records]}
+
+    print(f"[QueuedWrites] {json.dumps(report)}")
+    return {"batchItemFailures": []}
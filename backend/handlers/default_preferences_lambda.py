@@ -1,12 +1,23 @@
+import hashlib
 import json
 
 from lib.preferences_resolver import (
     build_user_context,
     merge_preferences,
-    resolve_managed_defaults,
+    resolve_defaults_from_schema,
+    schema_snapshot,
 )
+from lib.observability import instrument_handler
+from lib.tracing import span
 
+# DynamoDB call budget per scenario; see tests/test_ddb_call_budgets.py for what counts as a call.
+DDB_CALL_BUDGETS = {"self": 4}
 
+# Clients may cache the response but must revalidate it with If-None-Match.
+CACHE_CONTROL = "private, no-cache"
+
+
+@instrument_handler("default_preferences")
 def handler(event, context):
     print("Incoming event:", json.dumps(event))
 
@@ -26,14 +37,30 @@ def handler(event, context):
 
     try:
         user_ctx = build_user_context(requested_user_id)
-        defaults = resolve_managed_defaults(user_ctx)
+        schema_version, schema_items = schema_snapshot()
+        etag = _etag(schema_version, user_ctx)
+        if etag and etag in _if_none_match(event):
+            return {
+                "statusCode": 304,
+                "headers": {"ETag": etag, "Cache-Control": CACHE_CONTROL},
+                "body": "",
+            }
+
+        defaults = resolve_defaults_from_schema(schema_items, user_ctx)
         merged = merge_preferences([], defaults, include_defaults=True)
 
+        with span("serialize"):
+            body = json.dumps(merged)
+
+        headers = {"Content-Type": "application/json"}
+        if etag:
+            headers.update({"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
         # For consistency, return the same array shape as other endpoints
         return {
             "statusCode": 200,
-            "headers": {"Content-Type": "application/json"},
-            "body": json.dumps(merged),
+            "headers": headers,
+            "body": body,
         }
     except Exception as exc:
         print("Error resolving defaults:", repr(exc))
@@ -57,3 +84,21 @@ def _claims_user_id(event):
                 return source[key]
     return None
 
+
+def _etag(schema_version, user_ctx):
+    """
+    Defaults depend only on the schema and the user's (country, isChild, age), so
+    the ETag is derived from those without resolving anything.
+    """
+    if schema_version is None:
+        return None
+    fingerprint = f"{schema_version}|{user_ctx['country']}|{user_ctx['is_child']}|{user_ctx['age']}"
+    return '"' + hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def _if_none_match(event):
+    headers = event.get("headers") or {}
+    for key, value in headers.items():
+        if key.lower() == "if-none-match" and value:
+            return {tag.strip().removeprefix("W/") for tag in value.split(",")}
+    return set()
@@ -3,19 +3,38 @@ import os
 from datetime import datetime
 
 import boto3
-from boto3.dynamodb.conditions import Key
 
 from lib.preferences_resolver import (
     build_user_context,
     ensure_preference_value_allowed,
     get_managed_preference,
 )
+from lib.ddb_metrics import instrument_table
+from lib.effective_preferences import open_effective_view
+from lib.idempotency import idempotent, open_idempotency_store
+from lib.observability import instrument_handler
+from lib.outbox import build_event, change, open_outbox
+from lib.preference_store import ConcurrentPreferenceUpdate, open_preference_store
+from lib.preference_versions import record_version
+from lib.tracing import span, traced
 
 dynamodb = boto3.resource("dynamodb")
-preferences_table = dynamodb.Table(os.environ["PREFERENCES_TABLE"])
-versions_table = dynamodb.Table(os.environ["PREFERENCE_VERSIONS_TABLE"])
-users_table = dynamodb.Table(os.environ["USERS_TABLE"])
-child_links_table = dynamodb.Table(os.environ["CHILD_LINKS_TABLE"])
+preferences_table = instrument_table(dynamodb.Table(os.environ["PREFERENCES_TABLE"]))
+preference_store = open_preference_store(dynamodb, preferences_table)
+effective_view = open_effective_view(dynamodb)
+idempotency_store = open_idempotency_store(dynamodb)
+outbox = open_outbox(dynamodb)
+versions_table = instrument_table(dynamodb.Table(os.environ["PREFERENCE_VERSIONS_TABLE"]))
+users_table = instrument_table(dynamodb.Table(os.environ["USERS_TABLE"]))
+child_links_table = instrument_table(dynamodb.Table(os.environ["CHILD_LINKS_TABLE"]))
+
+# DynamoDB call budget per scenario; see tests/test_ddb_call_budgets.py for what counts as a call.
+# "document_self" is measured with PREFERENCE_STORAGE_MODE=document.
+DDB_CALL_BUDGETS = {
+    "self": 11,
+    "child": 13,
+    "document_self": 10,
+}
 
 
 def _now_iso():
@@ -23,23 +42,20 @@ def _now_iso():
 
 
 def _put_version_entry(user_id, pref_key, old_value):
-    timestamp = _now_iso()
-    item = {
-        "userId": user_id,
-        "preferenceKey_ts": f"{pref_key}#{timestamp}",
-        "preferenceKey": pref_key,
-        "timestamp": timestamp,
-        "action": "DELETE",
-    }
-
-    if old_value not in (None, ""):
-        item["oldValue"] = old_value
+    item = record_version(versions_table, user_id, pref_key, old_value, None, "DELETE")
 
     print(
         f"[PreferenceVersions] action=DELETE userId={user_id} key={pref_key} "
-        f"old={old_value}"
+        f"version={item['version']} old={old_value}"
     )
-    versions_table.put_item(Item=item)
+
+
+def _refresh_effective_view(user_id, items, user_ctx, computed_at):
+    """Rebuilds the user's EffectivePreferences item from the state just written."""
+    if effective_view is None or user_ctx is None:
+        return
+    with span("effective_view.refresh"):
+        effective_view.refresh(user_id, items, user_ctx, computed_at)
 
 
 def _log_block(user_id, pref_key, actor_id, reason):
@@ -71,6 +87,7 @@ def _get_user(user_id):
     return resp.get("Item")
 
 
+@traced("auth.ensure_actor_can_manage_child")
 def _ensure_actor_can_manage_child(actor_id, child_id):
     actor = _get_user(actor_id)
     if not actor:
@@ -108,6 +125,8 @@ def _resolve_target_user(event, caller_user_id):
     raise ValueError("userId is missing (path parameter or JWT)")
 
 
+@instrument_handler("delete_user_preference")
+@idempotent(idempotency_store, "delete_user_preference")
 def handler(event, context):
     print("Incoming event:", json.dumps(event))
 
@@ -138,12 +157,8 @@ def handler(event, context):
         }
 
     try:
-        existing_item = preferences_table.get_item(
-            Key={
-                "userId": user_id,
-                "preferenceKey": pref_key,
-            }
-        ).get("Item")
+        session = preference_store.session(user_id)
+        existing_item = session.current(pref_key)
 
         schema = get_managed_preference(pref_key)
         user_ctx = build_user_context(user_id)
@@ -157,27 +172,36 @@ def handler(event, context):
                 "body": json.dumps({"error": str(rule_err)}),
             }
 
-        preferences_table.delete_item(
-            Key={
-                "userId": user_id,
-                "preferenceKey": pref_key,
-            }
-        )
-
         old_value = existing_item.get("value") if existing_item else None
+        outbox_items = None
+        if outbox is not None:
+            event_record = build_event(user_id, caller_user_id, "DELETE", [change(pref_key, old_value, None)])
+            outbox_items = outbox.transact_items(event_record)
+
+        session.delete(pref_key)
+        session.commit(with_items=outbox_items)
+
         _put_version_entry(user_id, pref_key, old_value)
 
-        response = preferences_table.query(
-            KeyConditionExpression=Key("userId").eq(user_id)
-        )
-        items = response.get("Items", [])
+        computed_at = _now_iso()
+        items = session.items()
+        _refresh_effective_view(user_id, items, user_ctx, computed_at)
+
+        with span("serialize"):
+            body = json.dumps(items)
 
         return {
             "statusCode": 200,
             "headers": {"Content-Type": "application/json"},
-            "body": json.dumps(items),
+            "body": body,
         }
 
+    except ConcurrentPreferenceUpdate as conflict:
+        return {
+            "statusCode": 409,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"error": f"{conflict}; retry the request"}),
+        }
     except PermissionError as rule_err:
         _log_block(user_id, pref_key, caller_user_id, str(rule_err))
         return {
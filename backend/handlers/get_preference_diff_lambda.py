@@ -0,0 +1,195 @@
+import json
+import os
+from decimal import Decimal
+
+import boto3
+
+from lib.ddb_metrics import instrument_table
+from lib.observability import instrument_handler
+from lib.preference_checkpoints import MAX_KEYS_PER_DIFF, diff_versions, versions_between
+from lib.preference_versions import _UPPER_SENTINEL, _validate_bound
+from lib.tracing import span, traced
+from lib.version_archive import open_version_archive
+
+dynamodb = boto3.resource("dynamodb")
+versions_table = instrument_table(dynamodb.Table(os.environ["PREFERENCE_VERSIONS_TABLE"]))
+users_table = instrument_table(dynamodb.Table(os.environ["USERS_TABLE"]))
+child_links_table = instrument_table(dynamodb.Table(os.environ["CHILD_LINKS_TABLE"]))
+version_archive = open_version_archive()
+
+# DynamoDB call budget per scenario; see tests/test_ddb_call_budgets.py for what counts as a call.
+DDB_CALL_BUDGETS = {
+    "range": 1,
+    "versions": 3,
+    "child": 3,
+}
+
+
+def _convert_decimals(obj):
+    if isinstance(obj, list):
+        return [_convert_decimals(i) for i in obj]
+    if isinstance(obj, dict):
+        return {k: _convert_decimals(v) for k, v in obj.items()}
+    if isinstance(obj, Decimal):
+        if obj % 1 == 0:
+            return int(obj)
+        return float(obj)
+    return obj
+
+
+def _version_timestamp(user_id, version_key):
+    """Timestamp of a version row given its sort key (``<key>#v<N>``)."""
+    item = versions_table.get_item(Key={"userId": user_id, "preferenceKey_ts": version_key}).get("Item")
+    if item is None and version_archive is not None:
+        item = version_archive.find(user_id, version_key)
+    if item is None or "timestamp" not in item:
+        raise LookupError(f"Version {version_key} not found")
+    return item["timestamp"]
+
+
+def _window(user_id, query_params):
+    """
+    Returns ``(after, until)``: the diff covers versions with ``after < timestamp <=
+    until``. A version id bound includes that version in the state it names.
+    """
+    from_version = query_params.get("fromVersion")
+    to_version = query_params.get("toVersion")
+
+    if from_version:
+        after = _version_timestamp(user_id, from_version)
+    else:
+        from_ts = _validate_bound("from", query_params.get("from"))
+        # A prefix such as 2024-05-01 names the state at the end of that day.
+        after = f"{from_ts}{_UPPER_SENTINEL}" if from_ts else None
+    if to_version:
+        until = _version_timestamp(user_id, to_version)
+    else:
+        until = _validate_bound("to", query_params.get("to"))
+
+    if not until:
+        raise ValueError("to (or toVersion) is required")
+    if after and after > f"{until}{_UPPER_SENTINEL}":
+        raise ValueError("from must not be after to")
+    return after, until
+
+
+def _pref_keys(query_params):
+    """Distinct keys of the comma-separated ``preferenceKeys`` parameter, or None."""
+    raw = query_params.get("preferenceKeys")
+    if not raw:
+        return None
+    keys = list(dict.fromkeys(key for key in raw.split(",") if key))
+    if len(keys) > MAX_KEYS_PER_DIFF:
+        raise ValueError(f"At most {MAX_KEYS_PER_DIFF} preferenceKeys per request")
+    return keys or None
+
+
+@instrument_handler("get_preference_diff")
+def handler(event, context):
+    print("Incoming event:", json.dumps(event))
+
+    query_params = event.get("queryStringParameters") or {}
+    try:
+        user_id = _resolve_target_user(event)
+        after, until = _window(user_id, query_params)
+        pref_keys = _pref_keys(query_params)
+    except PermissionError as auth_err:
+        return {
+            "statusCode": 403,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"error": str(auth_err)}),
+        }
+    except LookupError as missing:
+        return {
+            "statusCode": 404,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"error": str(missing)}),
+        }
+    except ValueError as ve:
+        return {
+            "statusCode": 400,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"error": str(ve)}),
+        }
+
+    try:
+        with span("diff.versions") as diff_span:
+            rows = versions_between(versions_table, user_id, after, until, version_archive, pref_keys)
+            changes = diff_versions(rows)
+            diff_span.set_attribute("diff.rows", len(rows))
+
+        return {
+            "statusCode": 200,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps(
+                {
+                    "userId": user_id,
+                    "from": query_params.get("fromVersion") or query_params.get("from"),
+                    "to": query_params.get("toVersion") or query_params.get("to"),
+                    "changes": _convert_decimals(changes),
+                    "versionsRead": len(rows),
+                }
+            ),
+        }
+    except Exception as exc:
+        print("Error computing preference diff:", repr(exc))
+        return {
+            "statusCode": 500,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"error": "Failed to compute diff", "details": str(exc)}),
+        }
+
+
+def _resolve_target_user(event):
+    path_params = event.get("pathParameters") or {}
+    query_params = event.get("queryStringParameters") or {}
+    child_id = path_params.get("childId")
+    path_user_id = path_params.get("userId") or query_params.get("userId")
+    caller_user_id = _claims_user_id(event)
+
+    if child_id:
+        if not caller_user_id:
+            raise PermissionError("Authentication (Cognito) is required for child access")
+        _ensure_actor_can_manage_child(caller_user_id, child_id)
+        return child_id
+
+    if path_user_id:
+        return path_user_id
+
+    if caller_user_id:
+        return caller_user_id
+
+    raise ValueError("userId is missing (neither path nor JWT)")
+
+
+def _claims_user_id(event):
+    authorizer = (event.get("requestContext") or {}).get("authorizer") or {}
+    jwt_claims = (authorizer.get("jwt") or {}).get("claims") or {}
+    legacy_claims = authorizer.get("claims") or {}
+
+    for source in (jwt_claims, legacy_claims):
+        if not source:
+            continue
+        for key in ("sub", "username", "cognito:username"):
+            if source.get(key):
+                return source[key]
+    return None
+
+
+@traced("auth.ensure_actor_can_manage_child")
+def _ensure_actor_can_manage_child(actor_id, child_id):
+    actor = users_table.get_item(Key={"userId": actor_id}).get("Item")
+    if not actor:
+        raise PermissionError("Actor user record not found")
+
+    role = (actor.get("role") or "").lower()
+    if role not in ("adult", "admin"):
+        raise PermissionError("Only Adult/Admin can manage children")
+
+    if role == "admin":
+        return actor
+
+    link_resp = child_links_table.get_item(Key={"adultId": actor_id, "childId": child_id})
+    if "Item" not in link_resp:
+        raise PermissionError("Child is not linked to this adult")
+    return actor
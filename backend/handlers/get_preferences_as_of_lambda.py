@@ -0,0 +1,82 @@
+import json
+import os
+from decimal import Decimal
+
+import boto3
+
+from lib.ddb_metrics import instrument_table
+from lib.observability import instrument_handler
+from lib.preference_checkpoints import reconstruct
+from lib.tracing import span
+from lib.version_archive import open_version_archive
+
+dynamodb = boto3.resource("dynamodb")
+versions_table = instrument_table(dynamodb.Table(os.environ["PREFERENCE_VERSIONS_TABLE"]))
+version_archive = open_version_archive()
+
+# DynamoDB call budget per scenario; see tests/test_ddb_call_budgets.py for what counts as a call.
+DDB_CALL_BUDGETS = {"as_of": 2}
+
+
+def _convert_decimals(obj):
+    if isinstance(obj, list):
+        return [_convert_decimals(i) for i in obj]
+    if isinstance(obj, dict):
+        return {k: _convert_decimals(v) for k, v in obj.items()}
+    if isinstance(obj, Decimal):
+        if obj % 1 == 0:
+            return int(obj)
+        return float(obj)
+    return obj
+
+
+@instrument_handler("get_preferences_as_of")
+def handler(event, context):
+    print("Incoming event:", json.dumps(event))
+
+    path_params = event.get("pathParameters") or {}
+    query_params = event.get("queryStringParameters") or {}
+
+    user_id = path_params.get("userId") or query_params.get("userId")
+    as_of = query_params.get("at") or query_params.get("asOf")
+    if not (user_id and as_of):
+        return {
+            "statusCode": 400,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"error": "userId and at are required"}),
+        }
+
+    try:
+        with span("as_of.reconstruct"):
+            state = reconstruct(versions_table, user_id, as_of, version_archive)
+    except ValueError as ve:
+        return {
+            "statusCode": 400,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"error": str(ve)}),
+        }
+    except Exception as exc:
+        print("Error reconstructing preferences:", repr(exc))
+        return {
+            "statusCode": 500,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"error": "Failed to reconstruct preferences", "details": str(exc)}),
+        }
+
+    preferences = [
+        dict(entry, preferenceKey=key, userId=user_id)
+        for key, entry in sorted(state["preferences"].items())
+    ]
+    return {
+        "statusCode": 200,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps(
+            {
+                "userId": user_id,
+                "at": as_of,
+                "preferences": _convert_decimals(preferences),
+                "checkpoint": state["checkpoint"],
+                "replayed": state["replayed"],
+            }
+        ),
+    }
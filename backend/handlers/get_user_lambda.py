@@ -3,10 +3,17 @@ import json
 import os
 from decimal import Decimal
 
+from lib.ddb_metrics import instrument_table
+from lib.observability import instrument_handler
+
 dynamodb = boto3.resource("dynamodb")
-table = dynamodb.Table(os.environ["USERS_TABLE"])
+table = instrument_table(dynamodb.Table(os.environ["USERS_TABLE"]))
+
+# DynamoDB call budget per scenario; see tests/test_ddb_call_budgets.py for what counts as a call.
+DDB_CALL_BUDGETS = {"by_id": 1}
 
 
+@instrument_handler("get_user")
 def handler(event, context):
     print("Incoming event:", json.dumps(event))
 
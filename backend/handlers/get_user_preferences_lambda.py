@@ -2,20 +2,35 @@ import json
 import os
 
 import boto3
-from boto3.dynamodb.conditions import Key
 
 from lib.preferences_resolver import (
     build_user_context,
     merge_preferences,
-    resolve_managed_defaults,
 )
+from lib.ddb_metrics import instrument_table
+from lib.effective_preferences import now_iso, open_effective_view, resolve_effective
+from lib.observability import instrument_handler
+from lib.preference_store import open_preference_store
+from lib.tracing import span, traced
 
 dynamodb = boto3.resource("dynamodb")
-preferences_table = dynamodb.Table(os.environ["PREFERENCES_TABLE"])
-users_table = dynamodb.Table(os.environ["USERS_TABLE"])
-child_links_table = dynamodb.Table(os.environ["CHILD_LINKS_TABLE"])
-
-
+preferences_table = instrument_table(dynamodb.Table(os.environ["PREFERENCES_TABLE"]))
+preference_store = open_preference_store(dynamodb, preferences_table)
+effective_view = open_effective_view(dynamodb)
+users_table = instrument_table(dynamodb.Table(os.environ["USERS_TABLE"]))
+child_links_table = instrument_table(dynamodb.Table(os.environ["CHILD_LINKS_TABLE"]))
+
+# DynamoDB call budget per scenario; see tests/test_ddb_call_budgets.py for what counts as a call.
+# "self" / "child" are served from a fresh EffectivePreferences item; a stale or
+# missing one costs the live resolution plus one write.
+DDB_CALL_BUDGETS = {
+    "self": 1,
+    "child": 3,
+    "path": 1,
+}
+
+
+@instrument_handler("get_user_preferences")
 def handler(event, context):
     print("Incoming event:", json.dumps(event))
 
@@ -35,22 +50,39 @@ def handler(event, context):
         }
 
     try:
-        response = preferences_table.query(
-            KeyConditionExpression=Key("userId").eq(target_user_id)
-        )
-        items = response.get("Items", [])
+        if include_defaults and effective_view is not None:
+            with span("preferences.view") as view_span:
+                materialized = effective_view.read(target_user_id)
+                view_span.set_attribute("view.hit", materialized is not None)
+            if materialized is not None:
+                with span("serialize"):
+                    body = json.dumps(materialized)
+                return {
+                    "statusCode": 200,
+                    "headers": {"Content-Type": "application/json"},
+                    "body": body,
+                }
+
+        computed_at = now_iso()
+        with span("preferences.query") as query_span:
+            items = preference_store.list(target_user_id)
+            query_span.set_attribute("preferences.count", len(items))
 
-        defaults = {}
         if include_defaults:
             user_ctx = build_user_context(target_user_id)
-            defaults = resolve_managed_defaults(user_ctx)
+            schema_version, merged = resolve_effective(items, user_ctx)
+            if effective_view is not None:
+                effective_view.write(target_user_id, merged, user_ctx, schema_version, computed_at)
+        else:
+            merged = merge_preferences(items, {}, include_defaults=False)
 
-        merged = merge_preferences(items, defaults, include_defaults=include_defaults)
+        with span("serialize"):
+            body = json.dumps(merged)
 
         return {
             "statusCode": 200,
             "headers": {"Content-Type": "application/json"},
-            "body": json.dumps(merged),
+            "body": body,
         }
 
     except Exception as exc:
@@ -104,6 +136,7 @@ def _get_user(user_id):
     return resp.get("Item")
 
 
+@traced("auth.ensure_actor_can_manage_child")
 def _ensure_actor_can_manage_child(actor_id, child_id):
     actor = _get_user(actor_id)
     if not actor:
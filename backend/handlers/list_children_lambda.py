@@ -5,9 +5,15 @@ from decimal import Decimal
 import boto3
 from boto3.dynamodb.conditions import Key
 
+from lib.ddb_metrics import instrument_client, instrument_table
+from lib.observability import instrument_handler
+
 dynamodb = boto3.resource("dynamodb")
-child_links_table = dynamodb.Table(os.environ["CHILD_LINKS_TABLE"])
-users_table = dynamodb.Table(os.environ["USERS_TABLE"])
+child_links_table = instrument_table(dynamodb.Table(os.environ["CHILD_LINKS_TABLE"]))
+users_table = instrument_table(dynamodb.Table(os.environ["USERS_TABLE"]))
+
+# DynamoDB call budget per scenario; see tests/test_ddb_call_budgets.py for what counts as a call.
+DDB_CALL_BUDGETS = {"adult": 3}
 
 
 def _claims_user_id(event):
@@ -56,7 +62,7 @@ def _batch_get_users(user_ids):
     if not user_ids:
         return {}
     keys = [{"userId": child_id} for child_id in user_ids]
-    client = dynamodb.meta.client
+    client = instrument_client(dynamodb.meta.client)
     response = client.batch_get_item(
         RequestItems={
             users_table.name: {
@@ -68,6 +74,7 @@ def _batch_get_users(user_ids):
     return {item["userId"]: item for item in results}
 
 
+@instrument_handler("list_children")
 def handler(event, context):
     print("Incoming event:", json.dumps(event))
 
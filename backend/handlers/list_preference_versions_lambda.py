@@ -4,10 +4,29 @@ import os
 from decimal import Decimal
 
 import boto3
-from boto3.dynamodb.conditions import Key
+
+from lib.ddb_metrics import instrument_table
+from lib.observability import instrument_handler
+from lib.preference_versions import build_history_query, get_version, version_sort_key
+from lib.version_archive import not_archived, open_version_archive
 
 dynamodb = boto3.resource("dynamodb")
-versions_table = dynamodb.Table(os.environ["PREFERENCE_VERSIONS_TABLE"])
+versions_table = instrument_table(dynamodb.Table(os.environ["PREFERENCE_VERSIONS_TABLE"]))
+version_archive = open_version_archive()
+
+# Modes scoped to one user continue into the archive once the hot rows run out;
+# preferenceKey-only modes cover the hot tier.
+ARCHIVED_MODES = ("user", "user_key", "user_range", "user_action")
+
+# DynamoDB call budget per scenario; see tests/test_ddb_call_budgets.py for what counts as a call.
+DDB_CALL_BUDGETS = {
+    "user": 1,
+    "preference_key": 1,
+    "user_range": 1,
+    "user_action": 1,
+    "key_across_users": 1,
+    "version": 1,
+}
 
 
 def _decode_next_token(token):
@@ -39,6 +58,56 @@ def _convert_decimals(obj):
     return obj
 
 
+def _archive_predicate(preference_key, action):
+    """The non-time parts of the query's conditions, applied to archived rows."""
+    action = action.upper() if action else None
+
+    def matches(row):
+        if preference_key and row.get("preferenceKey") != preference_key:
+            return False
+        return not action or row.get("action") == action
+
+    return matches
+
+
+def _single_version(user_id, preference_key, version_raw):
+    """version=N is a single GetItem on the (userId, "<key>#v<N>") sort key."""
+    if not (user_id and preference_key):
+        return {
+            "statusCode": 400,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"error": "version requires userId and preferenceKey"}),
+        }
+    try:
+        sequence = int(version_raw)
+    except ValueError:
+        sequence = 0
+    if sequence < 1:
+        return {
+            "statusCode": 400,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"error": "version must be a positive integer"}),
+        }
+
+    try:
+        item = get_version(versions_table, user_id, preference_key, sequence)
+        if item is None and version_archive is not None:
+            item = version_archive.find(user_id, version_sort_key(preference_key, sequence))
+    except Exception as exc:
+        print("Error reading PreferenceVersions:", repr(exc))
+        return {
+            "statusCode": 500,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"error": "Failed to fetch versions", "details": str(exc)}),
+        }
+    return {
+        "statusCode": 200,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps({"items": _convert_decimals([item] if item else []), "nextToken": None, "mode": "version"}),
+    }
+
+
+@instrument_handler("list_preference_versions")
 def handler(event, context):
     print("Incoming event:", json.dumps(event))
 
@@ -46,14 +115,33 @@ def handler(event, context):
     query_params = event.get("queryStringParameters") or {}
 
     user_id = path_params.get("userId") or query_params.get("userId")
-    if not user_id:
+    preference_key = path_params.get("preferenceKey") or query_params.get("preferenceKey")
+    if not (user_id or preference_key):
         return {
             "statusCode": 400,
             "headers": {"Content-Type": "application/json"},
-            "body": json.dumps({"error": "userId is required"}),
+            "body": json.dumps({"error": "userId or preferenceKey is required"}),
+        }
+
+    version_raw = query_params.get("version")
+    if version_raw not in (None, ""):
+        return _single_version(user_id, preference_key, version_raw)
+
+    try:
+        mode, query_kwargs = build_history_query(
+            user_id=user_id,
+            preference_key=preference_key,
+            from_ts=query_params.get("from"),
+            to_ts=query_params.get("to"),
+            action=query_params.get("action"),
+        )
+    except ValueError as ve:
+        return {
+            "statusCode": 400,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"error": str(ve)}),
         }
 
-    preference_key = path_params.get("preferenceKey") or query_params.get("preferenceKey")
     limit_raw = query_params.get("limit") or query_params.get("Limit")
     limit = 50
     if limit_raw:
@@ -63,25 +151,48 @@ def handler(event, context):
             pass
 
     next_token = _decode_next_token(query_params.get("nextToken"))
-
-    key_condition = Key("userId").eq(user_id)
-    if preference_key:
-        prefix = f"{preference_key}#"
-        key_condition = key_condition & Key("preferenceKey_ts").begins_with(prefix)
-
-    query_kwargs = {
-        "KeyConditionExpression": key_condition,
-        "ScanIndexForward": False,
-        "Limit": limit,
-    }
-    if next_token:
+    tiered = version_archive is not None and mode in ARCHIVED_MODES
+
+    query_kwargs["ScanIndexForward"] = False
+    query_kwargs["Limit"] = limit
+    if tiered:
+        hot_filter = not_archived()
+        if "FilterExpression" in query_kwargs:
+            hot_filter = query_kwargs["FilterExpression"] & hot_filter
+        query_kwargs["FilterExpression"] = hot_filter
+    archive_cursor = None
+    if next_token and "archive" in next_token:
+        archive_cursor = next_token["archive"]
+    elif next_token:
         query_kwargs["ExclusiveStartKey"] = next_token
 
     try:
-        response = versions_table.query(**query_kwargs)
-        items = _convert_decimals(response.get("Items", []))
-
-        next_token_out = _encode_next_token(response.get("LastEvaluatedKey"))
+        if archive_cursor is None:
+            response = versions_table.query(**query_kwargs)
+            items = response.get("Items", [])
+            next_token_out = response.get("LastEvaluatedKey")
+            if tiered and not next_token_out:
+                archive_cursor = {}
+        else:
+            items, next_token_out = [], None
+
+        if tiered and archive_cursor is not None:
+            if len(items) < limit:
+                cold_items, cursor = version_archive.page(
+                    user_id,
+                    limit - len(items),
+                    archive_cursor,
+                    from_ts=query_params.get("from"),
+                    to_ts=query_params.get("to"),
+                    predicate=_archive_predicate(preference_key, query_params.get("action")),
+                )
+                items = items + cold_items
+                next_token_out = {"archive": cursor} if cursor else None
+            else:
+                next_token_out = {"archive": archive_cursor}
+
+        items = _convert_decimals(items)
+        next_token_out = _encode_next_token(next_token_out)
 
         return {
             "statusCode": 200,
@@ -90,6 +201,7 @@ def handler(event, context):
                 {
                     "items": items,
                     "nextToken": next_token_out,
+                    "mode": mode,
                 }
             ),
         }
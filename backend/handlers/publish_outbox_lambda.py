@@ -0,0 +1,52 @@
+import json
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+
+from lib.observability import instrument_handler
+from lib.outbox import open_outbox_publisher
+from lib.tracing import span
+
+dynamodb = boto3.resource("dynamodb")
+publisher = open_outbox_publisher(dynamodb)
+
+_deserializer = TypeDeserializer()
+
+
+def _new_image(record):
+    image = (record.get("dynamodb") or {}).get("NewImage") or {}
+    return {key: _deserializer.deserialize(value) for key, value in image.items()}
+
+
+@instrument_handler("publish_outbox")
+def handler(event, context):
+    """
+    Publishes preference change events from the outbox (see ``lib.outbox``).
+
+    PreferenceOutbox stream (NEW_IMAGE): publishes the inserted rows as one batch.
+    Scheduled invocation (no Records): drains every shard, picking up rows a stream
+    batch could not deliver. Rows are deleted only once the sink accepted them.
+    """
+    records = event.get("Records")
+    if records is None:
+        with span("outbox.drain"):
+            report = publisher.drain()
+        print(f"[Outbox] drain {json.dumps(report)}")
+        return report
+
+    events = [_new_image(record) for record in records if record.get("eventName") == "INSERT"]
+    try:
+        with span("outbox.publish"):
+            report = publisher.publish([event for event in events if event.get("eventId")])
+    except Exception as exc:
+        print("Error publishing outbox events:", repr(exc))
+        failures = []
+        for record in records:
+            sequence = (record.get("dynamodb") or {}).get("SequenceNumber")
+            if sequence:
+                failures.append({"itemIdentifier": sequence})
+        return {"batchItemFailures": failures}
+
+    # Rejected events stay in the outbox for the scheduled drain.
+    print(f"[Outbox] records={len(records)} published={report['published']} failed={report['failed']}")
+    return {"batchItemFailures": []}
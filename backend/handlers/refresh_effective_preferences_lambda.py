@@ -0,0 +1,71 @@
+import json
+import os
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+
+from lib.ddb_metrics import instrument_table
+from lib.effective_preferences import now_iso, open_effective_view
+from lib.observability import instrument_handler
+from lib.preference_store import open_preference_store
+from lib.preferences_resolver import _fetch_age_threshold, user_context_from_record
+from lib.tracing import span
+
+dynamodb = boto3.resource("dynamodb")
+preferences_table = instrument_table(dynamodb.Table(os.environ["PREFERENCES_TABLE"]))
+preference_store = open_preference_store(dynamodb, preferences_table)
+effective_view = open_effective_view(dynamodb)
+
+# Users attributes the effective preferences depend on.
+CONTEXT_ATTRIBUTES = ("country", "birthDate", "role")
+
+_deserializer = TypeDeserializer()
+
+
+def _image(record, name):
+    image = (record.get("dynamodb") or {}).get(name) or {}
+    return {key: _deserializer.deserialize(value) for key, value in image.items()}
+
+
+def _context_changed(old, new):
+    return any(old.get(attribute) != new.get(attribute) for attribute in CONTEXT_ATTRIBUTES)
+
+
+def _refresh(user):
+    user_ctx = user_context_from_record(user, _fetch_age_threshold(user.get("country")))
+    computed_at = now_iso()
+    items = preference_store.list(user["userId"])
+    effective_view.refresh(user["userId"], items, user_ctx, computed_at)
+
+
+@instrument_handler("refresh_effective_preferences")
+def handler(event, context):
+    """
+    Users table stream (NEW_AND_OLD_IMAGES): recomputes a user's EffectivePreferences
+    item when country, birthDate or role change and drops it when the user is deleted.
+    Failed records are reported individually (ReportBatchItemFailures).
+    """
+    records = event.get("Records") or []
+    failures = []
+    refreshed = 0
+
+    for record in records:
+        try:
+            old = _image(record, "OldImage")
+            new = _image(record, "NewImage")
+            if record.get("eventName") == "REMOVE":
+                effective_view.delete(old.get("userId") or _image(record, "Keys")["userId"])
+                continue
+            if not new.get("userId") or not _context_changed(old, new):
+                continue
+            with span("effective_view.refresh"):
+                _refresh(new)
+            refreshed += 1
+        except Exception as exc:
+            print("Error refreshing effective preferences:", repr(exc), json.dumps(record, default=str))
+            sequence = (record.get("dynamodb") or {}).get("SequenceNumber")
+            if sequence:
+                failures.append({"itemIdentifier": sequence})
+
+    print(f"[EffectivePreferences] records={len(records)} refreshed={refreshed} failed={len(failures)}")
+    return {"batchItemFailures": failures}
@@ -3,17 +3,43 @@ import os
 from datetime import datetime, timezone
 
 import boto3
-from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
 
 from lib.preferences_resolver import (
     build_user_context,
     ensure_preference_value_allowed,
     get_managed_preference,
+    load_managed_schema,
 )
+from lib.ddb_metrics import instrument_client, instrument_table
+from lib.effective_preferences import open_effective_view
+from lib.idempotency import idempotent, open_idempotency_store
+from lib.observability import instrument_handler
+from lib.outbox import build_event, change, open_outbox
+from lib.preference_checkpoints import reconstruct, revert_plan
+from lib.preference_store import ConcurrentPreferenceUpdate, open_preference_store
+from lib.preference_versions import read_sequences, record_version, version_sort_key, version_transact_items
+from lib.tracing import span
+from lib.version_archive import open_version_archive
 
 dynamodb = boto3.resource("dynamodb")
-preferences_table = dynamodb.Table(os.environ["PREFERENCES_TABLE"])
-versions_table = dynamodb.Table(os.environ["PREFERENCE_VERSIONS_TABLE"])
+preferences_table = instrument_table(dynamodb.Table(os.environ["PREFERENCES_TABLE"]))
+preference_store = open_preference_store(dynamodb, preferences_table)
+effective_view = open_effective_view(dynamodb)
+idempotency_store = open_idempotency_store(dynamodb)
+outbox = open_outbox(dynamodb)
+versions_table = instrument_table(dynamodb.Table(os.environ["PREFERENCE_VERSIONS_TABLE"]))
+version_archive = open_version_archive()
+
+# DynamoDB call budget per scenario; see tests/test_ddb_call_budgets.py for what counts as a call.
+# "bulk" is measured reverting one key (no checkpoint, schema cached).
+DDB_CALL_BUDGETS = {"revert": 12, "bulk": 10}
+
+# Each reverted key takes three transaction items (counter, version row, preference),
+# plus one update of the user's document outside items mode and one outbox row;
+# TransactWriteItems accepts 100.
+BULK_CHANGES_PER_TRANSACTION = 32
+BULK_TRANSACTION_ATTEMPTS = 3
 
 
 def _now_iso():
@@ -27,21 +53,11 @@ def _sanitize_value(value):
 
 
 def _write_version(user_id, pref_key, old_value, new_value, action):
-    timestamp = _now_iso()
-    item = {
-        "userId": user_id,
-        "preferenceKey_ts": f"{pref_key}#{timestamp}",
-        "preferenceKey": pref_key,
-        "timestamp": timestamp,
-        "action": action,
-    }
-    if old_value not in (None, ""):
-        item["oldValue"] = old_value
-    if new_value not in (None, ""):
-        item["newValue"] = new_value
-    versions_table.put_item(Item=item)
+    return record_version(versions_table, user_id, pref_key, old_value, new_value, action)
 
 
+@instrument_handler("revert_preference")
+@idempotent(idempotency_store, "revert_preference")
 def handler(event, context):
     print("Incoming event:", json.dumps(event))
 
@@ -65,7 +81,19 @@ def handler(event, context):
 
     user_id = payload.get("userId")
     pref_key = payload.get("preferenceKey")
+    if user_id and payload.get("at") and not pref_key:
+        return _bulk_revert(user_id, payload, caller_user_id)
+
     version_key = payload.get("versionKey") or payload.get("preferenceKey_ts")
+    if not version_key and pref_key and payload.get("version") is not None:
+        try:
+            version_key = version_sort_key(pref_key, int(payload["version"]))
+        except (TypeError, ValueError):
+            return {
+                "statusCode": 400,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps({"error": "version must be an integer"}),
+            }
 
     if not (user_id and pref_key and version_key):
         return {
@@ -73,7 +101,8 @@ def handler(event, context):
             "headers": {"Content-Type": "application/json"},
             "body": json.dumps(
                 {
-                    "error": "userId, preferenceKey and versionKey are required",
+                    "error": "userId, preferenceKey and versionKey (or version) are required, "
+                    "or userId and at for a bulk revert",
                 }
             ),
         }
@@ -86,6 +115,8 @@ def handler(event, context):
             }
         )
         version_item = version_resp.get("Item")
+        if not version_item and version_archive is not None:
+            version_item = version_archive.find(user_id, version_key)
         if not version_item:
             return {
                 "statusCode": 404,
@@ -101,9 +132,8 @@ def handler(event, context):
             }
 
         revert_value = version_item.get("oldValue")
-        current_item = preferences_table.get_item(
-            Key={"userId": user_id, "preferenceKey": pref_key}
-        ).get("Item")
+        session = preference_store.session(user_id)
+        current_item = session.current(pref_key)
         current_value = current_item.get("value") if current_item else None
 
         schema = get_managed_preference(pref_key)
@@ -120,9 +150,7 @@ def handler(event, context):
 
         if revert_value in (None, ""):
             if current_item:
-                preferences_table.delete_item(
-                    Key={"userId": user_id, "preferenceKey": pref_key}
-                )
+                session.delete(pref_key)
         else:
             new_item = {
                 "userId": user_id,
@@ -130,7 +158,14 @@ def handler(event, context):
                 "value": _sanitize_value(revert_value),
                 "updatedAt": _now_iso(),
             }
-            preferences_table.put_item(Item=new_item)
+            session.put(new_item)
+        outbox_items = None
+        if outbox is not None:
+            event_record = build_event(
+                user_id, caller_user_id, "REVERT", [change(pref_key, current_value, revert_value)]
+            )
+            outbox_items = outbox.transact_items(event_record)
+        session.commit(with_items=outbox_items)
 
         _write_version(
             user_id=user_id,
@@ -140,16 +175,25 @@ def handler(event, context):
             action="REVERT",
         )
 
-        updated = preferences_table.query(
-            KeyConditionExpression=Key("userId").eq(user_id)
-        ).get("Items", [])
+        computed_at = _now_iso()
+        updated = session.items()
+        _refresh_effective_view(user_id, updated, user_ctx, computed_at)
+
+        with span("serialize"):
+            body = json.dumps(updated)
 
         return {
             "statusCode": 200,
             "headers": {"Content-Type": "application/json"},
-            "body": json.dumps(updated),
+            "body": body,
         }
 
+    except ConcurrentPreferenceUpdate as conflict:
+        return {
+            "statusCode": 409,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"error": f"{conflict}; retry the request"}),
+        }
     except Exception as exc:
         print("Error during revert:", repr(exc))
         return {
@@ -159,6 +203,178 @@ def handler(event, context):
         }
 
 
+def _refresh_effective_view(user_id, items, user_ctx, computed_at):
+    """Rebuilds the user's EffectivePreferences item from the state just written."""
+    if effective_view is None or user_ctx is None:
+        return
+    with span("effective_view.refresh"):
+        effective_view.refresh(user_id, items, user_ctx, computed_at)
+
+
+def _schema_by_key():
+    """First schema row per key in scope order, as ``get_managed_preference`` returns it."""
+    schema = {}
+    for item in sorted(load_managed_schema(), key=lambda row: str(row.get("scope") or "")):
+        schema.setdefault(item.get("preferenceKey"), item)
+    return schema
+
+
+def _apply_bulk_revert(session, changes, caller_user_id=None):
+    """
+    Writes the changes in TransactWriteItems chunks. Version numbers are read with one
+    BatchGetItem per chunk and claimed with conditional counter updates; if another
+    writer moved a counter in between, the chunk is re-read and retried. A failed
+    condition on the preferences themselves (document mode) is a real conflict and
+    raises ``ConcurrentPreferenceUpdate``. Each chunk carries its own change event
+    when the outbox is configured.
+    """
+    user_id = session.user_id
+    client = instrument_client(dynamodb.meta.client)
+    timestamp = _now_iso()
+    reverted = []
+    for start in range(0, len(changes), BULK_CHANGES_PER_TRANSACTION):
+        chunk = changes[start : start + BULK_CHANGES_PER_TRANSACTION]
+        outbox_items = []
+        if outbox is not None:
+            event_record = build_event(
+                user_id, caller_user_id, "REVERT", [change(key, current, target) for key, current, target in chunk]
+            )
+            outbox_items = outbox.transact_items(event_record)
+        for attempt in range(1, BULK_TRANSACTION_ATTEMPTS + 1):
+            sequences = read_sequences(client, versions_table.name, user_id, [key for key, _, _ in chunk])
+            transact_items = []
+            version_positions = set()
+            written = []
+            for key, current_value, target_value in chunk:
+                version_item, version_items = version_transact_items(
+                    versions_table.name, user_id, key, current_value, target_value, "REVERT", sequences[key], timestamp
+                )
+                version_positions.update(range(len(transact_items), len(transact_items) + len(version_items)))
+                transact_items.extend(version_items)
+                if target_value is None:
+                    session.delete(key)
+                else:
+                    session.put({"preferenceKey": key, "value": target_value, "updatedAt": timestamp})
+                written.append(
+                    {"preferenceKey": key, "from": current_value, "to": target_value, "version": version_item["version"]}
+                )
+            # Preference items, or one conditional update of the user's document.
+            transact_items.extend(session.transact_items())
+            transact_items.extend(outbox_items)
+            try:
+                client.transact_write_items(TransactItems=transact_items)
+                session.committed()
+                break
+            except ClientError as err:
+                if err.response["Error"]["Code"] != "TransactionCanceledException":
+                    raise
+                reasons = err.response.get("CancellationReasons") or []
+                failed = {
+                    index for index, reason in enumerate(reasons) if reason.get("Code") == "ConditionalCheckFailed"
+                }
+                if failed - version_positions:
+                    # Retrying would reuse the same stale reads.
+                    raise ConcurrentPreferenceUpdate("Preferences were modified concurrently") from err
+                if attempt == BULK_TRANSACTION_ATTEMPTS:
+                    raise
+                print(f"[BulkRevert] userId={user_id} transaction cancelled ({err}); retrying")
+        reverted.extend(written)
+    return reverted, timestamp
+
+
+def _bulk_revert(user_id, payload, caller_user_id):
+    """Restores every key (or ``preferenceKeys``) to its value at ``payload["at"]``."""
+    only_keys = payload.get("preferenceKeys")
+    if only_keys is not None and not (
+        isinstance(only_keys, list) and all(isinstance(key, str) and key for key in only_keys)
+    ):
+        return {
+            "statusCode": 400,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"error": "preferenceKeys must be a list of preference keys"}),
+        }
+
+    try:
+        try:
+            with span("revert.reconstruct"):
+                state = reconstruct(versions_table, user_id, payload["at"], version_archive)
+        except ValueError as ve:
+            return {
+                "statusCode": 400,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps({"error": str(ve)}),
+            }
+
+        session = preference_store.session(user_id)
+        computed_at = _now_iso()
+        current_items = session.items()
+        changes = revert_plan(current_items, state["preferences"], payload["at"], only_keys)
+
+        user_ctx = None
+        if changes:
+            schema = _schema_by_key()
+            user_ctx = build_user_context(user_id)
+            blocked = []
+            for key, _, target_value in changes:
+                try:
+                    ensure_preference_value_allowed(schema.get(key) or {}, user_ctx, target_value)
+                except PermissionError as rule_err:
+                    _log_block(user_id, key, caller_user_id, str(rule_err))
+                    blocked.append({"preferenceKey": key, "error": str(rule_err)})
+            if blocked:
+                return {
+                    "statusCode": 403,
+                    "headers": {"Content-Type": "application/json"},
+                    "body": json.dumps({"error": "Some preferences cannot be reverted", "blocked": blocked}),
+                }
+
+        reverted, timestamp = _apply_bulk_revert(session, changes, caller_user_id) if changes else ([], None)
+
+        items = {item["preferenceKey"]: item for item in current_items}
+        for entry in reverted:
+            if entry["to"] is None:
+                items.pop(entry["preferenceKey"], None)
+            else:
+                items[entry["preferenceKey"]] = {
+                    "userId": user_id,
+                    "preferenceKey": entry["preferenceKey"],
+                    "value": entry["to"],
+                    "updatedAt": timestamp,
+                }
+
+        if reverted:
+            _refresh_effective_view(user_id, [items[key] for key in sorted(items)], user_ctx, computed_at)
+
+        with span("serialize"):
+            body = json.dumps(
+                {
+                    "userId": user_id,
+                    "at": payload["at"],
+                    "reverted": reverted,
+                    "items": [items[key] for key in sorted(items)],
+                }
+            )
+        return {
+            "statusCode": 200,
+            "headers": {"Content-Type": "application/json"},
+            "body": body,
+        }
+
+    except ConcurrentPreferenceUpdate as conflict:
+        return {
+            "statusCode": 409,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"error": f"{conflict}; retry the request"}),
+        }
+    except Exception as exc:
+        print("Error during bulk revert:", repr(exc))
+        return {
+            "statusCode": 500,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"error": "Failed to revert preferences", "details": str(exc)}),
+        }
+
+
 def _log_block(user_id, pref_key, actor_id, reason):
     print(
         "[PreferenceBlocked] "
@@ -3,19 +3,45 @@ import os
 from datetime import datetime
 
 import boto3
-from boto3.dynamodb.conditions import Key
 
 from lib.preferences_resolver import (
     build_user_context,
     ensure_preference_value_allowed,
     get_managed_preference,
 )
+from lib.ddb_metrics import instrument_table
+from lib.effective_preferences import open_effective_view
+from lib.idempotency import idempotent, open_idempotency_store
+from lib.observability import instrument_handler
+from lib.outbox import MAX_CHANGES_PER_EVENT, build_event, change, open_outbox
+from lib.preference_store import ConcurrentPreferenceUpdate, open_preference_store
+from lib.preference_versions import record_version
+from lib.tracing import span, traced
+from lib.write_coalescing import open_write_coalescer
+from lib.write_queue import new_message, open_write_queue
 
 dynamodb = boto3.resource("dynamodb")
-preferences_table = dynamodb.Table(os.environ["PREFERENCES_TABLE"])
-versions_table = dynamodb.Table(os.environ["PREFERENCE_VERSIONS_TABLE"])
-child_links_table = dynamodb.Table(os.environ["CHILD_LINKS_TABLE"])
-users_table = dynamodb.Table(os.environ["USERS_TABLE"])
+preferences_table = instrument_table(dynamodb.Table(os.environ["PREFERENCES_TABLE"]))
+preference_store = open_preference_store(dynamodb, preferences_table)
+effective_view = open_effective_view(dynamodb)
+idempotency_store = open_idempotency_store(dynamodb)
+outbox = open_outbox(dynamodb)
+write_queue = open_write_queue()
+write_coalescer = open_write_coalescer(dynamodb, write_queue)
+versions_table = instrument_table(dynamodb.Table(os.environ["PREFERENCE_VERSIONS_TABLE"]))
+child_links_table = instrument_table(dynamodb.Table(os.environ["CHILD_LINKS_TABLE"]))
+users_table = instrument_table(dynamodb.Table(os.environ["USERS_TABLE"]))
+
+# DynamoDB call budget per scenario; see tests/test_ddb_call_budgets.py for what counts as a call.
+# "batch" is measured with a five-preference body; "document_*" with
+# PREFERENCE_STORAGE_MODE=document.
+DDB_CALL_BUDGETS = {
+    "self": 11,
+    "child": 13,
+    "batch": 42,
+    "document_self": 10,
+    "document_batch": 34,
+}
 
 
 def _now_iso():
@@ -24,30 +50,32 @@ def _now_iso():
 
 def _put_version_entry(user_id, pref_key, old_value, new_value, action):
     """
-    Writes an immutable audit record to the PreferenceVersions table.
-    Empty strings are skipped because DynamoDB does not accept them.
+    Writes an immutable audit record to the PreferenceVersions table under the
+    next sequence number for (user, key).
     """
-    timestamp = datetime.utcnow().isoformat(timespec="milliseconds") + "Z"
-
-    item = {
-        "userId": user_id,
-        "preferenceKey_ts": f"{pref_key}#{timestamp}",
-        "preferenceKey": pref_key,
-        "timestamp": timestamp,
-        "action": action,
-    }
-
-    if old_value not in (None, ""):
-        item["oldValue"] = old_value
-
-    if new_value not in (None, ""):
-        item["newValue"] = new_value
+    item = record_version(versions_table, user_id, pref_key, old_value, new_value, action)
 
     print(
         f"[PreferenceVersions] action={action} userId={user_id} key={pref_key} "
-        f"old={old_value} new={new_value}"
+        f"version={item['version']} old={old_value} new={new_value}"
     )
-    versions_table.put_item(Item=item)
+
+
+def _refresh_effective_view(user_id, items, user_ctx, computed_at):
+    """Rebuilds the user's EffectivePreferences item from the state just written."""
+    if effective_view is None or user_ctx is None:
+        return
+    with span("effective_view.refresh"):
+        effective_view.refresh(user_id, items, user_ctx, computed_at)
+
+
+def _prefers(event, preference):
+    """Whether the RFC 7240 ``Prefer`` header asks for ``preference``."""
+    for name, value in (event.get("headers") or {}).items():
+        if name.lower() == "prefer":
+            tokens = [token.strip().split("=")[0].lower() for token in str(value).replace(";", ",").split(",")]
+            return preference in tokens
+    return False
 
 
 def _log_block(user_id, pref_key, actor_id, reason):
@@ -79,6 +107,7 @@ def _get_user(user_id):
     return resp.get("Item")
 
 
+@traced("auth.ensure_actor_can_manage_child")
 def _ensure_actor_can_manage_child(actor_id, child_id):
     actor = _get_user(actor_id)
     if not actor:
@@ -115,6 +144,8 @@ def _resolve_target_user(event, caller_user_id):
     raise ValueError("userId is required")
 
 
+@instrument_handler("set_user_preferences")
+@idempotent(idempotency_store, "set_user_preferences")
 def handler(event, context):
     """
     SET /preferences/{userId}
@@ -142,6 +173,15 @@ def handler(event, context):
          "voice_chat_enabled": "true",
          "language": "en"
        }
+
+    With ``Prefer: respond-async`` (and PREFERENCE_WRITE_QUEUE configured) the
+    change is queued and 202 is returned; ApplyQueuedWritesFunction validates and
+    writes it later, coalesced with other queued updates. ``Prefer: coalesce``
+    (and PENDING_WRITES_TABLE) holds the value for the coalescing window instead,
+    so rapid updates to a key end up as one write and one version row.
+
+    With PREFERENCE_OUTBOX_TABLE configured, a ``PreferencesChanged`` event is
+    recorded in the same transaction as the change (see ``lib.outbox``).
     """
     print("Incoming event:", json.dumps(event))
 
@@ -244,7 +284,61 @@ def handler(event, context):
                 "body": json.dumps({"error": "No preferences to save"}),
             }
 
-        # 4. Write to DynamoDB (simple upsert)
+        if outbox is not None and len(prefs_to_save) > MAX_CHANGES_PER_EVENT:
+            return {
+                "statusCode": 400,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps({"error": f"At most {MAX_CHANGES_PER_EVENT} preferences per request"}),
+            }
+
+        # 4. Coalescing / asynchronous modes: hand the change to the batch worker and return 202
+        coalescing = write_coalescer is not None and _prefers(event, "coalesce")
+        if coalescing or (write_queue is not None and _prefers(event, "respond-async")):
+            accepted = [pref for pref in prefs_to_save if pref.get("preferenceKey")]
+            if not accepted:
+                return {
+                    "statusCode": 400,
+                    "headers": {"Content-Type": "application/json"},
+                    "body": json.dumps({"error": "No preferences to save"}),
+                }
+            if coalescing:
+                with span("write_coalescer.stage"):
+                    write_coalescer.stage(
+                        user_id,
+                        caller_user_id,
+                        [(pref["preferenceKey"], pref.get("value")) for pref in accepted],
+                        _now_iso(),
+                    )
+                return {
+                    "statusCode": 202,
+                    "headers": {"Content-Type": "application/json", "Preference-Applied": "coalesce"},
+                    "body": json.dumps(
+                        {
+                            "status": "coalescing",
+                            "windowMs": write_coalescer.window_ms,
+                            "preferenceKeys": [pref["preferenceKey"] for pref in accepted],
+                        }
+                    ),
+                }
+            message = new_message(user_id, caller_user_id, _now_iso(), accepted)
+            with span("write_queue.send"):
+                write_queue.send([message])
+            return {
+                "statusCode": 202,
+                "headers": {"Content-Type": "application/json", "Preference-Applied": "respond-async"},
+                "body": json.dumps(
+                    {
+                        "status": "accepted",
+                        "messageId": message["messageId"],
+                        "preferenceKeys": [pref["preferenceKey"] for pref in accepted],
+                    }
+                ),
+            }
+
+        # 5. Validate and stage every change, then write them together
+        session = preference_store.session(user_id)
+        changes = []
+        user_ctx = None
         for pref in prefs_to_save:
             pref_key = pref.get("preferenceKey")
             value = pref.get("value")
@@ -254,9 +348,7 @@ def handler(event, context):
                 print(f"Skipping preference without key: {pref}")
                 continue
 
-            existing_item = preferences_table.get_item(
-                Key={"userId": user_id, "preferenceKey": pref_key}
-            ).get("Item")
+            existing_item = session.current(pref_key)
 
             schema = get_managed_preference(pref_key)
             user_ctx = build_user_context(user_id)
@@ -281,9 +373,27 @@ def handler(event, context):
             }
 
             print("Putting item:", item)
-            preferences_table.put_item(Item=item)
+            session.put(item)
 
             old_value = existing_item.get("value") if existing_item else None
+            changes.append((pref_key, old_value, stored_value))
+
+        # The change event is written in the same transaction (no publish call here).
+        outbox_items = None
+        if outbox is not None and changes:
+            event_record = build_event(user_id, caller_user_id, "UPSERT", [change(*entry) for entry in changes])
+            outbox_items = outbox.transact_items(event_record)
+
+        try:
+            session.commit(with_items=outbox_items)
+        except ConcurrentPreferenceUpdate as conflict:
+            return {
+                "statusCode": 409,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps({"error": f"{conflict}; retry the request"}),
+            }
+
+        for pref_key, old_value, stored_value in changes:
             _put_version_entry(
                 user_id=user_id,
                 pref_key=pref_key,
@@ -292,16 +402,18 @@ def handler(event, context):
                 action="UPSERT",
             )
 
-        # 5. Read back all prefs for this user (return current state)
-        response = preferences_table.query(
-            KeyConditionExpression=Key("userId").eq(user_id)
-        )
-        items = response.get("Items", [])
+        # 6. Return the current state (read back, or the written document)
+        computed_at = _now_iso()
+        items = session.items()
+        _refresh_effective_view(user_id, items, user_ctx, computed_at)
+
+        with span("serialize"):
+            body = json.dumps(items)
 
         return {
             "statusCode": 200,
             "headers": {"Content-Type": "application/json"},
-            "body": json.dumps(items),
+            "body": body,
         }
 
     except Exception as e:
@@ -0,0 +1,140 @@
+"""
+Moves PreferenceVersions rows of completed months into the cold archive
+(see ``lib.version_archive``).
+
+For every user the job reads the rows written before the start of the month
+``--lag-days`` ago that are not archived yet, merges them into the per-month
+blobs and then marks each row with ``archivedAt`` and its ``expiresAt`` TTL.
+Blobs are merged by sort key, so a run interrupted between the two steps is
+completed by the next one. Counter and checkpoint rows are never archived.
+
+    cd backend
+    VERSION_ARCHIVE_LOCATION=s3://bucket/prefix \\
+        python -m jobs.archive_preference_versions --segments 8 --workers 4 --retention-days 90
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from boto3.dynamodb.conditions import Key
+
+from lib.ddb_metrics import instrument_table
+from lib.preference_versions import USER_TIME_INDEX
+from lib.scan_engine import ThreadLocalDynamoDB, scan_items
+from lib.version_archive import RETENTION_DAYS, expires_at, month_of, not_archived, open_version_archive
+
+
+def archive_cutoff(lag_days: float, now: Optional[datetime] = None) -> str:
+    """Start of the month ``lag_days`` ago; rows before it belong to completed months."""
+    moment = (now or datetime.now(timezone.utc)) - timedelta(days=lag_days)
+    return f"{moment:%Y-%m}-01T00:00:00.000Z"
+
+
+def _unarchived_rows(versions_table, user_id: str, cutoff: str) -> List[Dict[str, Any]]:
+    params = {
+        "IndexName": USER_TIME_INDEX,
+        "KeyConditionExpression": Key("userId").eq(user_id) & Key("timestamp").lt(cutoff),
+        "FilterExpression": not_archived(),
+    }
+    rows = []
+    while True:
+        response = versions_table.query(**params)
+        rows.extend(response.get("Items", []))
+        start_key = response.get("LastEvaluatedKey")
+        if not start_key:
+            return rows
+        params["ExclusiveStartKey"] = start_key
+
+
+def archive_user(versions_table, archive, user_id: str, cutoff: str, retention_days: int) -> Dict[str, int]:
+    stats = {"rows": 0, "months": 0}
+    by_month: Dict[str, List[Dict[str, Any]]] = {}
+    for row in _unarchived_rows(versions_table, user_id, cutoff):
+        by_month.setdefault(month_of(row["timestamp"]), []).append(row)
+
+    archived_at = datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
+    for month, rows in sorted(by_month.items()):
+        archive.write_month(user_id, month, rows)
+        for row in rows:
+            # Rows that TTL removed after the query fail the condition and are skipped.
+            try:
+                versions_table.update_item(
+                    Key={"userId": row["userId"], "preferenceKey_ts": row["preferenceKey_ts"]},
+                    UpdateExpression="SET archivedAt = :at, expiresAt = :exp",
+                    ConditionExpression="attribute_exists(preferenceKey_ts)",
+                    ExpressionAttributeValues={
+                        ":at": archived_at,
+                        ":exp": expires_at(row["timestamp"], retention_days),
+                    },
+                )
+            except versions_table.meta.client.exceptions.ConditionalCheckFailedException:
+                continue
+        stats["rows"] += len(rows)
+        stats["months"] += 1
+    return stats
+
+
+def run(
+    users_table,
+    versions_table,
+    archive,
+    total_segments: int = 4,
+    workers: int = 4,
+    lag_days: float = 1,
+    retention_days: int = RETENTION_DAYS,
+) -> Dict[str, Any]:
+    started = time.perf_counter()
+    cutoff = archive_cutoff(lag_days)
+
+    def archive_segment(segment: int) -> Dict[str, int]:
+        stats = {"users": 0, "rows": 0, "months": 0}
+        users = scan_items(
+            users_table, total_segments=total_segments, segments=[segment], max_workers=1, projection=["userId"]
+        )
+        for user in users:
+            stats["users"] += 1
+            for key, value in archive_user(versions_table, archive, user["userId"], cutoff, retention_days).items():
+                stats[key] += value
+        return stats
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(archive_segment, range(total_segments)))
+    report: Dict[str, Any] = {"cutoff": cutoff, "retentionDays": retention_days}
+    for key in ("users", "rows", "months"):
+        report[key] = sum(result[key] for result in results)
+    report["elapsedSec"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--location", default=os.environ.get("VERSION_ARCHIVE_LOCATION"))
+    parser.add_argument("--segments", type=int, default=4, help="TotalSegments of the Users scan")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--lag-days", type=float, default=1, help="archive months that ended at least this long ago")
+    parser.add_argument("--retention-days", type=int, default=RETENTION_DAYS, help="TTL of archived rows")
+    args = parser.parse_args(argv)
+    if not args.location:
+        parser.error("--location or VERSION_ARCHIVE_LOCATION is required")
+
+    # The segment workers write from their own threads.
+    dynamodb = ThreadLocalDynamoDB()
+    report = run(
+        instrument_table(dynamodb.Table(os.environ["USERS_TABLE"])),
+        instrument_table(dynamodb.Table(os.environ["PREFERENCE_VERSIONS_TABLE"])),
+        open_version_archive(args.location),
+        total_segments=args.segments,
+        workers=args.workers,
+        lag_days=args.lag_days,
+        retention_days=args.retention_days,
+    )
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Adds the ``userAction`` / ``keyAction`` / ``userKey`` index attributes to
+PreferenceVersions rows written before those indexes existed (see
+``lib.preference_versions``).
+
+Rows without ``preferenceKey`` or ``action`` are skipped; already backfilled rows
+are left untouched, so the job can be rerun safely.
+
+    cd backend
+    python -m jobs.backfill_version_indexes --segments 8
+"""
+
+import argparse
+import json
+import os
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+
+from lib.ddb_metrics import instrument_table
+from lib.preference_versions import index_attributes
+from lib.scan_engine import scan_items
+
+
+def backfill(table, total_segments: int = 4) -> dict:
+    stats = {"scanned": 0, "updated": 0}
+    rows = scan_items(
+        table,
+        total_segments=total_segments,
+        projection=["userId", "preferenceKey_ts", "preferenceKey", "action"],
+        FilterExpression=Attr("userKey").not_exists() & Attr("action").exists(),
+    )
+    for row in rows:
+        stats["scanned"] += 1
+        if not row.get("preferenceKey"):
+            continue
+        attributes = index_attributes(row["userId"], row["preferenceKey"], row["action"])
+        table.update_item(
+            Key={"userId": row["userId"], "preferenceKey_ts": row["preferenceKey_ts"]},
+            UpdateExpression="SET userAction = :ua, keyAction = :ka, userKey = :uk",
+            ExpressionAttributeValues={
+                ":ua": attributes["userAction"],
+                ":ka": attributes["keyAction"],
+                ":uk": attributes["userKey"],
+            },
+        )
+        stats["updated"] += 1
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--segments", type=int, default=4)
+    args = parser.parse_args(argv)
+    table = instrument_table(boto3.resource("dynamodb").Table(os.environ["PREFERENCE_VERSIONS_TABLE"]))
+    print(json.dumps(backfill(table, args.segments)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Writes per-user preference checkpoints for point-in-time reconstruction
+(see ``lib.preference_checkpoints``).
+
+For every user the job reconstructs the preferences at ``now - --lag-seconds``
+from the previous checkpoint plus the versions written since, and stores the
+result as a new checkpoint when at least ``--min-new-versions`` versions were
+replayed. The lag keeps in-flight writes out of the checkpoint window. Run it on
+a schedule (e.g. daily); the interval bounds how many versions an as-of request
+has to replay.
+
+    cd backend
+    python -m jobs.checkpoint_preference_versions --segments 8 --workers 4
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
+
+
+from lib.ddb_metrics import instrument_table
+from lib.preference_checkpoints import reconstruct, write_checkpoint
+from lib.scan_engine import ThreadLocalDynamoDB, scan_items
+from lib.version_archive import open_version_archive
+
+
+def _cutoff(lag_seconds: float) -> str:
+    moment = datetime.now(timezone.utc) - timedelta(seconds=lag_seconds)
+    return moment.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def checkpoint_segment(
+    users_table, versions_table, segment: int, total_segments: int, as_of: str, min_new_versions: int, archive=None
+) -> Dict[str, int]:
+    stats = {"users": 0, "checkpoints": 0, "replayed": 0}
+    users = scan_items(
+        users_table, total_segments=total_segments, segments=[segment], max_workers=1, projection=["userId"]
+    )
+    for user in users:
+        stats["users"] += 1
+        state = reconstruct(versions_table, user["userId"], as_of, archive)
+        stats["replayed"] += state["replayed"]
+        if state["replayed"] >= min_new_versions:
+            write_checkpoint(versions_table, user["userId"], as_of, state["preferences"])
+            stats["checkpoints"] += 1
+    return stats
+
+
+def run(
+    users_table,
+    versions_table,
+    total_segments: int = 4,
+    workers: int = 4,
+    lag_seconds: float = 60,
+    min_new_versions: int = 1,
+    archive=None,
+) -> Dict[str, Any]:
+    started = time.perf_counter()
+    as_of = _cutoff(lag_seconds)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(
+            pool.map(
+                lambda segment: checkpoint_segment(
+                    users_table, versions_table, segment, total_segments, as_of, min_new_versions, archive
+                ),
+                range(total_segments),
+            )
+        )
+    report: Dict[str, Any] = {"asOf": as_of}
+    for key in ("users", "checkpoints", "replayed"):
+        report[key] = sum(result[key] for result in results)
+    report["elapsedSec"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--segments", type=int, default=4, help="TotalSegments of the Users scan")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--lag-seconds", type=float, default=60, help="checkpoint at now minus this lag")
+    parser.add_argument(
+        "--min-new-versions", type=int, default=1, help="skip users with fewer new versions since their last checkpoint"
+    )
+    args = parser.parse_args(argv)
+
+    # The segment workers write from their own threads.
+    dynamodb = ThreadLocalDynamoDB()
+    users_table = instrument_table(dynamodb.Table(os.environ["USERS_TABLE"]))
+    versions_table = instrument_table(dynamodb.Table(os.environ["PREFERENCE_VERSIONS_TABLE"]))
+    report = run(
+        users_table,
+        versions_table,
+        total_segments=args.segments,
+        workers=args.workers,
+        lag_seconds=args.lag_seconds,
+        min_new_versions=args.min_new_versions,
+        archive=open_version_archive(),
+    )
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
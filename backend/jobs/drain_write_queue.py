@@ -0,0 +1,96 @@
+"""
+Drains the asynchronous write queue (see ``lib.write_queue`` and
+``lib.queued_writes``) in batches of ``--batch-size`` messages until it is empty.
+
+In AWS the queue feeds ApplyQueuedWritesFunction. This job serves the local
+directory stand-in, and can also catch up an SQS queue by hand. A batch is acked
+only after it was applied, so an interrupted run re-applies at most the batch
+in flight. ``--sweep-pending`` first queues a flush for every pending row of the
+coalescing window (``lib.write_coalescing``), e.g. after a lost flush message.
+
+    cd backend
+    PREFERENCE_WRITE_QUEUE=../queued-writes python -m jobs.drain_write_queue --batch-size 200
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+import boto3
+
+from lib.ddb_metrics import instrument_client, instrument_table
+from lib.outbox import open_outbox
+from lib.preference_store import open_preference_store
+from lib.queued_writes import apply_queued_writes
+from lib.write_coalescing import open_write_coalescer
+from lib.write_queue import open_write_queue
+
+
+def run(
+    queue,
+    store,
+    client,
+    versions_table,
+    effective_table_name: Optional[str] = None,
+    batch_size: int = 100,
+    max_batches: Optional[int] = None,
+    coalescer=None,
+    sweep_pending: bool = False,
+    outbox=None,
+) -> Dict[str, Any]:
+    started = time.perf_counter()
+    totals = {"batches": 0, "messages": 0, "updates": 0, "written": 0, "blocked": 0, "superseded": 0}
+    if sweep_pending and coalescer is not None:
+        totals["swept"] = coalescer.sweep()
+    while max_batches is None or totals["batches"] < max_batches:
+        received = queue.receive(batch_size)
+        if not received:
+            break
+        report = apply_queued_writes(
+            [message["body"] for message in received],
+            store,
+            client,
+            versions_table,
+            effective_table_name=effective_table_name,
+            coalescer=coalescer,
+            outbox=outbox,
+        )
+        queue.ack(message["receipt"] for message in received)
+        totals["batches"] += 1
+        for name, value in report.items():
+            totals[name] = totals.get(name, 0) + value
+    totals["elapsedSec"] = round(time.perf_counter() - started, 3)
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queue", default=os.environ.get("PREFERENCE_WRITE_QUEUE"), help="queue URL or directory")
+    parser.add_argument("--batch-size", type=int, default=100, help="messages coalesced per batch")
+    parser.add_argument("--max-batches", type=int, help="stop after this many batches")
+    parser.add_argument("--sweep-pending", action="store_true", help="flush every pending coalesced write first")
+    args = parser.parse_args(argv)
+    if not args.queue:
+        parser.error("--queue or PREFERENCE_WRITE_QUEUE is required")
+
+    dynamodb = boto3.resource("dynamodb")
+    queue = open_write_queue(args.queue)
+    report = run(
+        queue,
+        open_preference_store(dynamodb, instrument_table(dynamodb.Table(os.environ["PREFERENCES_TABLE"]))),
+        instrument_client(dynamodb.meta.client),
+        instrument_table(dynamodb.Table(os.environ["PREFERENCE_VERSIONS_TABLE"])),
+        effective_table_name=os.environ.get("EFFECTIVE_PREFERENCES_TABLE"),
+        batch_size=args.batch_size,
+        max_batches=args.max_batches,
+        coalescer=open_write_coalescer(dynamodb, queue),
+        sweep_pending=args.sweep_pending,
+        outbox=open_outbox(dynamodb),
+    )
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Parallel-segment streaming export of the Preferences table.
+
+The table is scanned with ``TotalSegments`` parallel segments on worker threads
+(``lib.scan_engine``) and every page is streamed straight into gzip NDJSON or
+CSV shards (``part-<segment>-<n>.<fmt>.gz``) so memory is bounded by the scan
+engine's page buffer plus one open shard file per segment. Shards are cut on page boundaries and the segment's
+LastEvaluatedKey is checkpointed after each upload, so ``--resume`` continues
+every unfinished segment from its last shard without duplicating rows.
+
+Consumed read capacity is capped with a token bucket shared by all workers
+(``--max-rcu``, units per second). The destination is a local directory or an
+``s3://bucket/prefix`` location (see ``lib.object_store``).
+
+    cd backend
+    python -m jobs.export_preferences ../export --segments 16 --workers 8 --max-rcu 500
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import boto3
+from botocore.config import Config
+
+from lib.ddb_metrics import instrument_table
+from lib.object_store import open_object_store
+from lib.preference_store import storage_mode
+from lib.preferences_resolver import _normalize_value
+from lib.scan_engine import scan_pages
+
+CHECKPOINT_KEY = "_checkpoint.json"
+MANIFEST_KEY = "_manifest.json"
+DEFAULT_COLUMNS = ("userId", "preferenceKey", "value", "updatedAt")
+
+
+def _now_iso():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
+
+
+def _plain(value):
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, set)):
+        return [_plain(v) for v in value]
+    return _normalize_value(value)
+
+
+class CapacityLimiter:
+    """Token bucket over consumed read capacity units, shared by all workers."""
+
+    def __init__(self, units_per_second: Optional[float]):
+        self.rate = units_per_second
+        self.tokens = units_per_second or 0.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, units: float):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= units
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+
+class ShardWriter:
+    """Gzip NDJSON / CSV shard written to a temp file, then uploaded."""
+
+    def __init__(self, fmt: str, columns: List[str]):
+        self.fmt = fmt
+        self.columns = columns
+        handle, self.path = tempfile.mkstemp(suffix=f".{fmt}.gz")
+        os.close(handle)
+        self._fh = io.TextIOWrapper(gzip.open(self.path, "wb"), encoding="utf-8", newline="")
+        self._csv = None
+        if fmt == "csv":
+            self._csv = csv.DictWriter(self._fh, fieldnames=columns, extrasaction="ignore")
+            self._csv.writeheader()
+        self.rows = 0
+
+    def write(self, row: Dict[str, Any]):
+        if self._csv is not None:
+            self._csv.writerow({k: v if not isinstance(v, (dict, list)) else json.dumps(v) for k, v in row.items()})
+        else:
+            self._fh.write(json.dumps(row, separators=(",", ":")) + "\n")
+        self.rows += 1
+
+    def close(self):
+        self._fh.close()
+
+    def discard(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Checkpoint:
+    """Per-segment progress, persisted in the destination store."""
+
+    def __init__(self, store, params: Dict[str, Any]):
+        self.store = store
+        self.params = params
+        self.segments: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        raw = self.store.get_bytes(CHECKPOINT_KEY)
+        if raw is None:
+            return
+        data = json.loads(raw)
+        if data.get("params") != self.params:
+            raise ValueError(f"Checkpoint was written with different parameters: {data.get('params')}")
+        self.segments = data.get("segments") or {}
+
+    def exists(self) -> bool:
+        return self.store.get_bytes(CHECKPOINT_KEY) is not None
+
+    def segment(self, segment: int) -> Dict[str, Any]:
+        with self._lock:
+            state = self.segments.get(str(segment)) or {"part": 0, "rows": 0, "shards": []}
+            return {**state, "shards": list(state["shards"])}
+
+    def update(self, segment: int, state: Dict[str, Any]):
+        with self._lock:
+            self.segments[str(segment)] = {**state, "shards": list(state["shards"])}
+            payload = json.dumps({"params": self.params, "updatedAt": _now_iso(), "segments": self.segments})
+            self.store.put_bytes(CHECKPOINT_KEY, payload.encode("utf-8"))
+
+
+class Exporter:
+    def __init__(
+        self,
+        store,
+        table_name: str,
+        total_segments: int = 8,
+        workers: int = 4,
+        fmt: str = "ndjson",
+        rows_per_shard: int = 100000,
+        page_size: Optional[int] = None,
+        max_rcu: Optional[float] = None,
+        attributes: Optional[List[str]] = None,
+    ):
+        self.store = store
+        self.table_name = table_name
+        self.total_segments = total_segments
+        self.workers = max(1, workers)
+        self.fmt = fmt
+        self.rows_per_shard = rows_per_shard
+        self.page_size = page_size
+        self.attributes = attributes
+        self.columns = list(attributes or DEFAULT_COLUMNS)
+        self.limiter = CapacityLimiter(max_rcu)
+        dynamodb = boto3.resource("dynamodb", config=Config(retries={"mode": "adaptive", "max_attempts": 10}))
+        self.table = instrument_table(dynamodb.Table(table_name))
+        self.checkpoint = Checkpoint(
+            store, {"table": table_name, "totalSegments": total_segments, "format": fmt, "attributes": attributes}
+        )
+        self._consumed = 0.0
+
+    def _shard_key(self, segment: int, part: int) -> str:
+        return f"part-{segment:04d}-{part:05d}.{self.fmt}.gz"
+
+    def _finish_shard(self, segment: int, state: Dict[str, Any], writer: ShardWriter, last_key):
+        writer.close()
+        if writer.rows:
+            key = self._shard_key(segment, state["part"])
+            self.store.put_file(key, writer.path)
+            state["shards"].append({"key": key, "rows": writer.rows})
+            state["part"] += 1
+            state["rows"] += writer.rows
+        writer.discard()
+        state["lastEvaluatedKey"] = last_key
+        state["done"] = not last_key
+        self.checkpoint.update(segment, state)
+
+    def run(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        states = {segment: self.checkpoint.segment(segment) for segment in range(self.total_segments)}
+        pending = [segment for segment, state in states.items() if not state.get("done")]
+        writers: Dict[int, ShardWriter] = {}
+        try:
+            # Pages are consumed here, one open shard per segment; the rate limiter
+            # blocks this loop and the scan engine's bounded queue stalls the workers.
+            for page in scan_pages(
+                self.table,
+                total_segments=self.total_segments,
+                max_workers=self.workers,
+                projection=self.attributes,
+                page_size=self.page_size,
+                segments=pending,
+                start_keys={segment: states[segment].get("lastEvaluatedKey") for segment in pending},
+            ):
+                self._consumed += page.consumed_capacity
+                self.limiter.consume(page.consumed_capacity)
+                writer = writers.get(page.segment)
+                if writer is None:
+                    writer = writers[page.segment] = ShardWriter(self.fmt, self.columns)
+                for item in page.items:
+                    writer.write(_plain(item))
+                if page.last_evaluated_key and writer.rows < self.rows_per_shard:
+                    continue
+                self._finish_shard(page.segment, states[page.segment], writers.pop(page.segment), page.last_evaluated_key)
+        finally:
+            for writer in writers.values():
+                writer.discard()
+        elapsed = time.perf_counter() - started
+
+        ordered = [states[segment] for segment in range(self.total_segments)]
+        rows = sum(state["rows"] for state in ordered)
+        manifest = {
+            "table": self.table_name,
+            "format": self.fmt,
+            "columns": self.columns if self.fmt == "csv" else None,
+            "totalSegments": self.total_segments,
+            "rows": rows,
+            "shards": [shard for state in ordered for shard in state["shards"]],
+            "completedAt": _now_iso(),
+        }
+        self.store.put_bytes(MANIFEST_KEY, json.dumps(manifest, indent=2).encode("utf-8"))
+        return {
+            "rows": rows,
+            "shards": len(manifest["shards"]),
+            "consumedRCU": round(self._consumed, 1),
+            "elapsedSec": round(elapsed, 3),
+            "rowsPerSec": round(rows / elapsed, 1) if elapsed else None,
+            "manifest": self.store.url(MANIFEST_KEY),
+        }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("destination", help="local directory or s3://bucket/prefix")
+    parser.add_argument("--table", default=os.environ.get("PREFERENCES_TABLE"))
+    parser.add_argument("--segments", type=int, default=8, help="TotalSegments of the parallel scan")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    parser.add_argument("--rows-per-shard", type=int, default=100000)
+    parser.add_argument("--page-size", type=int, help="scan Limit per request")
+    parser.add_argument("--max-rcu", type=float, help="cap on consumed read capacity units per second")
+    parser.add_argument("--attributes", help="comma-separated projection (also the CSV columns)")
+    parser.add_argument("--resume", action="store_true", help="continue unfinished segments")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.table:
+        raise SystemExit("--table or PREFERENCES_TABLE is required")
+    if storage_mode() == "document":
+        raise SystemExit("The export reads Preferences items, which document mode no longer writes")
+    exporter = Exporter(
+        open_object_store(args.destination),
+        args.table,
+        total_segments=args.segments,
+        workers=args.workers,
+        fmt=args.format,
+        rows_per_shard=args.rows_per_shard,
+        page_size=args.page_size,
+        max_rcu=args.max_rcu,
+        attributes=args.attributes.split(",") if args.attributes else None,
+    )
+    if args.resume:
+        exporter.checkpoint.load()
+    elif exporter.checkpoint.exists():
+        raise SystemExit(f"{args.destination} already holds an export checkpoint; pass --resume")
+    report = exporter.run()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
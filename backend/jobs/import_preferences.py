@@ -0,0 +1,466 @@
+"""
+Streaming bulk import of preferences from CSV or NDJSON files.
+
+Rows carry ``userId``, ``preferenceKey`` and ``value`` (CSV header or JSON fields).
+Every row is validated with the same rules as PUT /preferences
+(``ensure_preference_value_allowed`` against ManagedPreferenceSchema and the
+target user's context) and written with BatchWriteItem. Batches are sent from a
+small thread pool with a bounded number in flight, so memory stays constant
+regardless of file size; unprocessed items and throttling errors are retried with
+exponential backoff.
+
+Progress is checkpointed as the highest input line below which every batch has
+been committed, so an interrupted run resumes with ``--resume``. It re-writes the
+batches submitted after the last checkpoint; Preferences writes are puts, and the
+version numbers allocated for IMPORT rows are saved in the checkpoint before the
+rows are written, so a re-written row reuses its number instead of adding a
+second version.
+
+    cd backend
+    python -m jobs.import_preferences ../studio.csv --workers 8 --write-versions
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import boto3
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+
+from lib.ddb_metrics import instrument_client, instrument_table
+from lib.preference_store import storage_mode
+from lib.preference_versions import build_version_item, next_sequence
+from lib.preferences_resolver import (
+    build_user_context,
+    ensure_preference_value_allowed,
+    load_managed_schema,
+)
+
+BATCH_SIZE = 25
+MAX_ATTEMPTS = 8
+THROTTLE_ERRORS = {
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+}
+
+_serializer = TypeSerializer()
+
+
+def _now_iso():
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def _open_text(path: str):
+    if path.endswith(".gz"):
+        return io.TextIOWrapper(gzip.open(path, "rb"), encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+
+def detect_format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl", ".json")):
+        return "ndjson"
+    raise ValueError(f"Cannot infer input format from {path!r}; pass --format")
+
+
+def iter_rows(path: str, fmt: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Yields ``(line_number, row)`` without reading the whole file into memory."""
+    with _open_text(path) as fh:
+        if fmt == "csv":
+            reader = csv.DictReader(fh)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line_number, line in enumerate(fh, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                row = {"__invalid__": "Invalid JSON"}
+            yield line_number, row if isinstance(row, dict) else {"__invalid__": "Row is not an object"}
+
+
+class _UserContextCache:
+    """Bounded LRU of resolver user contexts (rows are usually grouped by user)."""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def get(self, user_id: str) -> Dict[str, Any]:
+        if user_id in self._entries:
+            self._entries.move_to_end(user_id)
+            return self._entries[user_id]
+        ctx = build_user_context(user_id)
+        self._entries[user_id] = ctx
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return ctx
+
+
+def load_schema_index() -> Dict[str, Dict[str, Any]]:
+    schema = {}
+    for item in load_managed_schema():
+        key = item.get("preferenceKey")
+        if key and key not in schema:
+            schema[key] = item
+    return schema
+
+
+class Checkpoint:
+    def __init__(self, path: Optional[str], source: str):
+        self.path = path
+        self.source = os.path.abspath(source)
+        self.committed_line = 0
+        self.stats: Dict[str, int] = {}
+        # Version numbers allocated for input lines not yet committed.
+        self.sequences: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not (self.path and os.path.exists(self.path)):
+            return
+        with open(self.path, encoding="utf-8") as fh:
+            data = json.load(fh)
+        if data.get("source") != self.source:
+            raise ValueError(f"Checkpoint {self.path} belongs to {data.get('source')}")
+        self.committed_line = int(data.get("committedLine", 0))
+        self.stats = data.get("stats") or {}
+        self.sequences = {line: int(sequence) for line, sequence in (data.get("sequences") or {}).items()}
+
+    def sequence_for(self, line: int) -> Optional[int]:
+        with self._lock:
+            return self.sequences.get(str(line))
+
+    def record_sequences(self, sequences: Dict[int, int]):
+        """Persists version numbers allocated for input lines before their rows are written."""
+        with self._lock:
+            self.sequences.update({str(line): sequence for line, sequence in sequences.items()})
+            self._write(done=False)
+
+    def save(self, committed_line: int, stats: Dict[str, int], done: bool = False):
+        with self._lock:
+            self.committed_line = committed_line
+            self.stats = dict(stats)
+            self.sequences = {line: seq for line, seq in self.sequences.items() if int(line) > committed_line}
+            self._write(done)
+
+    def _write(self, done: bool):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(
+                {
+                    "source": self.source,
+                    "committedLine": self.committed_line,
+                    "done": done,
+                    "updatedAt": _now_iso(),
+                    "stats": self.stats,
+                    "sequences": self.sequences,
+                },
+                fh,
+            )
+        os.replace(tmp_path, self.path)
+
+
+class BatchWriter:
+    """BatchWriteItem with retry of unprocessed items and throttling back-off."""
+
+    def __init__(self, client, base_delay: float = 0.05, max_delay: float = 5.0):
+        self.client = client
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def _backoff(self, attempt: int):
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        time.sleep(random.uniform(0, delay))
+
+    def write(self, request_items: Dict[str, List[Dict[str, Any]]]):
+        pending = request_items
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                response = self.client.batch_write_item(RequestItems=pending)
+            except ClientError as err:
+                if err.response.get("Error", {}).get("Code") not in THROTTLE_ERRORS:
+                    raise
+                with self._lock:
+                    self.throttled += 1
+                self._backoff(attempt)
+                continue
+            pending = response.get("UnprocessedItems") or {}
+            if not pending:
+                return
+            with self._lock:
+                self.throttled += 1
+            self._backoff(attempt)
+        raise RuntimeError(f"Batch still unprocessed after {MAX_ATTEMPTS} attempts")
+
+
+def _stored_value(value: Any) -> str:
+    return str(value) if value is not None else ""
+
+
+def _put_request(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {"PutRequest": {"Item": {k: _serializer.serialize(v) for k, v in item.items()}}}
+
+
+class Importer:
+    def __init__(
+        self,
+        preferences_table: str,
+        versions_table: Optional[str],
+        workers: int = 4,
+        checkpoint_every: int = 20,
+        rejects_path: Optional[str] = None,
+        effective_table: Optional[str] = None,
+    ):
+        self.preferences_table = preferences_table
+        self.versions_table = versions_table
+        self.effective_table = effective_table
+        self.workers = max(1, workers)
+        self.checkpoint_every = checkpoint_every
+        self.rejects_path = rejects_path
+        self.writer = BatchWriter(instrument_client(boto3.client("dynamodb")))
+        self._local = threading.local()
+        self.checkpoint: Optional[Checkpoint] = None
+        self.schema = load_schema_index()
+        self.contexts = _UserContextCache()
+        self.stats = {"read": 0, "imported": 0, "rejected": 0, "invalid": 0, "skipped": 0, "batches": 0}
+
+    def _validate(self, row: Dict[str, Any]) -> Optional[str]:
+        if "__invalid__" in row:
+            return row["__invalid__"]
+        if not row.get("userId") or not row.get("preferenceKey"):
+            return "userId and preferenceKey are required"
+        if "value" not in row:
+            return "value is required"
+        schema = self.schema.get(row["preferenceKey"]) or {}
+        try:
+            ensure_preference_value_allowed(schema, self.contexts.get(row["userId"]), row["value"])
+        except PermissionError as rule_err:
+            return str(rule_err)
+        return None
+
+    def _preference_requests(self, rows: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+        timestamp = _now_iso()
+        return {
+            self.preferences_table: [
+                _put_request(
+                    {
+                        "userId": row["userId"],
+                        "preferenceKey": row["preferenceKey"],
+                        "value": _stored_value(row["value"]),
+                        "updatedAt": timestamp,
+                    }
+                )
+                for row in rows
+            ]
+        }
+
+    def _sequence_table(self):
+        # boto3 resources are not thread-safe; one per writer thread.
+        table = getattr(self._local, "versions", None)
+        if table is None:
+            table = self._local.versions = instrument_table(boto3.resource("dynamodb").Table(self.versions_table))
+        return table
+
+    def _version_requests(self, entries: List[Tuple[int, Dict[str, Any]]]) -> Dict[str, List[Dict[str, Any]]]:
+        # The import is a blind write, so IMPORT entries carry only the new value.
+        # Sequence numbers are allocated one by one (atomic ADD) unless a previous
+        # attempt at the same line already did; they are checkpointed before the
+        # rows are batch-written.
+        timestamp = _now_iso()
+        table = self._sequence_table()
+        requests = []
+        allocated = {}
+        for line, row in entries:
+            sequence = self.checkpoint.sequence_for(line) if self.checkpoint else None
+            if sequence is None:
+                sequence = allocated[line] = next_sequence(table, row["userId"], row["preferenceKey"])
+            item = build_version_item(
+                row["userId"], row["preferenceKey"], None, _stored_value(row["value"]), "IMPORT", sequence, timestamp
+            )
+            requests.append(_put_request(item))
+        if allocated and self.checkpoint:
+            self.checkpoint.record_sequences(allocated)
+        return {self.versions_table: requests}
+
+    def _view_invalidations(self, rows: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+        # Materialized effective preferences of imported users are rebuilt on next read.
+        user_ids = sorted({row["userId"] for row in rows})
+        return {
+            self.effective_table: [
+                {"DeleteRequest": {"Key": {"userId": _serializer.serialize(user_id)}}} for user_id in user_ids
+            ]
+        }
+
+    def _write_batch(self, entries: List[Tuple[int, Dict[str, Any]]]):
+        rows = [row for _, row in entries]
+        self.writer.write(self._preference_requests(rows))
+        if self.versions_table:
+            self.writer.write(self._version_requests(entries))
+        if self.effective_table:
+            self.writer.write(self._view_invalidations(rows))
+
+    def run(self, rows: Iterator[Tuple[int, Dict[str, Any]]], checkpoint: Checkpoint) -> Dict[str, Any]:
+        started = time.perf_counter()
+        if checkpoint.stats:
+            self.stats.update({k: v for k, v in checkpoint.stats.items() if k in self.stats})
+        resume_after = checkpoint.committed_line
+        self.checkpoint = checkpoint
+        rejects = open(self.rejects_path, "a", encoding="utf-8") if self.rejects_path else None
+
+        # (last input line, future, keys) per submitted batch, in submission order.
+        # Keys of in-flight batches are tracked so that a later write to the same
+        # (userId, preferenceKey) waits for the earlier one instead of racing it.
+        in_flight: "deque[Tuple[int, Any, List[Tuple[str, str]]]]" = deque()
+        in_flight_keys: Dict[Tuple[str, str], int] = {}
+        max_in_flight = self.workers * 2
+        committed_line = resume_after
+        batches_since_checkpoint = 0
+
+        def drain(block_until: int, wait_for_key=None):
+            nonlocal committed_line, batches_since_checkpoint
+            while in_flight and (
+                len(in_flight) > block_until
+                or in_flight[0][1].done()
+                or (wait_for_key is not None and wait_for_key in in_flight_keys)
+            ):
+                last_line, future, keys = in_flight.popleft()
+                future.result()
+                for key in keys:
+                    in_flight_keys[key] -= 1
+                    if not in_flight_keys[key]:
+                        del in_flight_keys[key]
+                committed_line = max(committed_line, last_line)
+                batches_since_checkpoint += 1
+            if batches_since_checkpoint >= self.checkpoint_every:
+                checkpoint.save(committed_line, self.stats)
+                batches_since_checkpoint = 0
+
+        batch: "OrderedDict[Tuple[str, str], Tuple[int, Dict[str, Any]]]" = OrderedDict()
+        batch_last_line = resume_after
+        last_line = resume_after
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+
+                def submit():
+                    nonlocal batch
+                    rows_to_write = list(batch.values())  # (line, row)
+                    self.stats["imported"] += len(rows_to_write)
+                    self.stats["batches"] += 1
+                    keys = list(batch)
+                    for key in keys:
+                        in_flight_keys[key] = in_flight_keys.get(key, 0) + 1
+                    in_flight.append((batch_last_line, pool.submit(self._write_batch, rows_to_write), keys))
+                    batch = OrderedDict()
+                    drain(max_in_flight)
+
+                for line_number, row in rows:
+                    if line_number <= resume_after:
+                        continue
+                    self.stats["read"] += 1
+                    last_line = line_number
+                    reason = self._validate(row)
+                    if reason:
+                        self.stats["invalid" if "__invalid__" in row else "rejected"] += 1
+                        if rejects:
+                            rejects.write(json.dumps({"line": line_number, "reason": reason, "row": row}) + "\n")
+                        continue
+                    key = (row["userId"], row["preferenceKey"])
+                    if key in batch:
+                        # BatchWriteItem rejects duplicate keys: flush what we have first.
+                        submit()
+                    if key in in_flight_keys:
+                        drain(max_in_flight, wait_for_key=key)
+                    batch[key] = (line_number, row)
+                    batch_last_line = line_number
+                    if len(batch) >= BATCH_SIZE:
+                        submit()
+
+                if batch:
+                    submit()
+                drain(0)
+        finally:
+            if rejects:
+                rejects.close()
+
+        checkpoint.save(max(committed_line, last_line), self.stats, done=True)
+        elapsed = time.perf_counter() - started
+        return {
+            **self.stats,
+            "throttledRetries": self.writer.throttled,
+            "elapsedSec": round(elapsed, 3),
+            "rowsPerSec": round(self.stats["read"] / elapsed, 1) if elapsed else None,
+            "resumedAfterLine": resume_after,
+        }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="local CSV / NDJSON file (optionally .gz)")
+    parser.add_argument("--format", choices=("csv", "ndjson"))
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <source>.checkpoint.json)")
+    parser.add_argument("--resume", action="store_true", help="continue from the checkpoint")
+    parser.add_argument("--checkpoint-every", type=int, default=20, help="batches between checkpoints")
+    parser.add_argument("--rejects", help="append rejected rows (NDJSON) to this file")
+    parser.add_argument("--write-versions", action="store_true", help="also write IMPORT entries to PreferenceVersions")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    mode = storage_mode()
+    if mode == "document":
+        raise SystemExit("The import writes Preferences items; run it with PREFERENCE_STORAGE_MODE=items or dual")
+    fmt = args.format or detect_format(args.source)
+    checkpoint = Checkpoint(args.checkpoint or f"{args.source}.checkpoint.json", args.source)
+    if args.resume:
+        checkpoint.load()
+    elif checkpoint.path and os.path.exists(checkpoint.path):
+        raise SystemExit(f"Checkpoint {checkpoint.path} exists; pass --resume or remove it")
+
+    importer = Importer(
+        preferences_table=os.environ["PREFERENCES_TABLE"],
+        versions_table=os.environ["PREFERENCE_VERSIONS_TABLE"] if args.write_versions else None,
+        workers=args.workers,
+        checkpoint_every=args.checkpoint_every,
+        rejects_path=args.rejects,
+        effective_table=os.environ.get("EFFECTIVE_PREFERENCES_TABLE"),
+    )
+    report = importer.run(iter_rows(args.source, fmt), checkpoint)
+    print(json.dumps(report, indent=2))
+    if mode == "dual":
+        print(
+            "Documents of imported users are stale; refresh them with "
+            "python -m jobs.migrate_preference_documents --overwrite",
+            file=sys.stderr,
+        )
+    if report["rejected"] or report["invalid"]:
+        print(f"{report['rejected'] + report['invalid']} rows were not imported", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
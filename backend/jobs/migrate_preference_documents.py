@@ -0,0 +1,123 @@
+"""
+Copies Preferences items into per-user PreferenceDocuments items
+(see ``lib.preference_store``).
+
+Roll-out: deploy with ``PREFERENCE_STORAGE_MODE=dual`` (items stay authoritative and
+migrated documents are kept in step), run this job, check it with ``--verify``,
+then switch to ``document``. Keys a dual-mode write already put into a document
+are kept, so the job can run while traffic is live; ``--overwrite`` rebuilds
+documents from the items instead (e.g. after a bulk import in dual mode).
+
+    cd backend
+    python -m jobs.migrate_preference_documents --segments 8 --workers 4
+    python -m jobs.migrate_preference_documents --verify
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+
+from lib.ddb_metrics import instrument_table
+from lib.preference_store import PreferenceStore, document_items
+from lib.scan_engine import ThreadLocalDynamoDB, scan_items
+
+# Users listed per mismatch in the --verify report.
+_MISMATCH_SAMPLE = 20
+
+
+def _comparable(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {item["preferenceKey"]: (item.get("value"), item.get("updatedAt")) for item in items}
+
+
+def migrate_user(store: PreferenceStore, user_id: str, overwrite: bool = False) -> int:
+    """Merges the user's items into their document; returns the number of keys copied."""
+    items = _user_items(store, user_id)
+    if not items and not overwrite:
+        return 0
+    return store.merge_document(user_id, items, overwrite=overwrite)
+
+
+def verify_user(store: PreferenceStore, user_id: str) -> bool:
+    """True when the user's document holds exactly their items."""
+    document = store.documents_table.get_item(Key={"userId": user_id}).get("Item")
+    return _comparable(document_items(user_id, document)) == _comparable(_user_items(store, user_id))
+
+
+def _user_items(store: PreferenceStore, user_id: str) -> List[Dict[str, Any]]:
+    return PreferenceStore(store.preferences_table, store.documents_table, mode="items").list(user_id)
+
+
+def run(
+    users_table,
+    store: PreferenceStore,
+    total_segments: int = 4,
+    workers: int = 4,
+    overwrite: bool = False,
+    verify: bool = False,
+) -> Dict[str, Any]:
+    started = time.perf_counter()
+
+    def migrate_segment(segment: int) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {"users": 0, "keys": 0, "mismatched": []}
+        users = scan_items(
+            users_table, total_segments=total_segments, segments=[segment], max_workers=1, projection=["userId"]
+        )
+        for user in users:
+            stats["users"] += 1
+            if verify:
+                if not verify_user(store, user["userId"]):
+                    stats["mismatched"].append(user["userId"])
+            else:
+                stats["keys"] += migrate_user(store, user["userId"], overwrite)
+        return stats
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(migrate_segment, range(total_segments)))
+    report: Dict[str, Any] = {"mode": "verify" if verify else "migrate"}
+    report["users"] = sum(result["users"] for result in results)
+    if verify:
+        mismatched = [user_id for result in results for user_id in result["mismatched"]]
+        report["mismatched"] = len(mismatched)
+        report["mismatchedSample"] = sorted(mismatched)[:_MISMATCH_SAMPLE]
+    else:
+        report["keys"] = sum(result["keys"] for result in results)
+    report["elapsedSec"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--segments", type=int, default=4, help="TotalSegments of the Users scan")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--overwrite", action="store_true", help="rebuild documents from the items")
+    parser.add_argument("--verify", action="store_true", help="only compare documents with the items")
+    args = parser.parse_args(argv)
+    if not os.environ.get("PREFERENCE_DOCUMENTS_TABLE"):
+        parser.error("PREFERENCE_DOCUMENTS_TABLE is required")
+
+    # The segment workers write from their own threads.
+    dynamodb = ThreadLocalDynamoDB()
+    store = PreferenceStore(
+        instrument_table(dynamodb.Table(os.environ["PREFERENCES_TABLE"])),
+        instrument_table(dynamodb.Table(os.environ["PREFERENCE_DOCUMENTS_TABLE"])),
+        mode="dual",
+    )
+    report = run(
+        instrument_table(dynamodb.Table(os.environ["USERS_TABLE"])),
+        store,
+        total_segments=args.segments,
+        workers=args.workers,
+        overwrite=args.overwrite,
+        verify=args.verify,
+    )
+    print(json.dumps(report))
+    if report.get("mismatched"):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Recomputes materialized effective preferences after a ManagedPreferenceSchema change
+(see ``lib.schema_propagation`` and ``lib.effective_preferences``).
+
+The job reads the change records of versions ``--from-version`` (exclusive,
+default: the one before the current stamp) up to the current version. It then
+works out which (isChild, country, age band) cohorts those changes affect and
+scans Users in parallel segments. Only users in an affected cohort are
+recomputed, in batches of ``--batch-size``, with a progress line per batch on
+stderr. When the change only touches named countries, the scan filters on
+``country``.
+
+Once every affected user is recomputed, the stamp's ``viewFloor`` is restored,
+so the views of unaffected users count as fresh again. It is not restored if
+the schema moved on in the meantime.
+
+    cd backend
+    python -m jobs.propagate_schema_change --segments 8 --workers 4
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from boto3.dynamodb.conditions import Attr
+
+from jobs.resolve_effective_preferences import age_threshold_for, load_age_thresholds
+from lib.ddb_metrics import instrument_table
+from lib.effective_preferences import EffectivePreferencesView, now_iso
+from lib.preference_store import open_preference_store
+from lib.preferences_resolver import (
+    managed_prefs_table,
+    schema_snapshot,
+    user_context_from_record,
+    users_table,
+)
+from lib.schema_propagation import affected_cohorts, cohort_dimensions, cohort_of, schema_delta
+from lib.schema_version import open_schema_changes_table, read_schema_changes, read_schema_stamp, set_view_floor
+from lib.scan_engine import ThreadLocalDynamoDB, scan_items
+
+
+class Progress:
+    """Thread-safe counters printed as one JSON line per finished batch."""
+
+    def __init__(self, out=sys.stderr):
+        self.out = out
+        self.counts = {"scanned": 0, "affected": 0, "recomputed": 0, "batches": 0, "failed": 0}
+        self._lock = threading.Lock()
+
+    def add(self, report: bool = False, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.counts[name] += value
+            if report:
+                print(json.dumps(dict(self.counts, at=now_iso())), file=self.out, flush=True)
+
+
+def plan(changes_table, from_version: Optional[int] = None) -> Dict[str, Any]:
+    """The versions, delta and affected cohorts of the pending change."""
+    stamp = read_schema_stamp(managed_prefs_table)
+    to_version = stamp["version"]
+    if to_version is None:
+        raise SystemExit("ManagedPreferenceSchema has no version stamp")
+    from_version = to_version - 1 if from_version is None else from_version
+    changes = read_schema_changes(changes_table, from_version, to_version)
+    if len(changes) != to_version - from_version:
+        raise SystemExit(f"Change records for versions {from_version + 1}..{to_version} are incomplete")
+
+    version, rows = schema_snapshot()
+    if version != to_version:
+        raise SystemExit("ManagedPreferenceSchema changed while planning; rerun")
+    delta = schema_delta(changes, rows)
+    countries, boundaries = cohort_dimensions(delta)
+    return {
+        "fromVersion": from_version,
+        "toVersion": to_version,
+        "previousFloor": changes[0].get("previousFloor") if changes else None,
+        "keys": sorted(delta),
+        "countries": countries,
+        "boundaries": boundaries,
+        "cohorts": affected_cohorts(delta),
+    }
+
+
+def _country_filter(cohorts):
+    """Scan filter on ``country`` when "any other country" is not affected."""
+    if not cohorts or any(country is None for _, country, _ in cohorts):
+        return None
+    return Attr("country").is_in(sorted({country for _, country, _ in cohorts}))
+
+
+def run(
+    view: EffectivePreferencesView,
+    store,
+    changes_table,
+    total_segments: int = 4,
+    workers: int = 4,
+    batch_size: int = 100,
+    from_version: Optional[int] = None,
+    progress: Optional[Progress] = None,
+) -> Dict[str, Any]:
+    started = time.perf_counter()
+    pending = plan(changes_table, from_version)
+    progress = progress or Progress()
+    report = {key: pending[key] for key in ("fromVersion", "toVersion", "keys")}
+    report["cohorts"] = [
+        {"isChild": is_child, "country": country or "*", "ageFrom": band}
+        for is_child, country, band in sorted(pending["cohorts"], key=str)
+    ]
+
+    if pending["cohorts"]:
+        thresholds = load_age_thresholds()
+        scan_filter = _country_filter(pending["cohorts"])
+        scan_options = {"FilterExpression": scan_filter} if scan_filter is not None else {}
+
+        def recompute(batch):
+            failed = 0
+            for user, user_ctx in batch:
+                try:
+                    computed_at = now_iso()
+                    view.refresh(user["userId"], store.list(user["userId"]), user_ctx, computed_at)
+                except Exception as exc:
+                    failed += 1
+                    print(f"Failed to recompute {user['userId']}: {exc!r}", file=sys.stderr)
+            progress.add(report=True, recomputed=len(batch) - failed, failed=failed, batches=1)
+
+        def propagate_segment(segment: int):
+            batch = []
+            users = scan_items(
+                users_table,
+                total_segments=total_segments,
+                segments=[segment],
+                max_workers=1,
+                **scan_options,
+            )
+            for user in users:
+                progress.add(scanned=1)
+                user_ctx = user_context_from_record(user, age_threshold_for(thresholds, user.get("country")))
+                if cohort_of(user_ctx, pending["countries"], pending["boundaries"]) not in pending["cohorts"]:
+                    continue
+                progress.add(affected=1)
+                batch.append((user, user_ctx))
+                if len(batch) >= batch_size:
+                    recompute(batch)
+                    batch = []
+            if batch:
+                recompute(batch)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            list(pool.map(propagate_segment, range(total_segments)))
+
+    report.update(progress.counts)
+    report["viewFloorRestored"] = not progress.counts["failed"] and set_view_floor(
+        managed_prefs_table, pending["toVersion"], pending["previousFloor"]
+    )
+    report["elapsedSec"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--segments", type=int, default=4, help="TotalSegments of the Users scan")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=100, help="users recomputed per progress report")
+    parser.add_argument("--from-version", type=int, help="last version already propagated (default: current - 1)")
+    args = parser.parse_args(argv)
+    if not os.environ.get("EFFECTIVE_PREFERENCES_TABLE"):
+        parser.error("EFFECTIVE_PREFERENCES_TABLE is required")
+
+    # The segment workers write from their own threads.
+    dynamodb = ThreadLocalDynamoDB()
+    report = run(
+        EffectivePreferencesView(instrument_table(dynamodb.Table(os.environ["EFFECTIVE_PREFERENCES_TABLE"]))),
+        open_preference_store(dynamodb, instrument_table(dynamodb.Table(os.environ["PREFERENCES_TABLE"]))),
+        open_schema_changes_table(dynamodb),
+        total_segments=args.segments,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        from_version=args.from_version,
+    )
+    print(json.dumps(report))
+    if report["failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
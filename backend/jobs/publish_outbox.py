@@ -0,0 +1,50 @@
+"""
+Publishes the change events waiting in the preference outbox (see ``lib.outbox``)
+in batches of ``--batch-size``, shard by shard, oldest first.
+
+In AWS, PublishOutboxFunction does this from the outbox stream and on a schedule.
+This job drains a local outbox into a file (one JSON event per line), or catches
+up a bus by hand with ``--sink eventbridge://<bus>``. A shard stops at its first
+batch with rejected events, so the next run retries them before newer ones.
+
+    cd backend
+    PREFERENCE_OUTBOX_TABLE=PreferenceOutbox python -m jobs.publish_outbox --sink ../events.ndjson
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+import boto3
+
+from lib.outbox import open_event_sink, open_outbox_publisher
+
+
+def run(publisher, batch_size: int = 100, max_batches: Optional[int] = None) -> Dict[str, Any]:
+    started = time.perf_counter()
+    report: Dict[str, Any] = publisher.drain(batch_size, max_batches)
+    report["elapsedSec"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--sink", default=os.environ.get("PREFERENCE_EVENT_SINK"), help="eventbridge://<bus> or a file path"
+    )
+    parser.add_argument("--batch-size", type=int, default=100, help="events per sink call")
+    parser.add_argument("--max-batches", type=int, help="stop each shard after this many batches")
+    args = parser.parse_args(argv)
+    if not args.sink:
+        parser.error("--sink or PREFERENCE_EVENT_SINK is required")
+    if not os.environ.get("PREFERENCE_OUTBOX_TABLE"):
+        parser.error("PREFERENCE_OUTBOX_TABLE is required")
+
+    publisher = open_outbox_publisher(boto3.resource("dynamodb"), open_event_sink(args.sink))
+    print(json.dumps(run(publisher, args.batch_size, args.max_batches)))
+
+
+if __name__ == "__main__":
+    main()
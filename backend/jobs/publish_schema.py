@@ -0,0 +1,47 @@
+"""
+Publishes ManagedPreferenceSchema rows and bumps the schema version stamp.
+
+Schema rows must be written through this job (or ``lib.schema_version``) rather
+than edited in the console, otherwise resolvers keep serving the cached schema
+until their stamp moves.
+
+    cd backend
+    python -m jobs.publish_schema ../schema.json [--delete voice_chat:GLOBAL]
+"""
+
+import argparse
+import json
+import os
+from decimal import Decimal
+
+import boto3
+
+from lib.schema_version import open_schema_changes_table, write_schema_items
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", nargs="?", help="JSON array of schema rows")
+    parser.add_argument("--delete", action="append", default=[], metavar="KEY:SCOPE", help="row to remove")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    items = []
+    if args.source:
+        with open(args.source, encoding="utf-8") as fh:
+            items = json.load(fh, parse_float=Decimal)
+    deletes = []
+    for entry in args.delete:
+        key, _, scope = entry.partition(":")
+        deletes.append({"preferenceKey": key, "scope": scope or "GLOBAL"})
+
+    table_name = os.environ.get("MANAGED_PREFERENCES_TABLE") or os.environ["MANAGED_SCHEMA_TABLE"]
+    dynamodb = boto3.resource("dynamodb")
+    version = write_schema_items(dynamodb.Table(table_name), open_schema_changes_table(dynamodb), items, deletes)
+    print(json.dumps({"written": len(items), "deleted": len(deletes), "schemaVersion": version}))
+
+
+if __name__ == "__main__":
+    main()
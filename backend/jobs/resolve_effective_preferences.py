@@ -0,0 +1,187 @@
+"""
+Offline batch resolution of every user's effective preferences.
+
+Users are scanned with ``TotalSegments`` parallel segments spread over worker
+processes. Managed defaults depend only on (country, isChild, age), so each
+process loads ManagedPreferenceSchema and AgeThresholds once and resolves the
+defaults once per cohort with the resolver's ``_resolve_single_default`` rules;
+each user then costs a single Preferences query (or document GetItem, see
+``lib.preference_store``) plus ``merge_preferences``.
+
+Snapshots are written as gzip NDJSON shards (one per segment, one line per user
+with the same list GET /preferences returns) to a local directory or
+``s3://bucket/prefix``, followed by ``_manifest.json`` with a throughput report.
+
+    cd backend
+    python -m jobs.resolve_effective_preferences ../effective --segments 16 --workers 4
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+import boto3
+
+from jobs.export_preferences import ShardWriter, _plain
+from lib.ddb_metrics import instrument_table
+from lib.object_store import open_object_store
+from lib.preference_store import open_preference_store
+from lib.preferences_resolver import (
+    _parse_int,
+    age_thresholds_table,
+    load_managed_schema,
+    merge_preferences,
+    resolve_defaults_from_schema,
+    user_context_from_record,
+    users_table,
+)
+from lib.scan_engine import scan_items
+
+MANIFEST_KEY = "_manifest.json"
+
+
+def _now_iso():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
+
+
+def load_age_thresholds() -> Dict[str, Optional[int]]:
+    return {
+        item["regionCode"]: _parse_int(item.get("ageThreshold"))
+        for item in scan_items(age_thresholds_table)
+        if "regionCode" in item
+    }
+
+
+def age_threshold_for(thresholds: Dict[str, Optional[int]], country: Optional[str]) -> Optional[int]:
+    """Same fallback as ``_fetch_age_threshold``: the country row, then DEFAULT."""
+    if not country:
+        return None
+    if thresholds.get(country) is not None:
+        return thresholds[country]
+    return thresholds.get("DEFAULT")
+
+
+class CohortDefaults:
+    """Resolved managed defaults cached per (country, isChild, age) cohort."""
+
+    def __init__(self, schema_items):
+        self.schema_items = schema_items
+        self._cache: Dict[Tuple[Any, bool, Any], Dict[str, Dict[str, Any]]] = {}
+        self.hits = 0
+
+    def for_context(self, user_ctx: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        cohort = (user_ctx["country"], user_ctx["is_child"], user_ctx["age"])
+        defaults = self._cache.get(cohort)
+        if defaults is None:
+            defaults = resolve_defaults_from_schema(self.schema_items, user_ctx)
+            self._cache[cohort] = defaults
+        else:
+            self.hits += 1
+        return defaults
+
+    @property
+    def cohorts(self) -> int:
+        return len(self._cache)
+
+
+def resolve_segment(segment: int, total_segments: int, destination: str) -> Dict[str, Any]:
+    """Resolves one Users segment and uploads its shard; runs inside a worker process."""
+    started = time.perf_counter()
+    store = open_object_store(destination)
+    dynamodb = boto3.resource("dynamodb")
+    preference_store = open_preference_store(
+        dynamodb, instrument_table(dynamodb.Table(os.environ["PREFERENCES_TABLE"]))
+    )
+    cohorts = CohortDefaults(load_managed_schema())
+    thresholds = load_age_thresholds()
+
+    writer = ShardWriter("ndjson", [])
+    users = 0
+    preference_rows = 0
+    try:
+        for user in scan_items(users_table, total_segments=total_segments, segments=[segment], max_workers=1):
+            user_ctx = user_context_from_record(user, age_threshold_for(thresholds, user.get("country")))
+            items = preference_store.list(user["userId"])
+            merged = merge_preferences(items, cohorts.for_context(user_ctx), include_defaults=True)
+            writer.write(
+                {
+                    "userId": user["userId"],
+                    "country": user_ctx["country"],
+                    "isChild": user_ctx["is_child"],
+                    "preferences": _plain(merged),
+                }
+            )
+            users += 1
+            preference_rows += len(items)
+        writer.close()
+        key = f"part-{segment:04d}.ndjson.gz"
+        if users:
+            store.put_file(key, writer.path)
+    finally:
+        writer.discard()
+
+    return {
+        "segment": segment,
+        "key": key if users else None,
+        "users": users,
+        "preferenceRows": preference_rows,
+        "cohorts": cohorts.cohorts,
+        "cohortHits": cohorts.hits,
+        "elapsedSec": round(time.perf_counter() - started, 3),
+    }
+
+
+def _resolve_segment_args(args):
+    return resolve_segment(*args)
+
+
+def run(destination: str, total_segments: int = 8, workers: int = 4) -> Dict[str, Any]:
+    started = time.perf_counter()
+    tasks = [(segment, total_segments, destination) for segment in range(total_segments)]
+    if workers <= 1:
+        results = [resolve_segment(*task) for task in tasks]
+    else:
+        # spawn: boto3 sessions and connection pools are not fork-safe.
+        with multiprocessing.get_context("spawn").Pool(workers) as pool:
+            results = pool.map(_resolve_segment_args, tasks)
+    elapsed = time.perf_counter() - started
+
+    users = sum(result["users"] for result in results)
+    lookups = sum(result["cohorts"] + result["cohortHits"] for result in results)
+    report = {
+        "completedAt": _now_iso(),
+        "totalSegments": total_segments,
+        "workers": workers,
+        "users": users,
+        "preferenceRows": sum(result["preferenceRows"] for result in results),
+        "elapsedSec": round(elapsed, 3),
+        "usersPerSec": round(users / elapsed, 1) if elapsed else None,
+        "cohortHitRate": round(sum(r["cohortHits"] for r in results) / lookups, 4) if lookups else None,
+        "shards": [result["key"] for result in results if result["key"]],
+        "segments": results,
+    }
+    open_object_store(destination).put_bytes(MANIFEST_KEY, json.dumps(report, indent=2).encode("utf-8"))
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("destination", help="local directory or s3://bucket/prefix")
+    parser.add_argument("--segments", type=int, default=8, help="TotalSegments of the Users scan")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args.destination, total_segments=args.segments, workers=args.workers)
+    summary = {k: v for k, v in report.items() if k != "segments"}
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
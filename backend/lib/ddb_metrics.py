@@ -0,0 +1,250 @@
+"""Per-invocation DynamoDB call accounting, emitted as CloudWatch Embedded Metric Format."""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+NAMESPACE = os.environ.get("DDB_METRICS_NAMESPACE", "UserPreferencesService/DynamoDB")
+
+_TABLE_OPERATIONS = ("get_item", "put_item", "delete_item", "update_item", "query", "scan")
+_CLIENT_OPERATIONS = (
+    "get_item",
+    "put_item",
+    "delete_item",
+    "update_item",
+    "query",
+    "scan",
+    "batch_get_item",
+    "batch_write_item",
+    "transact_get_items",
+    "transact_write_items",
+)
+_READ_OPERATIONS = {"get_item", "query", "scan", "batch_get_item", "transact_get_items"}
+
+_METRICS = (
+    ("Calls", "Count"),
+    ("LatencyMs", "Milliseconds"),
+    ("ConsumedRCU", "Count"),
+    ("ConsumedWCU", "Count"),
+)
+
+
+def metrics_enabled() -> bool:
+    return os.environ.get("DDB_METRICS", "on").lower() not in ("0", "off", "false", "no")
+
+
+class StdoutSink:
+    """Default sink: one EMF JSON document per line, picked up by CloudWatch Logs."""
+
+    def emit(self, document: Dict[str, Any]):
+        print(json.dumps(document))
+
+
+class InMemorySink:
+    """Keeps emitted EMF documents in memory (tests, local benchmarks)."""
+
+    def __init__(self):
+        self.documents: List[Dict[str, Any]] = []
+
+    def emit(self, document: Dict[str, Any]):
+        self.documents.append(document)
+
+    def clear(self):
+        self.documents = []
+
+    def calls(self, function: Optional[str] = None, table: Optional[str] = None, operation: Optional[str] = None) -> int:
+        total = 0
+        for doc in self.documents:
+            if function and doc.get("Function") != function:
+                continue
+            if table and doc.get("Table") != table:
+                continue
+            if operation and doc.get("Operation") != operation:
+                continue
+            total += doc.get("Calls", 0)
+        return total
+
+
+class _Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[Tuple[str, str], Dict[str, float]] = {}
+
+    def record(self, table_name: str, operation: str, latency_ms: float, capacity: float):
+        capacity_metric = "ConsumedRCU" if operation in _READ_OPERATIONS else "ConsumedWCU"
+        with self._lock:
+            entry = self._stats.setdefault(
+                (table_name, operation),
+                {"Calls": 0, "LatencyMs": 0.0, "ConsumedRCU": 0.0, "ConsumedWCU": 0.0},
+            )
+            entry["Calls"] += 1
+            entry["LatencyMs"] += latency_ms
+            entry[capacity_metric] += capacity
+
+    def drain(self) -> Dict[Tuple[str, str], Dict[str, float]]:
+        with self._lock:
+            stats, self._stats = self._stats, {}
+        return stats
+
+    def snapshot(self) -> Dict[Tuple[str, str], Dict[str, float]]:
+        with self._lock:
+            return {key: dict(value) for key, value in self._stats.items()}
+
+
+_global_recorder = _Recorder()
+_current_recorder: contextvars.ContextVar = contextvars.ContextVar(
+    "ddb_metrics_recorder", default=_global_recorder
+)
+_sink: Any = StdoutSink()
+
+
+def set_sink(sink) -> Any:
+    global _sink
+    previous, _sink = _sink, sink
+    return previous
+
+
+def get_sink():
+    return _sink
+
+
+def begin_invocation():
+    """Starts a fresh recorder for the current invocation (context-local)."""
+    return _current_recorder.set(_Recorder())
+
+
+def current_stats() -> Dict[Tuple[str, str], Dict[str, float]]:
+    return _current_recorder.get().snapshot()
+
+
+def end_invocation(function_name: str, token=None):
+    """Emits one EMF line per (table, operation) touched during the invocation."""
+    recorder = _current_recorder.get()
+    if token is not None:
+        _current_recorder.reset(token)
+    stats = recorder.drain()
+    if not stats or not metrics_enabled():
+        return
+    timestamp = int(time.time() * 1000)
+    for (table_name, operation), values in sorted(stats.items()):
+        document = {
+            "_aws": {
+                "Timestamp": timestamp,
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": NAMESPACE,
+                        "Dimensions": [
+                            ["Function", "Table", "Operation"],
+                            ["Function", "Table"],
+                            ["Function"],
+                        ],
+                        "Metrics": [{"Name": name, "Unit": unit} for name, unit in _METRICS],
+                    }
+                ],
+            },
+            "Function": function_name,
+            "Table": table_name,
+            "Operation": operation,
+            "Calls": values["Calls"],
+            "LatencyMs": round(values["LatencyMs"], 3),
+            "ConsumedRCU": values["ConsumedRCU"],
+            "ConsumedWCU": values["ConsumedWCU"],
+        }
+        _sink.emit(document)
+
+
+def _capacity_by_table(consumed: Any) -> Dict[str, float]:
+    if not consumed:
+        return {}
+    entries = consumed if isinstance(consumed, list) else [consumed]
+    result: Dict[str, float] = {}
+    for entry in entries:
+        table_name = entry.get("TableName")
+        if not table_name:
+            continue
+        result[table_name] = result.get(table_name, 0.0) + float(entry.get("CapacityUnits") or 0)
+    return result
+
+
+def _request_tables(operation: str, kwargs: Dict[str, Any]) -> List[str]:
+    if "TableName" in kwargs:
+        return [kwargs["TableName"]]
+    if "RequestItems" in kwargs:
+        return list(kwargs["RequestItems"].keys())
+    if "TransactItems" in kwargs:
+        names = []
+        for transact_item in kwargs["TransactItems"]:
+            for action in transact_item.values():
+                table_name = action.get("TableName")
+                if table_name and table_name not in names:
+                    names.append(table_name)
+        return names
+    return ["unknown"]
+
+
+def _timed_call(fn, operation: str, table_names: List[str], kwargs: Dict[str, Any]):
+    if not metrics_enabled():
+        return fn(**kwargs)
+
+    kwargs.setdefault("ReturnConsumedCapacity", "TOTAL")
+    recorder = _current_recorder.get()
+    start = time.perf_counter()
+    response = None
+    try:
+        response = fn(**kwargs)
+        return response
+    finally:
+        latency_ms = (time.perf_counter() - start) * 1000
+        capacity = _capacity_by_table((response or {}).get("ConsumedCapacity"))
+        for table_name in table_names:
+            recorder.record(table_name, operation, latency_ms, capacity.get(table_name, 0.0))
+
+
+class InstrumentedTable:
+    """Transparent proxy around a boto3 ``Table`` that records every data-plane call."""
+
+    def __init__(self, table):
+        self._table = table
+
+    def __getattr__(self, name):
+        attr = getattr(self._table, name)
+        if name in _TABLE_OPERATIONS:
+            def call(**kwargs):
+                return _timed_call(attr, name, [self._table.name], kwargs)
+
+            return call
+        return attr
+
+    def __repr__(self):
+        return f"InstrumentedTable({self._table.name!r})"
+
+
+class InstrumentedClient:
+    """Same as ``InstrumentedTable`` for low-level client calls (batch / transact APIs)."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name in _CLIENT_OPERATIONS:
+            def call(**kwargs):
+                return _timed_call(attr, name, _request_tables(name, kwargs), kwargs)
+
+            return call
+        return attr
+
+
+def instrument_table(table):
+    if isinstance(table, InstrumentedTable):
+        return table
+    return InstrumentedTable(table)
+
+
+def instrument_client(client):
+    if isinstance(client, InstrumentedClient):
+        return client
+    return InstrumentedClient(client)
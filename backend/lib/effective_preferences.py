@@ -0,0 +1,168 @@
+"""
+Materialized effective preferences (EFFECTIVE_PREFERENCES_TABLE).
+
+One item per user holds the list GET /me/preferences returns (stored overrides
+merged with the managed defaults of the user's cohort):
+
+    {"userId", "preferences": [...], "schemaVersion", "country", "isChild", "age",
+     "validUntil", "computedAt"}
+
+Write handlers refresh it from the state they just wrote, a Users stream handler
+recomputes it when country / birthDate / role change, and readers fall back to
+live resolution when it is stale:
+
+* ``schemaVersion`` is not between the stamp's ``viewFloor`` (see
+  ``lib.schema_version``) and its current version, or there is no stamp;
+* ``validUntil`` (the user's next birthday, when the age can flip a rule) has passed.
+
+Writes are conditioned on ``computedAt`` (taken before the source rows were read)
+and ``schemaVersion``, so a view built from an older snapshot or schema never
+replaces a newer one; a rejected write drops the item so the next read resolves
+live.
+"""
+
+import os
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from lib.ddb_metrics import instrument_table
+from lib.preferences_resolver import (
+    _parse_birth_date,
+    merge_preferences,
+    resolve_defaults_from_schema,
+    schema_snapshot,
+    schema_view_floor,
+)
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def next_birthday(birth_date: Optional[str], today: Optional[date] = None) -> Optional[str]:
+    """ISO date of the next birthday after ``today`` (29 February -> 1 March)."""
+    born = _parse_birth_date(birth_date)
+    if born is None:
+        return None
+    today = today or datetime.now(timezone.utc).date()
+    for year in (today.year, today.year + 1):
+        try:
+            candidate = date(year, born.month, born.day)
+        except ValueError:
+            candidate = date(year, 3, 1)
+        if candidate > today:
+            return candidate.isoformat()
+    return None
+
+
+def resolve_effective(items: List[Dict[str, Any]], user_ctx: Dict[str, Any]) -> Tuple[Optional[int], List[Dict[str, Any]]]:
+    """``(schema version, merged list)`` for the user's stored items and context."""
+    version, schema = schema_snapshot()
+    defaults = resolve_defaults_from_schema(schema, user_ctx)
+    return version, merge_preferences(items, defaults, include_defaults=True)
+
+
+def _storable(obj):
+    if isinstance(obj, list):
+        return [_storable(i) for i in obj]
+    if isinstance(obj, dict):
+        return {k: _storable(v) for k, v in obj.items()}
+    if isinstance(obj, float):
+        return Decimal(str(obj))
+    return obj
+
+
+def _plain(obj):
+    if isinstance(obj, list):
+        return [_plain(i) for i in obj]
+    if isinstance(obj, dict):
+        return {k: _plain(v) for k, v in obj.items()}
+    if isinstance(obj, Decimal):
+        return int(obj) if obj % 1 == 0 else float(obj)
+    return obj
+
+
+class EffectivePreferencesView:
+    def __init__(self, table):
+        self.table = table
+
+    def is_fresh(
+        self,
+        item: Dict[str, Any],
+        schema_version: Optional[int],
+        view_floor: Optional[int] = None,
+        today: Optional[date] = None,
+    ) -> bool:
+        stored = item.get("schemaVersion")
+        if schema_version is None or stored is None:
+            return False
+        if not (view_floor if view_floor is not None else schema_version) <= stored <= schema_version:
+            return False
+        valid_until = item.get("validUntil")
+        today = today or datetime.now(timezone.utc).date()
+        return not valid_until or today.isoformat() < valid_until
+
+    def read(self, user_id: str) -> Optional[List[Dict[str, Any]]]:
+        """The materialized list, or None when it is missing or stale."""
+        item = self.table.get_item(Key={"userId": user_id}).get("Item")
+        if item is None or not self.is_fresh(item, schema_snapshot()[0], schema_view_floor()):
+            return None
+        return _plain(item.get("preferences") or [])
+
+    def write(
+        self,
+        user_id: str,
+        merged: List[Dict[str, Any]],
+        user_ctx: Dict[str, Any],
+        schema_version: Optional[int],
+        computed_at: str,
+    ) -> bool:
+        """Stores ``merged``; False when the condition rejected it (the item is then dropped)."""
+        item = {
+            "userId": user_id,
+            "preferences": _storable(merged),
+            "country": user_ctx.get("country"),
+            "isChild": bool(user_ctx.get("is_child")),
+            "age": user_ctx.get("age"),
+            "computedAt": computed_at,
+        }
+        if schema_version is not None:
+            item["schemaVersion"] = schema_version
+        valid_until = next_birthday((user_ctx.get("user") or {}).get("birthDate"))
+        if valid_until:
+            item["validUntil"] = valid_until
+        condition = "attribute_not_exists(userId) OR (computedAt <= :at"
+        values: Dict[str, Any] = {":at": computed_at}
+        if schema_version is not None:
+            condition += " AND (attribute_not_exists(schemaVersion) OR schemaVersion <= :v)"
+            values[":v"] = schema_version
+        try:
+            self.table.put_item(
+                Item={k: v for k, v in item.items() if v is not None},
+                ConditionExpression=condition + ")",
+                ExpressionAttributeValues=values,
+            )
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            # The stored item may predate what this writer saw (e.g. it was built from
+            # a newer schema than a stale cache here); dropping it is always safe.
+            self.delete(user_id)
+            return False
+        return True
+
+    def refresh(self, user_id: str, items: List[Dict[str, Any]], user_ctx: Dict[str, Any], computed_at: str):
+        """Resolves and stores the view from already loaded items; returns the merged list."""
+        version, merged = resolve_effective(items, user_ctx)
+        self.write(user_id, merged, user_ctx, version, computed_at)
+        return merged
+
+    def delete(self, user_id: str):
+        self.table.delete_item(Key={"userId": user_id})
+
+
+def open_effective_view(dynamodb) -> Optional[EffectivePreferencesView]:
+    """The view over EFFECTIVE_PREFERENCES_TABLE, or None when it is not configured."""
+    table_name = os.environ.get("EFFECTIVE_PREFERENCES_TABLE")
+    if not table_name:
+        return None
+    return EffectivePreferencesView(instrument_table(dynamodb.Table(table_name)))
@@ -0,0 +1,233 @@
+"""
+``Idempotency-Key`` support for the mutation handlers (IDEMPOTENCY_TABLE).
+
+A retry carrying the same ``Idempotency-Key`` header gets the stored response of
+the first attempt (with ``Idempotent-Replayed: true``) and the handler does not
+run again. Keys are scoped to the operation and the caller, and bound to a
+fingerprint of the path parameters and body; reusing a key for a different
+request is answered with 422.
+
+Records live in the table for IDEMPOTENCY_TTL_SECONDS (DynamoDB TTL on
+``expiresAt``) and in a small per-container cache:
+
+    {"idempotencyKey": "<operation>#<caller>#<key>", "status": "IN_PROGRESS" | "COMPLETED",
+     "fingerprint", "response", "expiresAt", "lockedUntil"}
+
+While the first attempt runs, retries get 409. The lock lapses at ``lockedUntil``
+in case that invocation died. Responses worth retrying (409 and 5xx) are not
+stored: the record is released so the next retry runs the handler.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from lib.ddb_metrics import instrument_table
+
+HEADER = "idempotency-key"
+MAX_KEY_LENGTH = 255
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# Longer than the functions' timeout, so a running attempt keeps its lock.
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get("IDEMPOTENCY_LOCK_SECONDS", "60"))
+LOCAL_CACHE_SIZE = 1024
+
+
+def request_key(event: Dict[str, Any]) -> Optional[str]:
+    for name, value in (event.get("headers") or {}).items():
+        if name.lower() == HEADER and value and str(value).strip():
+            return str(value).strip()
+    return None
+
+
+def request_fingerprint(event: Dict[str, Any]) -> str:
+    payload = {"path": event.get("pathParameters") or {}, "body": event.get("body") or ""}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _caller(event: Dict[str, Any]) -> Optional[str]:
+    authorizer = (event.get("requestContext") or {}).get("authorizer") or {}
+    for source in (((authorizer.get("jwt") or {}).get("claims") or {}), authorizer.get("claims") or {}):
+        for key in ("sub", "username", "cognito:username"):
+            if source.get(key):
+                return source[key]
+    return None
+
+
+def _error(status: int, message: str) -> Dict[str, Any]:
+    return {
+        "statusCode": status,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps({"error": message}),
+    }
+
+
+def _replayed(response: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(response, headers=dict(response.get("headers") or {}, **{"Idempotent-Replayed": "true"}))
+
+
+def _storable(response: Dict[str, Any]) -> bool:
+    status = int(response.get("statusCode") or 500)
+    return status < 500 and status != 409
+
+
+class IdempotencyStore:
+    def __init__(
+        self,
+        table,
+        ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS,
+        lock_seconds: int = IDEMPOTENCY_LOCK_SECONDS,
+        cache_size: int = LOCAL_CACHE_SIZE,
+    ):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds
+        self.cache_size = cache_size
+        # record key -> (expiresAt, fingerprint, response), least recently used first
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, record_key: str, now: int):
+        with self._lock:
+            entry = self._cache.get(record_key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._cache[record_key]
+                return None
+            self._cache.move_to_end(record_key)
+            return entry
+
+    def _remember(self, record_key: str, expires_at: int, fingerprint: str, response: Dict[str, Any]):
+        with self._lock:
+            self._cache[record_key] = (expires_at, fingerprint, response)
+            self._cache.move_to_end(record_key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    @staticmethod
+    def _answer(stored_fingerprint: str, response: Dict[str, Any], fingerprint: str) -> Dict[str, Any]:
+        if stored_fingerprint != fingerprint:
+            return _error(422, "Idempotency-Key was already used for a different request")
+        return _replayed(response)
+
+    def begin(self, record_key: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """
+        Locks ``record_key`` and returns None when the request should run, or the
+        response to return instead (the stored one, 409 or 422).
+        """
+        now = int(time.time())
+        cached = self._cached(record_key, now)
+        if cached is not None:
+            return self._answer(cached[1], cached[2], fingerprint)
+
+        try:
+            self.table.put_item(
+                Item={
+                    "idempotencyKey": record_key,
+                    "status": "IN_PROGRESS",
+                    "fingerprint": fingerprint,
+                    "lockedUntil": now + self.lock_seconds,
+                    "expiresAt": now + self.ttl_seconds,
+                },
+                ConditionExpression=(
+                    "attribute_not_exists(idempotencyKey) OR expiresAt <= :now"
+                    " OR (#s = :in_progress AND lockedUntil <= :now)"
+                ),
+                ExpressionAttributeNames={"#s": "status"},
+                ExpressionAttributeValues={":now": now, ":in_progress": "IN_PROGRESS"},
+            )
+            return None
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+        item = self.table.get_item(Key={"idempotencyKey": record_key}, ConsistentRead=True).get("Item")
+        if item is None or item.get("status") != "COMPLETED":
+            if item is not None and item.get("fingerprint") != fingerprint:
+                return _error(422, "Idempotency-Key was already used for a different request")
+            return _error(409, "A request with this Idempotency-Key is in progress; retry later")
+        response = json.loads(item["response"])
+        self._remember(record_key, int(item["expiresAt"]), item["fingerprint"], response)
+        return self._answer(item["fingerprint"], response, fingerprint)
+
+    def complete(self, record_key: str, fingerprint: str, response: Dict[str, Any]):
+        """Stores the final response, or releases the key when a retry should run again."""
+        if not _storable(response):
+            self.release(record_key, fingerprint)
+            return
+        expires_at = int(time.time()) + self.ttl_seconds
+        # Cached first: if the put fails, retries reaching this container still replay.
+        self._remember(record_key, expires_at, fingerprint, response)
+        self.table.put_item(
+            Item={
+                "idempotencyKey": record_key,
+                "status": "COMPLETED",
+                "fingerprint": fingerprint,
+                "response": json.dumps(response),
+                "expiresAt": expires_at,
+            }
+        )
+
+    def release(self, record_key: str, fingerprint: str):
+        try:
+            self.table.delete_item(
+                Key={"idempotencyKey": record_key},
+                ConditionExpression="#s = :in_progress AND fingerprint = :fp",
+                ExpressionAttributeNames={"#s": "status"},
+                ExpressionAttributeValues={":in_progress": "IN_PROGRESS", ":fp": fingerprint},
+            )
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+
+def open_idempotency_store(dynamodb) -> Optional[IdempotencyStore]:
+    """The store over IDEMPOTENCY_TABLE, or None when it is not configured."""
+    table_name = os.environ.get("IDEMPOTENCY_TABLE")
+    if not table_name:
+        return None
+    return IdempotencyStore(instrument_table(dynamodb.Table(table_name)))
+
+
+def idempotent(store: Optional[IdempotencyStore], operation: str):
+    """
+    Handler decorator: requests with an ``Idempotency-Key`` header run at most
+    once per key. Without a header, or without a store, the handler runs as is.
+    """
+
+    def decorator(handler):
+        if store is None:
+            return handler
+
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            key = request_key(event)
+            if key is None:
+                return handler(event, context)
+            if len(key) > MAX_KEY_LENGTH:
+                return _error(400, f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters")
+
+            record_key = f"{operation}#{_caller(event) or '-'}#{key}"
+            fingerprint = request_fingerprint(event)
+            earlier = store.begin(record_key, fingerprint)
+            if earlier is not None:
+                print(f"[Idempotency] operation={operation} key={key} replayed status={earlier['statusCode']}")
+                return earlier
+            try:
+                response = handler(event, context)
+            except Exception:
+                store.release(record_key, fingerprint)
+                raise
+            try:
+                store.complete(record_key, fingerprint, response)
+            except Exception as exc:
+                # The mutation already happened; answer it rather than fail the request.
+                print(f"[Idempotency] operation={operation} key={key} failed to store the response: {exc!r}")
+            return response
+
+        return wrapper
+
+    return decorator
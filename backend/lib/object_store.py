@@ -0,0 +1,105 @@
+"""
+Minimal object store used by batch jobs for their outputs and checkpoints.
+
+``LocalObjectStore`` keeps objects as files under a directory and is what jobs use
+locally and in tests; ``S3ObjectStore`` has the same interface on top of a bucket
+and prefix. ``open_object_store`` picks one from a location string
+(``s3://bucket/prefix`` or a directory path).
+"""
+
+import os
+import shutil
+from typing import Iterator, Optional
+
+import boto3
+from botocore.exceptions import ClientError
+
+
+class LocalObjectStore:
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Object key escapes the store root: {key!r}")
+        return path
+
+    def put_bytes(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp_path, path)
+
+    def put_file(self, key: str, local_path: str):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(local_path, f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as fh:
+                return fh.read()
+        except FileNotFoundError:
+            return None
+
+    def list(self, prefix: str = "") -> Iterator[str]:
+        # Only the directory the prefix points into needs walking.
+        start = os.path.join(self.root, os.path.dirname(prefix)) if os.path.dirname(prefix) else self.root
+        for directory, _, files in os.walk(start):
+            for name in sorted(files):
+                if name.endswith(".tmp"):
+                    continue
+                key = os.path.relpath(os.path.join(directory, name), self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    yield key
+
+    def url(self, key: str) -> str:
+        return self._path(key)
+
+
+class S3ObjectStore:
+    def __init__(self, bucket: str, prefix: str = "", client=None):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = client or boto3.client("s3")
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put_bytes(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def put_file(self, key: str, local_path: str):
+        self.client.upload_file(local_path, self.bucket, self._key(key))
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as err:
+            if err.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            raise
+        return response["Body"].read()
+
+    def list(self, prefix: str = "") -> Iterator[str]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        strip = len(self.prefix) + 1 if self.prefix else 0
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            for obj in page.get("Contents", []):
+                yield obj["Key"][strip:]
+
+    def url(self, key: str) -> str:
+        return f"s3://{self.bucket}/{self._key(key)}"
+
+
+def open_object_store(location: str):
+    if location.startswith("s3://"):
+        bucket, _, prefix = location[len("s3://") :].partition("/")
+        return S3ObjectStore(bucket, prefix)
+    if location.startswith("file://"):
+        location = location[len("file://") :]
+    return LocalObjectStore(location)
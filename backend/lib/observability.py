@@ -0,0 +1,34 @@
+"""Entry-point wrapper shared by all lambda handlers."""
+
+import functools
+
+from lib import ddb_metrics, profiling, tracing
+
+
+def instrument_handler(function_name: str):
+    """
+    Wraps a lambda ``handler(event, context)`` so that every DynamoDB call made
+    during the invocation is flushed as EMF metrics once the handler returns,
+    opens the root tracing span that stage spans attach to, and runs the
+    invocation under the profiler when it is sampled or explicitly requested.
+    """
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            token = ddb_metrics.begin_invocation()
+            try:
+                with tracing.span(f"handler.{function_name}") as root:
+                    if profiling.should_profile(event, function_name):
+                        response = profiling.run_profiled(function_name, handler, event, context)
+                    else:
+                        response = handler(event, context)
+                    if isinstance(response, dict) and "statusCode" in response:
+                        root.set_attribute("http.status_code", response["statusCode"])
+                    return response
+            finally:
+                ddb_metrics.end_invocation(function_name, token)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,221 @@
+"""
+Transactional outbox for preference change events (PREFERENCE_OUTBOX_TABLE).
+
+Mutations write one outbox row per request in the same TransactWriteItems call
+as the preference change (``PreferenceSession.commit(with_items=...)``), so an
+event exists exactly when the change was committed:
+
+    {"shard", "eventId": "<occurredAt>#<ns>-<random>", "userId", "actorId", "action",
+     "changes": [{"preferenceKey", "oldValue", "newValue"}], "occurredAt"}
+
+Rows are spread over OUTBOX_SHARDS partitions by user, so one user's events stay
+in order within a shard. ``OutboxPublisher`` drains them in batches to a sink
+(``EventBridgeSink``, or ``FileSink`` locally). It deletes a row only after the
+sink accepted it, so delivery is at least once. Consumers deduplicate on the
+``eventId`` carried in every event.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional
+
+import boto3
+from boto3.dynamodb.conditions import Key
+
+from lib.ddb_metrics import instrument_table
+
+OUTBOX_SHARDS = int(os.environ.get("OUTBOX_SHARDS", "8"))
+EVENT_SOURCE = os.environ.get("PREFERENCE_EVENT_SOURCE", "user-preferences")
+DETAIL_TYPE = "PreferencesChanged"
+EVENTBRIDGE_BATCH = 10
+# Preference changes per request when the outbox is on: TransactWriteItems takes
+# 100 entries, one per key plus the document update and the outbox row.
+MAX_CHANGES_PER_EVENT = 98
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def shard_of(user_id: str, shards: int = OUTBOX_SHARDS) -> str:
+    return f"s{zlib.crc32(user_id.encode('utf-8')) % shards}"
+
+
+def change(pref_key: str, old_value: Any, new_value: Any) -> Dict[str, Any]:
+    entry = {"preferenceKey": pref_key}
+    if old_value not in (None, ""):
+        entry["oldValue"] = old_value
+    if new_value not in (None, ""):
+        entry["newValue"] = new_value
+    return entry
+
+
+def build_event(user_id: str, actor_id: Optional[str], action: str, changes: List[Dict[str, Any]]) -> Dict[str, Any]:
+    occurred_at = _now_iso()
+    return {
+        "shard": shard_of(user_id),
+        "eventId": f"{occurred_at}#{time.time_ns()}-{uuid.uuid4().hex[:12]}",
+        "userId": user_id,
+        "actorId": actor_id or "unknown",
+        "action": action,
+        "changes": changes,
+        "occurredAt": occurred_at,
+    }
+
+
+class Outbox:
+    def __init__(self, table):
+        self.table = table
+
+    def transact_items(self, event: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """TransactWriteItems entries that record ``event`` with the change it describes."""
+        return [
+            {
+                "Put": {
+                    "TableName": self.table.table_name,
+                    "Item": event,
+                    "ConditionExpression": "attribute_not_exists(eventId)",
+                }
+            }
+        ]
+
+    def record(self, events: Iterable[Dict[str, Any]]):
+        """Writes events outside a transaction (batch paths that are retried as a whole)."""
+        with self.table.batch_writer() as batch:
+            for event in events:
+                batch.put_item(Item=event)
+
+
+def open_outbox(dynamodb) -> Optional[Outbox]:
+    """The outbox over PREFERENCE_OUTBOX_TABLE, or None when it is not configured."""
+    table_name = os.environ.get("PREFERENCE_OUTBOX_TABLE")
+    if not table_name:
+        return None
+    return Outbox(instrument_table(dynamodb.Table(table_name)))
+
+
+def _plain(obj):
+    if isinstance(obj, list):
+        return [_plain(i) for i in obj]
+    if isinstance(obj, dict):
+        return {k: _plain(v) for k, v in obj.items()}
+    if isinstance(obj, Decimal):
+        return int(obj) if obj % 1 == 0 else float(obj)
+    return obj
+
+
+def event_detail(event: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: _plain(value) for key, value in event.items() if key != "shard"}
+
+
+class EventBridgeSink:
+    def __init__(self, bus_name: str, client=None, source: str = EVENT_SOURCE):
+        self.bus_name = bus_name
+        self.client = client or boto3.client("events")
+        self.source = source
+
+    def publish(self, events: List[Dict[str, Any]]) -> List[str]:
+        """Sends ``events``; returns the eventIds EventBridge accepted."""
+        accepted = []
+        for start in range(0, len(events), EVENTBRIDGE_BATCH):
+            chunk = events[start : start + EVENTBRIDGE_BATCH]
+            entries = [
+                {
+                    "Source": self.source,
+                    "DetailType": DETAIL_TYPE,
+                    "Detail": json.dumps(event_detail(event)),
+                    "EventBusName": self.bus_name,
+                }
+                for event in chunk
+            ]
+            response = self.client.put_events(Entries=entries)
+            for event, result in zip(chunk, response.get("Entries") or []):
+                if not result.get("ErrorCode"):
+                    accepted.append(event["eventId"])
+        return accepted
+
+
+class FileSink:
+    """Appends one JSON line per event; the local stand-in for the event bus."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def publish(self, events: List[Dict[str, Any]]) -> List[str]:
+        with self._lock, open(self.path, "a", encoding="utf-8") as fh:
+            for event in events:
+                fh.write(json.dumps({"detail-type": DETAIL_TYPE, "detail": event_detail(event)}) + "\n")
+        return [event["eventId"] for event in events]
+
+
+def open_event_sink(location: Optional[str] = None):
+    """``eventbridge://<bus>`` or a file path (PREFERENCE_EVENT_SINK); None when publishing is off."""
+    location = location or os.environ.get("PREFERENCE_EVENT_SINK")
+    if not location:
+        return None
+    if location.startswith("eventbridge://"):
+        return EventBridgeSink(location[len("eventbridge://") :])
+    if location.startswith("file://"):
+        location = location[len("file://") :]
+    return FileSink(location)
+
+
+class OutboxPublisher:
+    def __init__(self, table, sink, shards: int = OUTBOX_SHARDS):
+        self.table = table
+        self.sink = sink
+        self.shards = shards
+
+    def publish(self, events: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Publishes already loaded outbox rows and deletes the ones the sink accepted."""
+        if not events:
+            return {"published": 0, "failed": 0}
+        accepted = set(self.sink.publish(events))
+        with self.table.batch_writer() as batch:
+            for event in events:
+                if event["eventId"] in accepted:
+                    batch.delete_item(Key={"shard": event["shard"], "eventId": event["eventId"]})
+        return {"published": len(accepted), "failed": len(events) - len(accepted)}
+
+    def drain_shard(self, shard: str, batch_size: int = 100, max_batches: Optional[int] = None) -> Dict[str, int]:
+        """Publishes a shard's rows oldest first; stops at the first batch with failures."""
+        totals = {"batches": 0, "published": 0, "failed": 0}
+        while max_batches is None or totals["batches"] < max_batches:
+            response = self.table.query(
+                KeyConditionExpression=Key("shard").eq(shard),
+                Limit=batch_size,
+                ConsistentRead=True,
+            )
+            events = response.get("Items") or []
+            if not events:
+                break
+            result = self.publish(events)
+            totals["batches"] += 1
+            totals["published"] += result["published"]
+            totals["failed"] += result["failed"]
+            if result["failed"]:
+                break
+        return totals
+
+    def drain(self, batch_size: int = 100, max_batches_per_shard: Optional[int] = None) -> Dict[str, int]:
+        totals = {"batches": 0, "published": 0, "failed": 0}
+        for index in range(self.shards):
+            for name, value in self.drain_shard(f"s{index}", batch_size, max_batches_per_shard).items():
+                totals[name] += value
+        return totals
+
+
+def open_outbox_publisher(dynamodb, sink=None) -> Optional[OutboxPublisher]:
+    """Publisher over PREFERENCE_OUTBOX_TABLE into ``sink`` (default: PREFERENCE_EVENT_SINK), or None."""
+    table_name = os.environ.get("PREFERENCE_OUTBOX_TABLE")
+    sink = sink or open_event_sink()
+    if not table_name or sink is None:
+        return None
+    return OutboxPublisher(instrument_table(dynamodb.Table(table_name)), sink)
@@ -0,0 +1,207 @@
+"""
+Point-in-time reconstruction of a user's preferences from PreferenceVersions.
+
+Checkpoints are rows in PreferenceVersions itself
+(``preferenceKey_ts = "#ckpt#<asOf>"``) holding the user's full preference map as
+of ``asOf``. They are written by ``jobs.checkpoint_preference_versions`` and carry
+no ``timestamp`` or index attributes, so they stay out of every secondary index
+and sort before the ``#seq#`` counters and all version rows.
+
+Reconstructing the preferences at T reads the newest checkpoint at or before T
+(one Query with ``Limit=1``) and replays only the versions written after it up to
+T from the user's time index, so the cost is bounded by how often checkpoints are
+taken rather than by the length of the history.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from boto3.dynamodb.conditions import Key
+
+from lib.preference_versions import USER_KEY_TIME_INDEX, USER_TIME_INDEX, _UPPER_SENTINEL, _validate_bound
+from lib.version_archive import not_archived
+
+CHECKPOINT_PREFIX = "#ckpt#"
+# Each requested key is its own Query, so a diff over named keys is capped.
+MAX_KEYS_PER_DIFF = 25
+
+
+def checkpoint_sort_key(as_of: str) -> str:
+    return f"{CHECKPOINT_PREFIX}{as_of}"
+
+
+def latest_checkpoint(table, user_id: str, as_of: str) -> Optional[Dict[str, Any]]:
+    """Newest checkpoint taken at or before ``as_of`` (which may be a prefix)."""
+    response = table.query(
+        KeyConditionExpression=Key("userId").eq(user_id)
+        & Key("preferenceKey_ts").between(CHECKPOINT_PREFIX, checkpoint_sort_key(f"{as_of}{_UPPER_SENTINEL}")),
+        ScanIndexForward=False,
+        Limit=1,
+    )
+    items = response.get("Items", [])
+    return items[0] if items else None
+
+
+def _query_rows(table, params: Dict[str, Any], after: Optional[str]) -> List[Dict[str, Any]]:
+    items: List[Dict[str, Any]] = []
+    while True:
+        response = table.query(**params)
+        items.extend(item for item in response.get("Items", []) if not after or item["timestamp"] > after)
+        start_key = response.get("LastEvaluatedKey")
+        if not start_key:
+            return items
+        params["ExclusiveStartKey"] = start_key
+
+
+def versions_between(
+    table,
+    user_id: str,
+    after: Optional[str],
+    until: str,
+    archive=None,
+    pref_keys: Optional[Iterable[str]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Version rows with ``after < timestamp <= until``, oldest first, optionally only
+    for ``pref_keys`` (at most MAX_KEYS_PER_DIFF, one userKey-timestamp-index query
+    each). With a ``lib.version_archive.VersionArchive`` archived rows come from the
+    month blobs.
+    """
+    upper = f"{until}{_UPPER_SENTINEL}"
+    time_condition = Key("timestamp").between(after, upper) if after else Key("timestamp").lte(upper)
+    keys = sorted(set(pref_keys)) if pref_keys is not None else None
+    if keys is not None and len(keys) > MAX_KEYS_PER_DIFF:
+        raise ValueError(f"At most {MAX_KEYS_PER_DIFF} preferenceKeys per request")
+    if keys is None:
+        queries = [{"IndexName": USER_TIME_INDEX, "KeyConditionExpression": Key("userId").eq(user_id) & time_condition}]
+    else:
+        queries = [
+            {
+                "IndexName": USER_KEY_TIME_INDEX,
+                "KeyConditionExpression": Key("userKey").eq(f"{user_id}#{key}") & time_condition,
+            }
+            for key in keys
+        ]
+
+    items: List[Dict[str, Any]] = []
+    if archive is not None:
+        items.extend(
+            row
+            for row in archive.rows(user_id, after, until)
+            if (not after or row["timestamp"] > after) and (keys is None or row.get("preferenceKey") in keys)
+        )
+    for params in queries:
+        if archive is not None:
+            params["FilterExpression"] = not_archived()
+        items.extend(_query_rows(table, params, after))
+    items.sort(key=lambda item: (item["timestamp"], int(item.get("version") or 0)))
+    return items
+
+
+def apply_versions(preferences: Dict[str, Dict[str, Any]], versions: Iterable[Dict[str, Any]]) -> int:
+    """Replays version rows (oldest first) onto a ``{key: entry}`` map in place."""
+    applied = 0
+    for item in versions:
+        pref_key = item.get("preferenceKey")
+        if not pref_key:
+            continue
+        new_value = item.get("newValue")
+        if item.get("action") == "DELETE" or new_value in (None, ""):
+            preferences.pop(pref_key, None)
+        else:
+            entry = {"value": new_value, "updatedAt": item["timestamp"]}
+            if item.get("version") is not None:
+                entry["version"] = item["version"]
+            preferences[pref_key] = entry
+        applied += 1
+    return applied
+
+
+def reconstruct(table, user_id: str, as_of: str, archive=None) -> Dict[str, Any]:
+    """
+    Returns ``{"preferences": {key: entry}, "checkpoint": asOf or None, "replayed": n}``
+    for the state at ``as_of``. Raises ValueError for a malformed timestamp.
+    """
+    as_of = _validate_bound("at", as_of)
+    if not as_of:
+        raise ValueError("at is required")
+
+    checkpoint = latest_checkpoint(table, user_id, as_of)
+    preferences = dict((checkpoint or {}).get("preferences") or {})
+    checkpoint_at = checkpoint["asOf"] if checkpoint else None
+    replayed = apply_versions(preferences, versions_between(table, user_id, checkpoint_at, as_of, archive))
+    return {"preferences": preferences, "checkpoint": checkpoint_at, "replayed": replayed}
+
+
+def write_checkpoint(table, user_id: str, as_of: str, preferences: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    item = {
+        "userId": user_id,
+        "preferenceKey_ts": checkpoint_sort_key(as_of),
+        "asOf": as_of,
+        "preferences": preferences,
+        "keyCount": len(preferences),
+    }
+    table.put_item(Item=item)
+    return item
+
+
+def _value_text(value) -> Optional[str]:
+    if value in (None, ""):
+        return None
+    return str(value)
+
+
+def revert_plan(
+    current_items: Iterable[Dict[str, Any]],
+    target: Dict[str, Dict[str, Any]],
+    as_of: str,
+    only_keys: Optional[Iterable[str]] = None,
+) -> List[Tuple[str, Optional[str], Optional[str]]]:
+    """
+    Diff between the stored preferences and a reconstructed state as
+    ``[(key, current value, target value)]``; a target of None deletes the key.
+
+    Stored keys missing from the reconstruction are only deleted when they were
+    written after ``as_of``; older ones predate the version history and are kept.
+    """
+    current = {item["preferenceKey"]: item for item in current_items if item.get("preferenceKey")}
+    upper = f"{as_of}{_UPPER_SENTINEL}"
+    keys = set(target) | {key for key, item in current.items() if (item.get("updatedAt") or "") > upper}
+    if only_keys is not None:
+        keys &= set(only_keys)
+
+    changes = []
+    for key in sorted(keys):
+        current_value = _value_text(current[key].get("value")) if key in current else None
+        target_value = _value_text(target[key].get("value")) if key in target else None
+        if current_value != target_value:
+            changes.append((key, current_value, target_value))
+    return changes
+
+
+def diff_versions(rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Key-level diff of a window of version rows (oldest first) in one pass: each key's
+    value before the window is the first row's ``oldValue`` and its value after is
+    the last row's ``newValue``. Keys that ended where they started are dropped.
+    """
+    diff: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        pref_key = row.get("preferenceKey")
+        if not pref_key:
+            continue
+        entry = diff.get(pref_key)
+        if entry is None:
+            entry = diff[pref_key] = {
+                "preferenceKey": pref_key,
+                "before": row.get("oldValue"),
+                "changes": 0,
+                "fromVersion": row.get("version"),
+            }
+        entry["after"] = None if row.get("action") == "DELETE" else row.get("newValue")
+        entry["toVersion"] = row.get("version")
+        entry["changes"] += 1
+    return [
+        entry
+        for _, entry in sorted(diff.items())
+        if _value_text(entry["before"]) != _value_text(entry["after"])
+    ]
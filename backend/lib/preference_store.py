@@ -0,0 +1,348 @@
+"""
+Storage layouts for a user's stored preferences, selected by PREFERENCE_STORAGE_MODE.
+
+``items`` (default)
+    One Preferences item per (userId, preferenceKey): reads are a Query over the
+    user's partition and a batch of N changes is N writes.
+``document``
+    One PreferenceDocuments item per user,
+    ``{"userId", "prefs": {key: {"value", "updatedAt"}}, "revision"}``: reads are a
+    single GetItem and a batch is a single UpdateItem. Updates are optimistic at
+    attribute level: every touched key is conditioned on the ``updatedAt`` the
+    writer read (or on its absence), so concurrent writers only conflict when they
+    touch the same key, and a conflict raises ``ConcurrentPreferenceUpdate``.
+``dual``
+    Migration phase. Items stay authoritative and are written as in ``items``
+    mode; documents that already exist get the same attribute updates without
+    conditions. Reads use the document and fall back to the items when the user
+    has not been migrated yet (``jobs.migrate_preference_documents``).
+
+Handlers go through ``PreferenceStore.session(user_id)``: ``current`` / ``put`` /
+``delete`` stage changes against what was read, ``commit`` writes them and
+``items`` returns the resulting preferences without reading them back in
+document mode. ``commit(with_items=...)`` writes the changes in one
+TransactWriteItems call together with other entries (outbox rows).
+"""
+
+import os
+from typing import Any, Dict, List, Optional
+
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+from lib.ddb_metrics import instrument_client, instrument_table
+
+MODES = ("items", "dual", "document")
+
+# Keys per UpdateItem when merging into an existing document (expression size limit).
+_KEYS_PER_UPDATE = 50
+
+# TransactWriteItems limit.
+MAX_TRANSACT_ITEMS = 100
+
+
+class ConcurrentPreferenceUpdate(Exception):
+    """Another writer changed one of the keys this request read before writing it."""
+
+
+def storage_mode() -> str:
+    mode = (os.environ.get("PREFERENCE_STORAGE_MODE") or "items").lower()
+    if mode not in MODES:
+        raise ValueError(f"PREFERENCE_STORAGE_MODE must be one of {', '.join(MODES)}")
+    return mode
+
+
+def document_items(user_id: str, document: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Flattens a document into Preferences-shaped items, ordered like a Query."""
+    prefs = (document or {}).get("prefs") or {}
+    return [
+        {"userId": user_id, "preferenceKey": key, **entry}
+        for key, entry in sorted(prefs.items())
+    ]
+
+
+def _document_entry(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {name: value for name, value in item.items() if name not in ("userId", "preferenceKey")}
+
+
+def _update_expression(changes: Dict[str, Optional[Dict[str, Any]]], seen=None, if_absent: bool = False):
+    """
+    UpdateItem parameters for ``{key: entry or None}`` on a document's ``prefs`` map.
+    ``seen`` maps keys to the ``updatedAt`` read before writing (None = absent) and
+    turns each change into a conditional one.
+    """
+    names = {"#prefs": "prefs", "#rev": "revision"}
+    values: Dict[str, Any] = {":one": 1}
+    sets, removes, conditions = [], [], []
+    for index, (key, entry) in enumerate(changes.items()):
+        name = f"#k{index}"
+        names[name] = key
+        if entry is None:
+            removes.append(f"#prefs.{name}")
+        elif if_absent:
+            values[f":v{index}"] = entry
+            sets.append(f"#prefs.{name} = if_not_exists(#prefs.{name}, :v{index})")
+        else:
+            values[f":v{index}"] = entry
+            sets.append(f"#prefs.{name} = :v{index}")
+        if seen is not None:
+            if seen.get(key) is None:
+                conditions.append(f"attribute_not_exists(#prefs.{name})")
+            else:
+                names["#ts"] = "updatedAt"
+                values[f":seen{index}"] = seen[key]
+                conditions.append(f"#prefs.{name}.#ts = :seen{index}")
+
+    expression = "ADD #rev :one"
+    if sets:
+        expression = f"SET {', '.join(sets)} {expression}"
+    if removes:
+        expression = f"{expression} REMOVE {', '.join(removes)}"
+    params = {
+        "UpdateExpression": expression,
+        "ExpressionAttributeNames": names,
+        "ExpressionAttributeValues": values,
+    }
+    if conditions:
+        params["ConditionExpression"] = " AND ".join(conditions)
+    else:
+        params["ConditionExpression"] = "attribute_exists(userId)"
+    return params
+
+
+class PreferenceSession:
+    """Reads and staged writes of one user's preferences within one request."""
+
+    def __init__(self, store: "PreferenceStore", user_id: str):
+        self.store = store
+        self.user_id = user_id
+        self.mode = store.mode
+        self._document: Optional[Dict[str, Any]] = None
+        self._document_loaded = False
+        self._seen: Dict[str, Optional[str]] = {}
+        self._staged: Dict[str, Optional[Dict[str, Any]]] = {}
+        # Changes handed out by the last ``transact_items`` call, until ``committed``.
+        self._pending: Dict[str, Optional[Dict[str, Any]]] = {}
+
+    # -- reads --
+
+    def _load_document(self) -> Optional[Dict[str, Any]]:
+        if not self._document_loaded:
+            self._document = self.store.documents_table.get_item(Key={"userId": self.user_id}).get("Item")
+            self._document_loaded = True
+        return self._document
+
+    def current(self, pref_key: str) -> Optional[Dict[str, Any]]:
+        """The stored item for ``pref_key`` (Preferences shape) or None."""
+        if self._staged.get(pref_key, False) is not False:
+            entry = self._staged[pref_key]
+            return {"userId": self.user_id, "preferenceKey": pref_key, **entry} if entry else None
+        item = None
+        document = self._load_document() if self.mode != "items" else None
+        if document is not None:
+            entry = (document.get("prefs") or {}).get(pref_key)
+            item = {"userId": self.user_id, "preferenceKey": pref_key, **entry} if entry else None
+        elif self.mode != "document":
+            item = self.store.preferences_table.get_item(
+                Key={"userId": self.user_id, "preferenceKey": pref_key}
+            ).get("Item")
+        self._seen.setdefault(pref_key, item.get("updatedAt") if item else None)
+        return item
+
+    def items(self) -> List[Dict[str, Any]]:
+        """All stored preferences, including committed changes."""
+        if self.mode == "document" or (self.mode == "dual" and self._load_document() is not None):
+            items = document_items(self.user_id, self._load_document())
+        else:
+            items = []
+            params = {"KeyConditionExpression": Key("userId").eq(self.user_id)}
+            while True:
+                response = self.store.preferences_table.query(**params)
+                items.extend(response.get("Items", []))
+                if not response.get("LastEvaluatedKey"):
+                    break
+                params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        for item in items:
+            self._seen.setdefault(item["preferenceKey"], item.get("updatedAt"))
+        return items
+
+    # -- writes --
+
+    def put(self, item: Dict[str, Any]):
+        self._staged[item["preferenceKey"]] = _document_entry(item)
+
+    def delete(self, pref_key: str):
+        self._staged[pref_key] = None
+
+    def commit(self, with_items: Optional[List[Dict[str, Any]]] = None):
+        if with_items:
+            self._commit_transaction(with_items)
+            return
+        staged, self._staged = self._staged, {}
+        if not staged:
+            return
+        if self.mode != "document":
+            for pref_key, entry in staged.items():
+                key = {"userId": self.user_id, "preferenceKey": pref_key}
+                if entry is None:
+                    self.store.preferences_table.delete_item(Key=key)
+                else:
+                    self.store.preferences_table.put_item(Item={**key, **entry})
+        if self.mode == "items":
+            return
+
+        document = self._load_document()
+        if document is None:
+            if self.mode == "dual":
+                return  # not migrated yet; the migration copies the items
+            self._create_document(staged)
+        else:
+            seen = {key: self._seen.get(key) for key in staged} if self.mode == "document" else None
+            self._update_document(document, staged, seen)
+
+    def _create_document(self, staged: Dict[str, Optional[Dict[str, Any]]]):
+        prefs = {key: entry for key, entry in staged.items() if entry is not None}
+        try:
+            self.store.documents_table.put_item(
+                Item={"userId": self.user_id, "prefs": prefs, "revision": 1},
+                ConditionExpression="attribute_not_exists(userId)",
+            )
+        except self.store.conditional_check_failed as err:
+            raise ConcurrentPreferenceUpdate("Preferences were modified concurrently") from err
+        self._document = {"userId": self.user_id, "prefs": prefs, "revision": 1}
+
+    def _update_document(self, document, staged, seen):
+        params = _update_expression(staged, seen)
+        try:
+            response = self.store.documents_table.update_item(
+                Key={"userId": self.user_id}, ReturnValues="ALL_NEW", **params
+            )
+        except self.store.conditional_check_failed as err:
+            raise ConcurrentPreferenceUpdate("Preferences were modified concurrently") from err
+        self._document = response.get("Attributes") or document
+
+    def _commit_transaction(self, with_items: List[Dict[str, Any]]):
+        entries = self.transact_items() + with_items
+        if len(entries) > MAX_TRANSACT_ITEMS:
+            raise ValueError(f"{len(entries)} entries exceed the {MAX_TRANSACT_ITEMS}-item transaction limit")
+        try:
+            self.store.client.transact_write_items(TransactItems=entries)
+        except ClientError as err:
+            reasons = err.response.get("CancellationReasons") or []
+            if any(reason.get("Code") == "ConditionalCheckFailed" for reason in reasons):
+                raise ConcurrentPreferenceUpdate("Preferences were modified concurrently") from err
+            raise
+        self.committed()
+
+    def committed(self):
+        """
+        Records that the entries of the last ``transact_items`` call were written, so
+        ``items`` and later writes in this session start from the written state
+        without reading it back.
+        """
+        staged, self._pending = self._pending, {}
+        for key, entry in staged.items():
+            self._seen[key] = entry.get("updatedAt") if entry else None
+        document = self._document
+        if document is None and self.mode == "document" and staged:
+            document = {"userId": self.user_id, "prefs": {}, "revision": 0}
+            self._document_loaded = True
+        if document is not None:
+            prefs = dict(document.get("prefs") or {})
+            for key, entry in staged.items():
+                if entry is None:
+                    prefs.pop(key, None)
+                else:
+                    prefs[key] = entry
+            self._document = {**document, "prefs": prefs, "revision": int(document.get("revision") or 0) + 1}
+
+    def transact_items(self) -> List[Dict[str, Any]]:
+        """
+        The staged changes as TransactWriteItems entries (for callers that write
+        them together with version rows) and clears them. Call ``committed`` once
+        the transaction succeeded, before writing more through this session.
+        """
+        staged, self._staged = self._staged, {}
+        self._pending = staged
+        entries: List[Dict[str, Any]] = []
+        if self.mode != "document":
+            for pref_key, entry in staged.items():
+                key = {"userId": self.user_id, "preferenceKey": pref_key}
+                if entry is None:
+                    entries.append({"Delete": {"TableName": self.store.preferences_table.name, "Key": key}})
+                else:
+                    entries.append(
+                        {"Put": {"TableName": self.store.preferences_table.name, "Item": {**key, **entry}}}
+                    )
+        if self.mode == "items" or not staged:
+            return entries
+
+        document = self._load_document()
+        table_name = self.store.documents_table.name
+        if document is None:
+            if self.mode == "document":
+                prefs = {key: entry for key, entry in staged.items() if entry is not None}
+                entries.append(
+                    {
+                        "Put": {
+                            "TableName": table_name,
+                            "Item": {"userId": self.user_id, "prefs": prefs, "revision": 1},
+                            "ConditionExpression": "attribute_not_exists(userId)",
+                        }
+                    }
+                )
+            return entries
+        seen = {key: self._seen.get(key) for key in staged} if self.mode == "document" else None
+        entries.append(
+            {"Update": {"TableName": table_name, "Key": {"userId": self.user_id}, **_update_expression(staged, seen)}}
+        )
+        return entries
+
+
+class PreferenceStore:
+    def __init__(self, preferences_table, documents_table=None, mode: Optional[str] = None):
+        self.preferences_table = preferences_table
+        self.documents_table = documents_table
+        self.mode = mode or storage_mode()
+        if self.mode != "items" and documents_table is None:
+            raise ValueError(f"PREFERENCE_STORAGE_MODE={self.mode} requires PREFERENCE_DOCUMENTS_TABLE")
+        table = documents_table if documents_table is not None else preferences_table
+        self.conditional_check_failed = table.meta.client.exceptions.ConditionalCheckFailedException
+        self.client = instrument_client(table.meta.client)
+
+    def session(self, user_id: str) -> PreferenceSession:
+        return PreferenceSession(self, user_id)
+
+    def list(self, user_id: str) -> List[Dict[str, Any]]:
+        """Every stored preference of ``user_id`` (single GetItem in document mode)."""
+        return self.session(user_id).items()
+
+    def merge_document(self, user_id: str, items: List[Dict[str, Any]], overwrite: bool = False) -> int:
+        """
+        Copies Preferences items into the user's document (migration). Keys already
+        in the document are kept unless ``overwrite``; returns the number of keys sent.
+        """
+        entries = {item["preferenceKey"]: _document_entry(item) for item in items if item.get("preferenceKey")}
+        if overwrite or not entries:
+            self.documents_table.put_item(Item={"userId": user_id, "prefs": entries, "revision": 1})
+            return len(entries)
+        try:
+            self.documents_table.put_item(
+                Item={"userId": user_id, "prefs": entries, "revision": 1},
+                ConditionExpression="attribute_not_exists(userId)",
+            )
+            return len(entries)
+        except self.conditional_check_failed:
+            pass
+        keys = list(entries)
+        for start in range(0, len(keys), _KEYS_PER_UPDATE):
+            chunk = {key: entries[key] for key in keys[start : start + _KEYS_PER_UPDATE]}
+            self.documents_table.update_item(Key={"userId": user_id}, **_update_expression(chunk, if_absent=True))
+        return len(entries)
+
+
+def open_preference_store(dynamodb, preferences_table) -> PreferenceStore:
+    """Store over ``preferences_table`` and PREFERENCE_DOCUMENTS_TABLE (when configured)."""
+    documents_name = os.environ.get("PREFERENCE_DOCUMENTS_TABLE")
+    documents_table = instrument_table(dynamodb.Table(documents_name)) if documents_name else None
+    return PreferenceStore(preferences_table, documents_table)
@@ -0,0 +1,258 @@
+"""
+PreferenceVersions rows and the indexes that serve history queries.
+
+Every writer goes through ``record_version`` so each row carries a per-(user, key)
+sequence number and the attributes the secondary indexes are keyed on:
+
+  base table                       userId / preferenceKey_ts ("<key>#v<seq:012d>")
+  userId-timestamp-index           userId / timestamp
+  preferenceKey-timestamp-index    preferenceKey / timestamp
+  userAction-timestamp-index       userAction ("<userId>#<action>") / timestamp
+  keyAction-timestamp-index        keyAction ("<key>#<action>") / timestamp
+  userKey-timestamp-index          userKey ("<userId>#<key>") / timestamp
+
+Sequence numbers come from a counter row per (user, key) in the same table
+(``preferenceKey_ts = "#seq#<key>"``) incremented with an atomic ADD, so two writes
+in the same millisecond can no longer overwrite each other, version N is a single
+GetItem and the latest N versions are a descending Query with ``Limit=N``. Counter
+rows sort before every preference key and carry no index attributes; user-wide
+queries start at ``"$"`` to skip them. Rows written before sequence numbers keep
+their ``<key>#<timestamp>`` sort keys, which sort before every ``<key>#v...`` row.
+
+``build_history_query`` picks the table or index for a combination of userId,
+preferenceKey, from/to and action so that the partition and time range are key
+conditions. userId + preferenceKey reads the key's base-table history, or the
+(user, key) time index when from/to is given.
+"""
+
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from boto3.dynamodb.conditions import Attr, Key
+
+USER_TIME_INDEX = "userId-timestamp-index"
+KEY_TIME_INDEX = "preferenceKey-timestamp-index"
+USER_ACTION_INDEX = "userAction-timestamp-index"
+KEY_ACTION_INDEX = "keyAction-timestamp-index"
+USER_KEY_TIME_INDEX = "userKey-timestamp-index"
+
+ACTIONS = ("UPSERT", "DELETE", "REVERT", "IMPORT")
+
+SEQUENCE_WIDTH = 12
+COUNTER_PREFIX = "#seq#"
+# Lower bound for user-wide queries; sorts after the "#seq#" counter rows.
+FIRST_VERSION_SORT_KEY = "$"
+
+# Sorts after every character used in ISO timestamps, so "to" bounds are inclusive
+# even when they are only a prefix such as "2024-05-01".
+_UPPER_SENTINEL = "~"
+_TIMESTAMP_PREFIX = re.compile(r"^\d{4}(-\d{2}(-\d{2}(T[0-9:.]*Z?)?)?)?$")
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def index_attributes(user_id: str, pref_key: str, action: str) -> Dict[str, str]:
+    return {
+        "userAction": f"{user_id}#{action}",
+        "keyAction": f"{pref_key}#{action}",
+        "userKey": f"{user_id}#{pref_key}",
+    }
+
+
+def version_sort_key(pref_key: str, sequence: int) -> str:
+    return f"{pref_key}#v{sequence:0{SEQUENCE_WIDTH}d}"
+
+
+def counter_key(user_id: str, pref_key: str) -> Dict[str, str]:
+    return {"userId": user_id, "preferenceKey_ts": f"{COUNTER_PREFIX}{pref_key}"}
+
+
+def build_version_item(
+    user_id: str,
+    pref_key: str,
+    old_value: Any,
+    new_value: Any,
+    action: str,
+    sequence: int,
+    timestamp: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Builds an immutable audit row. Empty strings are skipped because DynamoDB does
+    not accept them.
+    """
+    timestamp = timestamp or now_iso()
+    item = {
+        "userId": user_id,
+        "preferenceKey_ts": version_sort_key(pref_key, sequence),
+        "preferenceKey": pref_key,
+        "version": sequence,
+        "timestamp": timestamp,
+        "action": action,
+    }
+    item.update(index_attributes(user_id, pref_key, action))
+    if old_value not in (None, ""):
+        item["oldValue"] = old_value
+    if new_value not in (None, ""):
+        item["newValue"] = new_value
+    return item
+
+
+def next_sequence(table, user_id: str, pref_key: str) -> int:
+    response = table.update_item(
+        Key=counter_key(user_id, pref_key),
+        UpdateExpression="ADD #seq :one",
+        ExpressionAttributeNames={"#seq": "sequence"},
+        ExpressionAttributeValues={":one": 1},
+        ReturnValues="UPDATED_NEW",
+    )
+    return int(response["Attributes"]["sequence"])
+
+
+def record_version(table, user_id: str, pref_key: str, old_value: Any, new_value: Any, action: str) -> Dict[str, Any]:
+    """Allocates the next sequence number for (user, key) and writes the version row."""
+    item = build_version_item(user_id, pref_key, old_value, new_value, action, next_sequence(table, user_id, pref_key))
+    table.put_item(Item=item, ConditionExpression="attribute_not_exists(preferenceKey_ts)")
+    return item
+
+
+def read_sequences(client, table_name: str, user_id: str, pref_keys) -> Dict[str, int]:
+    """Current counter value per key (0 when the key has no versions), via strongly consistent BatchGetItem."""
+    keys = list(dict.fromkeys(pref_keys))
+    sequences = {key: 0 for key in keys}
+    for start in range(0, len(keys), 100):
+        request = {
+            table_name: {
+                "Keys": [counter_key(user_id, key) for key in keys[start : start + 100]],
+                "ProjectionExpression": "preferenceKey_ts, #seq",
+                "ExpressionAttributeNames": {"#seq": "sequence"},
+                # A counter bumped a moment ago must not read stale, or the claim fails.
+                "ConsistentRead": True,
+            }
+        }
+        while request:
+            response = client.batch_get_item(RequestItems=request)
+            for item in response.get("Responses", {}).get(table_name, []):
+                sequences[item["preferenceKey_ts"][len(COUNTER_PREFIX) :]] = int(item.get("sequence") or 0)
+            request = response.get("UnprocessedKeys") or None
+    return sequences
+
+
+def version_transact_items(
+    table_name: str,
+    user_id: str,
+    pref_key: str,
+    old_value: Any,
+    new_value: Any,
+    action: str,
+    current_sequence: int,
+    timestamp: Optional[str] = None,
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    TransactWriteItems entries that record the next version of (user, key) given the
+    counter value read beforehand: the counter moves from ``current_sequence`` to the
+    next value only if nobody else moved it, and the version row is put under that
+    number. Returns ``(version item, transact items)``.
+    """
+    sequence = current_sequence + 1
+    item = build_version_item(user_id, pref_key, old_value, new_value, action, sequence, timestamp)
+    counter_update = {
+        "TableName": table_name,
+        "Key": counter_key(user_id, pref_key),
+        "UpdateExpression": "SET #seq = :next",
+        "ExpressionAttributeNames": {"#seq": "sequence"},
+        "ExpressionAttributeValues": {":next": sequence},
+    }
+    if current_sequence:
+        counter_update["ConditionExpression"] = "#seq = :current"
+        counter_update["ExpressionAttributeValues"][":current"] = current_sequence
+    else:
+        counter_update["ConditionExpression"] = "attribute_not_exists(#seq)"
+    version_put = {
+        "TableName": table_name,
+        "Item": item,
+        "ConditionExpression": "attribute_not_exists(preferenceKey_ts)",
+    }
+    return item, [{"Update": counter_update}, {"Put": version_put}]
+
+
+def get_version(table, user_id: str, pref_key: str, sequence: int) -> Optional[Dict[str, Any]]:
+    return table.get_item(Key={"userId": user_id, "preferenceKey_ts": version_sort_key(pref_key, sequence)}).get("Item")
+
+
+def _validate_bound(name: str, value: Optional[str]) -> Optional[str]:
+    if value in (None, ""):
+        return None
+    if not _TIMESTAMP_PREFIX.match(value):
+        raise ValueError(f"{name} must be an ISO-8601 UTC timestamp or prefix (e.g. 2024-05-01T12:00)")
+    return value
+
+
+def _range_condition(attribute: str, from_ts: Optional[str], to_ts: Optional[str], prefix: str = ""):
+    if from_ts and to_ts:
+        return Key(attribute).between(f"{prefix}{from_ts}", f"{prefix}{to_ts}{_UPPER_SENTINEL}")
+    if from_ts:
+        return Key(attribute).gte(f"{prefix}{from_ts}")
+    if to_ts:
+        return Key(attribute).lte(f"{prefix}{to_ts}{_UPPER_SENTINEL}")
+    return None
+
+
+def build_history_query(
+    user_id: Optional[str] = None,
+    preference_key: Optional[str] = None,
+    from_ts: Optional[str] = None,
+    to_ts: Optional[str] = None,
+    action: Optional[str] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Returns ``(mode, query kwargs)`` for a history request. Raises ValueError when
+    the combination cannot be served (neither userId nor preferenceKey, bad bounds
+    or an unknown action).
+    """
+    from_ts = _validate_bound("from", from_ts)
+    to_ts = _validate_bound("to", to_ts)
+    if from_ts and to_ts and from_ts > f"{to_ts}{_UPPER_SENTINEL}":
+        raise ValueError("from must not be after to")
+    if action:
+        action = action.upper()
+        if action not in ACTIONS:
+            raise ValueError(f"action must be one of {', '.join(ACTIONS)}")
+
+    if user_id and preference_key:
+        if from_ts or to_ts:
+            condition = Key("userKey").eq(f"{user_id}#{preference_key}") & _range_condition("timestamp", from_ts, to_ts)
+            kwargs = {"IndexName": USER_KEY_TIME_INDEX, "KeyConditionExpression": condition}
+            filter_expression = None
+        else:
+            condition = Key("userId").eq(user_id) & Key("preferenceKey_ts").begins_with(f"{preference_key}#")
+            kwargs = {"KeyConditionExpression": condition}
+            filter_expression = None
+        if action:
+            action_filter = Attr("action").eq(action)
+            filter_expression = action_filter if filter_expression is None else filter_expression & action_filter
+        if filter_expression is not None:
+            kwargs["FilterExpression"] = filter_expression
+        return "user_key", kwargs
+
+    if user_id and action:
+        index, partition, mode = USER_ACTION_INDEX, Key("userAction").eq(f"{user_id}#{action}"), "user_action"
+    elif user_id and (from_ts or to_ts):
+        index, partition, mode = USER_TIME_INDEX, Key("userId").eq(user_id), "user_range"
+    elif user_id:
+        condition = Key("userId").eq(user_id) & Key("preferenceKey_ts").gte(FIRST_VERSION_SORT_KEY)
+        return "user", {"KeyConditionExpression": condition}
+    elif preference_key and action:
+        index, partition, mode = KEY_ACTION_INDEX, Key("keyAction").eq(f"{preference_key}#{action}"), "key_action"
+    elif preference_key:
+        index, partition, mode = KEY_TIME_INDEX, Key("preferenceKey").eq(preference_key), "key_range"
+    else:
+        raise ValueError("userId or preferenceKey is required")
+
+    condition = partition
+    time_condition = _range_condition("timestamp", from_ts, to_ts)
+    if time_condition is not None:
+        condition = condition & time_condition
+    return mode, {"IndexName": index, "KeyConditionExpression": condition}
@@ -1,33 +1,31 @@
 import os
+import threading
+import time
 from datetime import datetime, timezone
 from decimal import Decimal
-from typing import Any, Dict, Iterable
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 import boto3
 from boto3.dynamodb.conditions import Key
 
+from lib.ddb_metrics import instrument_table
+from lib.scan_engine import scan_all
+from lib.schema_version import is_schema_stamp, read_schema_stamp
+from lib.tracing import span, traced
+
 dynamodb = boto3.resource("dynamodb")
-users_table = dynamodb.Table(os.environ["USERS_TABLE"])
+users_table = instrument_table(dynamodb.Table(os.environ["USERS_TABLE"]))
 managed_table_env = os.environ.get("MANAGED_PREFERENCES_TABLE") or os.environ["MANAGED_SCHEMA_TABLE"]
-managed_prefs_table = dynamodb.Table(managed_table_env)
-age_thresholds_table = dynamodb.Table(
-    os.environ.get("AGE_THRESHOLDS_TABLE", "AgeThresholds")
+managed_prefs_table = instrument_table(dynamodb.Table(managed_table_env))
+age_thresholds_table = instrument_table(
+    dynamodb.Table(os.environ.get("AGE_THRESHOLDS_TABLE", "AgeThresholds"))
 )
 
+# How long a loaded schema is trusted before the version stamp is checked again.
+SCHEMA_VERSION_TTL_SECONDS = float(os.environ.get("SCHEMA_VERSION_TTL_SECONDS", "5"))
 
-def _scan_all(table):
-    items = []
-    start_key = None
-    while True:
-        params = {}
-        if start_key:
-            params["ExclusiveStartKey"] = start_key
-        response = table.scan(**params)
-        items.extend(response.get("Items", []))
-        start_key = response.get("LastEvaluatedKey")
-        if not start_key:
-            break
-    return items
+_schema_lock = threading.Lock()
+_schema_cache: Dict[str, Any] = {"version": None, "items": None, "checked_at": 0.0, "view_floor": None}
 
 
 def _normalize_value(value):
@@ -80,12 +78,11 @@ def _fetch_age_threshold(country):
     return None
 
 
-def build_user_context(user_id):
-    user = users_table.get_item(Key={"userId": user_id}).get("Item") or {}
+def user_context_from_record(user: Dict[str, Any], age_threshold) -> Dict[str, Any]:
+    """Builds the resolver context from an already loaded Users item."""
     birth_date = _parse_birth_date(user.get("birthDate"))
     age = _calculate_age(birth_date)
     country = user.get("country")
-    age_threshold = _fetch_age_threshold(country)
     role = (user.get("role") or "").lower()
     is_child = role == "child"
     if not is_child and age is not None and age_threshold is not None:
@@ -99,6 +96,13 @@ def build_user_context(user_id):
     }
 
 
+@traced("resolver.build_user_context")
+def build_user_context(user_id):
+    user = users_table.get_item(Key={"userId": user_id}).get("Item") or {}
+    age_threshold = _fetch_age_threshold(user.get("country"))
+    return user_context_from_record(user, age_threshold)
+
+
 def _resolve_single_default(schema, user_ctx):
     value = schema.get("baseDefault")
     source = "baseDefault"
@@ -138,8 +142,7 @@ def _resolve_single_default(schema, user_ctx):
     }
 
 
-def resolve_managed_defaults(user_ctx):
-    managed_items = _scan_all(managed_prefs_table)
+def resolve_defaults_from_schema(managed_items: Iterable[Dict[str, Any]], user_ctx):
     resolved = {}
     for item in managed_items:
         pref_key = item.get("preferenceKey")
@@ -151,6 +154,54 @@ def resolve_managed_defaults(user_ctx):
     return resolved
 
 
+def _schema_is_fresh(now: float) -> bool:
+    return (
+        _schema_cache["items"] is not None
+        and _schema_cache["version"] is not None
+        and now - _schema_cache["checked_at"] < SCHEMA_VERSION_TTL_SECONDS
+    )
+
+
+def schema_snapshot() -> Tuple[Optional[int], List[Dict[str, Any]]]:
+    """
+    Returns ``(version, rows)`` of ManagedPreferenceSchema, rescanning only when the
+    version stamp has moved. Without a stamp the schema is rescanned on every call.
+    """
+    with _schema_lock:
+        now = time.monotonic()
+        if _schema_is_fresh(now):
+            return _schema_cache["version"], _schema_cache["items"]
+        stamp = read_schema_stamp(managed_prefs_table)
+        version = stamp["version"]
+        _schema_cache["view_floor"] = stamp["viewFloor"]
+        if version is not None and version == _schema_cache["version"] and _schema_cache["items"] is not None:
+            _schema_cache["checked_at"] = now
+            return version, _schema_cache["items"]
+
+        with span("resolver.schema_scan") as scan_span:
+            items = [item for item in scan_all(managed_prefs_table) if not is_schema_stamp(item)]
+            scan_span.set_attribute("schema.rows", len(items))
+            if version is not None:
+                scan_span.set_attribute("schema.version", version)
+        _schema_cache.update(version=version, items=items, checked_at=now)
+        return version, items
+
+
+def schema_view_floor() -> Optional[int]:
+    """Oldest schema version whose materialized views are still valid (None = current only)."""
+    schema_snapshot()
+    return _schema_cache["view_floor"]
+
+
+def load_managed_schema() -> List[Dict[str, Any]]:
+    return schema_snapshot()[1]
+
+
+def resolve_managed_defaults(user_ctx):
+    return resolve_defaults_from_schema(load_managed_schema(), user_ctx)
+
+
+@traced("resolver.merge_preferences")
 def merge_preferences(
     user_items: Iterable[Dict[str, Any]],
     defaults: Dict[str, Dict[str, Any]],
@@ -179,6 +230,7 @@ def merge_preferences(
     return list(merged.values())
 
 
+@traced("resolver.get_managed_preference")
 def get_managed_preference(pref_key: str) -> Dict[str, Any]:
     if not pref_key:
         return {}
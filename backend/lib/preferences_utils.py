@@ -6,6 +6,12 @@ from typing import Any, Dict, Optional
 from boto3.dynamodb.conditions import Key
 
 import boto3
+
+from lib.ddb_metrics import instrument_table
+from lib.scan_engine import scan_all
+from lib.schema_version import is_schema_stamp
+from lib.tracing import span, traced
+
 _table_cache: Dict[str, Any] = {}
 dynamodb = boto3.resource("dynamodb")
 
@@ -20,7 +26,7 @@ def _table(env_var_name: str):
             table_name = os.environ["MANAGED_SCHEMA_TABLE"]
         else:
             raise
-    table = dynamodb.Table(table_name)
+    table = instrument_table(dynamodb.Table(table_name))
     _table_cache[env_var_name] = table
     return table
 
@@ -47,6 +53,7 @@ def get_user(user_id: str) -> Optional[Dict[str, Any]]:
     return resp.get("Item")
 
 
+@traced("auth.ensure_actor_can_manage_child")
 def ensure_actor_can_manage_child(actor_id: str, child_id: str) -> Dict[str, Any]:
     actor = get_user(actor_id)
     if not actor:
@@ -109,6 +116,7 @@ def _fetch_age_threshold(country: Optional[str]) -> Optional[int]:
     return None
 
 
+@traced("resolver.build_user_context")
 def build_user_context(user_id: str) -> Dict[str, Any]:
     user = get_user(user_id) or {}
     birth_date = _parse_birth_date(user.get("birthDate"))
@@ -128,21 +136,6 @@ def build_user_context(user_id: str) -> Dict[str, Any]:
     }
 
 
-def _scan_all(table):
-    items = []
-    start_key = None
-    while True:
-        params = {}
-        if start_key:
-            params["ExclusiveStartKey"] = start_key
-        response = table.scan(**params)
-        items.extend(response.get("Items", []))
-        start_key = response.get("LastEvaluatedKey")
-        if not start_key:
-            break
-    return items
-
-
 def _normalize_value(value: Any):
     if isinstance(value, Decimal):
         if value % 1 == 0:
@@ -153,7 +146,9 @@ def _normalize_value(value: Any):
 
 def resolve_managed_defaults(user_ctx: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
     managed_table = _table("MANAGED_PREFERENCES_TABLE")
-    managed_items = _scan_all(managed_table)
+    with span("resolver.schema_scan") as scan_span:
+        managed_items = [item for item in scan_all(managed_table) if not is_schema_stamp(item)]
+        scan_span.set_attribute("schema.rows", len(managed_items))
     resolved = {}
     for item in managed_items:
         pref_key = item.get("preferenceKey")
@@ -200,6 +195,7 @@ def resolve_single_default(schema: Dict[str, Any], user_ctx: Dict[str, Any]) ->
     }
 
 
+@traced("resolver.merge_preferences")
 def merge_preferences(user_items, defaults, include_defaults: bool):
     merged = {}
     for item in user_items:
@@ -0,0 +1,128 @@
+"""
+Opt-in CPU / memory profiling of single handler invocations.
+
+An invocation is profiled when either
+  * it is sampled: PROFILE_SAMPLE_RATE is a fraction in (0, 1], or
+  * it carries a valid ``X-Profile-Request`` header: ``<unix-ts>.<hex hmac>`` where the
+    HMAC-SHA256 is computed with PROFILE_SIGNING_SECRET over ``"<unix-ts>.<function>"``
+    and the timestamp is at most PROFILE_SIGNATURE_MAX_AGE seconds old.
+
+The profile (cProfile stats plus tracemalloc peak) is reduced to a compact top-N
+summary that is printed as one JSON log line, or written to PROFILE_OUTPUT_DIR
+together with the raw ``.pstats`` file when that variable is set.
+"""
+
+import cProfile
+import hashlib
+import hmac
+import json
+import os
+import pstats
+import random
+import time
+import tracemalloc
+from typing import Any, Dict, Optional
+
+PROFILE_HEADER = "x-profile-request"
+
+
+def _float_env(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def sign_profile_request(secret: str, function_name: str, timestamp: Optional[int] = None) -> str:
+    timestamp = int(time.time()) if timestamp is None else int(timestamp)
+    message = f"{timestamp}.{function_name}".encode("utf-8")
+    digest = hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+    return f"{timestamp}.{digest}"
+
+
+def _header(event: Dict[str, Any], name: str) -> Optional[str]:
+    headers = event.get("headers") or {}
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _valid_signature(value: Optional[str], function_name: str) -> bool:
+    secret = os.environ.get("PROFILE_SIGNING_SECRET")
+    if not (secret and value) or "." not in value:
+        return False
+    timestamp_raw, _, _ = value.partition(".")
+    try:
+        timestamp = int(timestamp_raw)
+    except ValueError:
+        return False
+    max_age = _float_env("PROFILE_SIGNATURE_MAX_AGE", 300)
+    if abs(time.time() - timestamp) > max_age:
+        return False
+    expected = sign_profile_request(secret, function_name, timestamp)
+    return hmac.compare_digest(expected, value)
+
+
+def should_profile(event: Any, function_name: str) -> bool:
+    if isinstance(event, dict) and _valid_signature(_header(event, PROFILE_HEADER), function_name):
+        return True
+    rate = _float_env("PROFILE_SAMPLE_RATE", 0.0)
+    return rate > 0 and random.random() < rate
+
+
+def _summarize(profiler: cProfile.Profile, top_n: int) -> Dict[str, Any]:
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, func), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        rows.append(
+            {
+                "function": f"{os.path.basename(filename)}:{line}({func})",
+                "ncalls": ncalls,
+                "tottimeMs": round(tottime * 1000, 3),
+                "cumtimeMs": round(cumtime * 1000, 3),
+            }
+        )
+    rows.sort(key=lambda row: row["cumtimeMs"], reverse=True)
+    return {"totalCalls": stats.total_calls, "top": rows[:top_n]}
+
+
+def run_profiled(function_name: str, handler, event, context):
+    top_n = int(_float_env("PROFILE_TOP_N", 20))
+    started_tracemalloc = not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        return handler(event, context)
+    finally:
+        profiler.disable()
+        wall_ms = (time.perf_counter() - start) * 1000
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        if started_tracemalloc:
+            tracemalloc.stop()
+
+        summary = {
+            "profile": function_name,
+            "wallMs": round(wall_ms, 3),
+            "peakTracedMemoryKiB": round(peak_bytes / 1024, 1),
+        }
+        summary.update(_summarize(profiler, top_n))
+        _emit(function_name, summary, profiler)
+
+
+def _emit(function_name: str, summary: Dict[str, Any], profiler: cProfile.Profile):
+    output_dir = os.environ.get("PROFILE_OUTPUT_DIR")
+    if not output_dir:
+        print("[Profile]", json.dumps(summary))
+        return
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.join(output_dir, f"{function_name}-{int(time.time() * 1000)}")
+    profiler.dump_stats(f"{stem}.pstats")
+    with open(f"{stem}.json", "w", encoding="utf-8") as fh:
+        json.dump(summary, fh, indent=2)
+    print(f"[Profile] function={function_name} wallMs={summary['wallMs']} written={stem}.json")
@@ -0,0 +1,236 @@
+"""
+Applies queued preference writes (``lib.write_queue``) in batches.
+
+Updates to the same (user, key) within a batch are coalesced, so the value
+accepted last wins. The result is checked with ``ensure_preference_value_allowed``
+against the user's context, built once per user. A blocked change is logged and
+dropped, because retrying it would not help.
+
+A change is skipped when the stored value is newer than its ``acceptedAt``,
+since a synchronous write landed after it was accepted. In items mode, the
+current rows are read with BatchGetItem and the new ones written with
+BatchWriteItem.
+Version rows take their numbers from the per-key counters and are batch-written
+as well. In dual/document mode, each user's changes are one store session commit.
+The touched users' EffectivePreferences items are deleted, so their next read
+resolves live.
+
+Flush messages of the coalescing window (``lib.write_coalescing``) bring in the
+pending rows they name as one more change per key. Those rows are settled once
+the batch is written.
+
+With an outbox (``lib.outbox``), one change event per user and actor is recorded
+after the batch is written. This happens outside a transaction: a batch that fails
+part-way is redelivered and applied again, so its events are still recorded,
+possibly twice.
+"""
+
+import random
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from lib.outbox import build_event, change as event_change
+from lib.preference_versions import build_version_item, next_sequence
+from lib.preferences_resolver import build_user_context, ensure_preference_value_allowed, load_managed_schema
+
+MAX_ATTEMPTS = 6
+
+
+def coalesce(messages: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """``{userId: {preferenceKey: {"value", "acceptedAt", "actorId", "updates"}}}``; the last accepted wins."""
+    latest: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    def accepted(message):
+        return message.get("acceptedAt") or "", message.get("acceptedNs") or 0, message.get("messageId") or ""
+
+    for message in sorted(messages, key=accepted):
+        changes = latest.setdefault(message["userId"], {})
+        for pref in message.get("preferences") or []:
+            key = pref.get("preferenceKey")
+            if not key:
+                continue
+            updates = int(pref.get("updates") or 1) + (changes[key]["updates"] if key in changes else 0)
+            changes[key] = {
+                "value": pref.get("value"),
+                "acceptedAt": message["acceptedAt"],
+                "actorId": message.get("actorId"),
+                "updates": updates,
+            }
+    return latest
+
+
+def _pending_message(row: Dict[str, Any]) -> Dict[str, Any]:
+    """A pending coalesced row as a queued write of its final value."""
+    return {
+        "userId": row["userId"],
+        "actorId": row.get("actorId"),
+        "acceptedAt": row["lastAt"],
+        "acceptedNs": int(row["lastNs"]),
+        "preferences": [
+            {"preferenceKey": row["preferenceKey"], "value": row.get("value"), "updates": int(row.get("updates") or 1)}
+        ],
+    }
+
+
+def _schema_by_key() -> Dict[str, Dict[str, Any]]:
+    schema: Dict[str, Dict[str, Any]] = {}
+    for item in sorted(load_managed_schema(), key=lambda row: str(row.get("scope") or "")):
+        schema.setdefault(item.get("preferenceKey"), item)
+    return schema
+
+
+def _backoff(attempt: int):
+    time.sleep(min(2.0, 0.05 * (2**attempt)) * random.random())
+
+
+def _batch_get(client, table_name: str, keys: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    items = []
+    for start in range(0, len(keys), 100):
+        request = {table_name: {"Keys": keys[start : start + 100]}}
+        attempt = 0
+        while request:
+            response = client.batch_get_item(RequestItems=request)
+            for item in response.get("Responses", {}).get(table_name, []):
+                items.append(item)
+            request = response.get("UnprocessedKeys") or None
+            if request:
+                attempt += 1
+                if attempt >= MAX_ATTEMPTS:
+                    raise RuntimeError(f"{table_name}: keys still unprocessed after {MAX_ATTEMPTS} attempts")
+                _backoff(attempt)
+    return items
+
+
+def _batch_write(client, table_name: str, requests: List[Dict[str, Any]]):
+    for start in range(0, len(requests), 25):
+        pending = {table_name: requests[start : start + 25]}
+        for attempt in range(MAX_ATTEMPTS):
+            pending = client.batch_write_item(RequestItems=pending).get("UnprocessedItems") or {}
+            if not pending:
+                break
+            _backoff(attempt)
+        else:
+            raise RuntimeError(f"{table_name}: batch still unprocessed after {MAX_ATTEMPTS} attempts")
+
+
+def _put_request(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {"PutRequest": {"Item": {k: v for k, v in item.items() if v is not None}}}
+
+
+def _stored_value(value: Any) -> str:
+    return str(value) if value is not None else ""
+
+
+def _allowed_changes(latest, report) -> Dict[str, List[Tuple[str, Dict[str, Any]]]]:
+    schema = _schema_by_key()
+    allowed: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+    for user_id, changes in latest.items():
+        user_ctx = build_user_context(user_id)
+        for key, change in changes.items():
+            try:
+                ensure_preference_value_allowed(schema.get(key) or {}, user_ctx, change["value"])
+            except PermissionError as rule_err:
+                report["blocked"] += 1
+                print(
+                    "[PreferenceBlocked] "
+                    f"userId={user_id} actorId={change['actorId'] or 'unknown'} "
+                    f"preferenceKey={key} reason={rule_err} mode=async"
+                )
+                continue
+            allowed.setdefault(user_id, []).append((key, change))
+    return allowed
+
+
+def apply_queued_writes(
+    messages: Iterable[Dict[str, Any]],
+    store,
+    client,
+    versions_table,
+    effective_table_name: Optional[str] = None,
+    coalescer=None,
+    outbox=None,
+) -> Dict[str, Any]:
+    """
+    Applies a batch of queued messages. ``client`` is the (instrumented) client of
+    the DynamoDB resource, which takes and returns plain Python values;
+    ``versions_table`` is the PreferenceVersions table.
+    """
+    messages = list(messages)
+    writes = [message for message in messages if message.get("kind") != "flush"]
+    pending_rows = []
+    if coalescer is not None:
+        pairs = [
+            (message["userId"], key)
+            for message in messages
+            if message.get("kind") == "flush"
+            for key in message.get("preferenceKeys") or []
+        ]
+        pending_rows = coalescer.pending(client, pairs) if pairs else []
+    latest = coalesce(writes + [_pending_message(row) for row in pending_rows])
+    report = {
+        "messages": len(messages),
+        "flushed": len(pending_rows),
+        "updates": sum(change["updates"] for changes in latest.values() for change in changes.values()),
+        "written": 0,
+        "blocked": 0,
+        "superseded": 0,
+    }
+    allowed = _allowed_changes(latest, report)
+
+    # (userId, key, old value, new value, updates, actorId)
+    written: List[Tuple[str, str, Any, str, int, Optional[str]]] = []
+    if store.mode == "items":
+        table_name = store.preferences_table.table_name
+        keys = [{"userId": user_id, "preferenceKey": key} for user_id, changes in allowed.items() for key, _ in changes]
+        current = {(item["userId"], item["preferenceKey"]): item for item in _batch_get(client, table_name, keys)}
+        puts = []
+        for user_id, changes in allowed.items():
+            for key, change in changes:
+                existing = current.get((user_id, key)) or {}
+                if str(existing.get("updatedAt") or "") > change["acceptedAt"]:
+                    report["superseded"] += 1
+                    continue
+                value = _stored_value(change["value"])
+                puts.append(
+                    _put_request(
+                        {"userId": user_id, "preferenceKey": key, "value": value, "updatedAt": change["acceptedAt"]}
+                    )
+                )
+                written.append((user_id, key, existing.get("value"), value, change["updates"], change["actorId"]))
+        _batch_write(client, table_name, puts)
+    else:
+        for user_id, changes in allowed.items():
+            session = store.session(user_id)
+            for key, change in changes:
+                existing = session.current(key) or {}
+                if str(existing.get("updatedAt") or "") > change["acceptedAt"]:
+                    report["superseded"] += 1
+                    continue
+                value = _stored_value(change["value"])
+                session.put({"userId": user_id, "preferenceKey": key, "value": value, "updatedAt": change["acceptedAt"]})
+                written.append((user_id, key, existing.get("value"), value, change["updates"], change["actorId"]))
+            session.commit()
+
+    versions = []
+    for user_id, key, old, new, updates, _ in written:
+        item = build_version_item(user_id, key, old, new, "UPSERT", next_sequence(versions_table, user_id, key))
+        if updates > 1:
+            item["coalescedUpdates"] = updates
+        versions.append(_put_request(item))
+    _batch_write(client, versions_table.table_name, versions)
+
+    if effective_table_name:
+        touched = sorted({change[0] for change in written})
+        invalidations = [{"DeleteRequest": {"Key": {"userId": user_id}}} for user_id in touched]
+        _batch_write(client, effective_table_name, invalidations)
+
+    if outbox is not None and written:
+        grouped: Dict[Tuple[str, Optional[str]], List[Dict[str, Any]]] = {}
+        for user_id, key, old, new, _, actor_id in written:
+            grouped.setdefault((user_id, actor_id), []).append(event_change(key, old, new))
+        outbox.record(build_event(user, actor, "UPSERT", changes) for (user, actor), changes in grouped.items())
+        report["events"] = len(grouped)
+
+    report["written"] = len(written)
+    report["requeued"] = coalescer.settle(pending_rows) if pending_rows else 0
+    return report
@@ -0,0 +1,256 @@
+"""
+Parallel segmented Scan with a streaming interface.
+
+``scan_items`` yields items and ``scan_pages`` yields ``ScanPage`` objects (segment,
+items, LastEvaluatedKey, consumed capacity) as they arrive. With one segment the
+scan runs inline in the caller's thread, exactly like a page-by-page loop. With
+more, every segment is scanned by a worker thread and pages are handed over
+through a bounded queue: when the consumer falls behind, workers block on the
+queue instead of buffering the table in memory (backpressure).
+
+Workers run in a copy of the caller's ``contextvars`` context so DynamoDB metrics
+(``lib.ddb_metrics``) and tracing spans (``lib.tracing``) are attributed to the
+invocation that started the scan. boto3 resources are not thread-safe, so a
+boto3 ``Table`` is scanned through its (thread-safe) low-level client, which the
+resource has already set up to take and return plain Python values.
+
+Jobs that fan segments out over their own threads and write from them use
+``ThreadLocalDynamoDB`` in place of ``boto3.resource("dynamodb")``.
+
+Every request asks for ``ReturnConsumedCapacity``, so ``ScanPage.consumed_capacity``
+is filled in whether or not DynamoDB metrics are enabled.
+
+Defaults come from SCAN_TOTAL_SEGMENTS (1), SCAN_MAX_WORKERS (= segments) and
+SCAN_MAX_BUFFERED_PAGES (2 per worker).
+"""
+
+import contextvars
+import os
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import boto3
+
+from lib.ddb_metrics import InstrumentedTable, instrument_client
+
+_DONE = object()
+
+
+def _int_env(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+class ThreadLocalDynamoDB:
+    """
+    Stand-in for ``boto3.resource("dynamodb")`` whose ``Table`` handles resolve to a
+    resource of the calling thread. The resources come from one session, so the
+    clients' exception classes are shared.
+    """
+
+    def __init__(self, **resource_kwargs):
+        self._session = boto3.session.Session()
+        self._resource_kwargs = resource_kwargs
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _resource(self):
+        resource = getattr(self._local, "resource", None)
+        if resource is None:
+            with self._lock:  # sessions are not thread-safe either
+                resource = self._session.resource("dynamodb", **self._resource_kwargs)
+            self._local.resource = resource
+            self._local.tables = {}
+        return resource
+
+    def thread_table(self, table_name: str):
+        resource = self._resource()
+        tables = self._local.tables
+        if table_name not in tables:
+            tables[table_name] = resource.Table(table_name)
+        return tables[table_name]
+
+    @property
+    def meta(self):
+        return self._resource().meta
+
+    def Table(self, table_name: str) -> "_ThreadLocalTable":  # noqa: N802 - mirrors boto3
+        return _ThreadLocalTable(self, table_name)
+
+
+class _ThreadLocalTable:
+    def __init__(self, dynamodb: ThreadLocalDynamoDB, table_name: str):
+        self.name = self.table_name = table_name
+        self._dynamodb = dynamodb
+
+    def __getattr__(self, name):
+        return getattr(self._dynamodb.thread_table(self.table_name), name)
+
+    def __repr__(self):
+        return f"ThreadLocalTable({self.table_name!r})"
+
+
+class ScanPage:
+    __slots__ = ("segment", "items", "last_evaluated_key", "consumed_capacity")
+
+    def __init__(self, segment: int, items: List[Dict[str, Any]], last_evaluated_key, consumed_capacity: float):
+        self.segment = segment
+        self.items = items
+        self.last_evaluated_key = last_evaluated_key
+        self.consumed_capacity = consumed_capacity
+
+
+class _Failure:
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _scan_params(
+    total_segments: int,
+    segment: int,
+    projection: Optional[Iterable[str]],
+    page_size: Optional[int],
+    extra: Dict[str, Any],
+) -> Dict[str, Any]:
+    params = dict(extra)
+    params.setdefault("ReturnConsumedCapacity", "TOTAL")
+    if total_segments > 1:
+        params["Segment"] = segment
+        params["TotalSegments"] = total_segments
+    if projection:
+        names = {f"#p{index}": name for index, name in enumerate(projection)}
+        params["ProjectionExpression"] = ", ".join(names)
+        params.setdefault("ExpressionAttributeNames", {}).update(names)
+    if page_size:
+        params["Limit"] = page_size
+    return params
+
+
+def _scan_call(table) -> Callable[..., Dict[str, Any]]:
+    """``Scan`` through a boto3 table's client (shareable across threads), else ``table.scan``."""
+    meta = getattr(table, "meta", None)
+    if meta is None or not hasattr(meta, "client"):
+        return table.scan
+    client = instrument_client(meta.client) if isinstance(table, InstrumentedTable) else meta.client
+    table_name = table.name
+
+    def scan(**params):
+        return client.scan(TableName=table_name, **params)
+
+    return scan
+
+
+def _segment_pages(scan, segment: int, start_key, params: Dict[str, Any]) -> Iterator[ScanPage]:
+    while True:
+        request = dict(params)
+        if start_key:
+            request["ExclusiveStartKey"] = start_key
+        response = scan(**request)
+        start_key = response.get("LastEvaluatedKey")
+        consumed = float((response.get("ConsumedCapacity") or {}).get("CapacityUnits") or 0)
+        yield ScanPage(segment, response.get("Items", []), start_key, consumed)
+        if not start_key:
+            return
+
+
+def scan_pages(
+    table,
+    total_segments: Optional[int] = None,
+    max_workers: Optional[int] = None,
+    projection: Optional[Iterable[str]] = None,
+    page_size: Optional[int] = None,
+    segments: Optional[Iterable[int]] = None,
+    start_keys: Optional[Dict[int, Any]] = None,
+    max_buffered_pages: Optional[int] = None,
+    **scan_kwargs,
+) -> Iterator[ScanPage]:
+    """
+    Streams scan pages of ``table`` (a boto3 Table or anything with ``scan(**kw)``).
+
+    ``segments`` restricts the scan to a subset of segments and ``start_keys`` resumes
+    segments from a LastEvaluatedKey, which lets callers checkpoint per segment.
+    Any other keyword (FilterExpression, ExpressionAttributeValues, ...) is passed
+    to every Scan request.
+    """
+    total_segments = total_segments or _int_env("SCAN_TOTAL_SEGMENTS", 1)
+    segment_ids = list(range(total_segments) if segments is None else segments)
+    start_keys = start_keys or {}
+    params_by_segment = {
+        segment: _scan_params(total_segments, segment, projection, page_size, scan_kwargs) for segment in segment_ids
+    }
+    workers = min(max_workers or _int_env("SCAN_MAX_WORKERS", total_segments), len(segment_ids))
+    scan = _scan_call(table)
+
+    if workers <= 1:
+        for segment in segment_ids:
+            yield from _segment_pages(scan, segment, start_keys.get(segment), params_by_segment[segment])
+        return
+
+    buffered = max_buffered_pages or _int_env("SCAN_MAX_BUFFERED_PAGES", 2 * workers)
+    pages: "queue.Queue[Any]" = queue.Queue(maxsize=buffered)
+    pending: "queue.Queue[int]" = queue.Queue()
+    for segment in segment_ids:
+        pending.put(segment)
+    stop = threading.Event()
+
+    def offer(item) -> bool:
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker():
+        try:
+            while not stop.is_set():
+                try:
+                    segment = pending.get_nowait()
+                except queue.Empty:
+                    return
+                for page in _segment_pages(scan, segment, start_keys.get(segment), params_by_segment[segment]):
+                    if not offer(page):
+                        return
+        except BaseException as err:  # handed to the consumer and re-raised there
+            offer(_Failure(err))
+        finally:
+            offer(_DONE)
+
+    threads = [
+        threading.Thread(target=contextvars.copy_context().run, args=(worker,), daemon=True, name=f"scan-{index}")
+        for index in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    finished = 0
+    try:
+        while finished < workers:
+            item = pages.get()
+            if item is _DONE:
+                finished += 1
+            elif isinstance(item, _Failure):
+                raise item.error
+            else:
+                yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def scan_items(table, **options) -> Iterator[Dict[str, Any]]:
+    """Streams the items of ``table``; takes the same options as ``scan_pages``."""
+    for page in scan_pages(table, **options):
+        yield from page.items
+
+
+def scan_all(table, **options) -> List[Dict[str, Any]]:
+    """Materializes a scan; for call sites that genuinely need every item at once."""
+    return list(scan_items(table, **options))
@@ -0,0 +1,98 @@
+"""
+Which users a ManagedPreferenceSchema change affects.
+
+A key's default depends only on the user's cohort: whether they are a child,
+their country and their age. A change therefore affects a bounded set of
+cohorts. Countries are the ones named in the changed rows' ``countryOverrides``,
+plus "any other". Ages fall into bands split at each ``minAge`` and at
+``maxAge + 1``, plus "unknown". ``affected_cohorts`` resolves every candidate
+cohort against the rows before and after the change and keeps the ones whose
+defaults differ. ``cohort_of`` maps a user context onto the same candidates.
+"""
+
+from bisect import bisect_right
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from lib.preferences_resolver import _parse_int, _resolve_single_default
+
+# (is_child, country or None for "any other", lower bound of the age band or None)
+Cohort = Tuple[bool, Optional[str], Optional[int]]
+
+
+def _row_key(row: Dict[str, Any]) -> Tuple[str, str]:
+    return row["preferenceKey"], str(row.get("scope") or "")
+
+
+def schema_delta(changes: Iterable[Dict[str, Any]], current_rows: Iterable[Dict[str, Any]]):
+    """
+    ``{preferenceKey: (rows before, rows after)}`` for every key touched by
+    ``changes`` (change records, oldest first). ``current_rows`` is the schema
+    now; the "before" rows are it with the changed rows rolled back.
+    """
+    original: Dict[Tuple[str, str], Optional[Dict[str, Any]]] = {}
+    for change in changes:
+        before = {_row_key(row): row for row in change.get("before") or []}
+        touched = [_row_key(row) for row in change.get("after") or []]
+        touched += [_row_key(key) for key in change.get("deleted") or []]
+        for row_key in touched:
+            original.setdefault(row_key, before.get(row_key))
+
+    keys = {key for key, _ in original}
+    after = {_row_key(row): row for row in current_rows if row.get("preferenceKey") in keys}
+    before = dict(after)
+    for row_key, row in original.items():
+        if row is None:
+            before.pop(row_key, None)
+        else:
+            before[row_key] = row
+
+    delta = {}
+    for key in sorted(keys):
+        delta[key] = (
+            [row for row_key, row in sorted(before.items()) if row_key[0] == key],
+            [row for row_key, row in sorted(after.items()) if row_key[0] == key],
+        )
+    return delta
+
+
+def cohort_dimensions(delta) -> Tuple[List[str], List[int]]:
+    """Countries named by the changed rows and the age-band boundaries."""
+    countries: Set[str] = set()
+    boundaries: Set[int] = {0}
+    for before, after in delta.values():
+        for row in before + after:
+            countries.update((row.get("countryOverrides") or {}).keys())
+            min_age = _parse_int(row.get("minAge"))
+            max_age = _parse_int(row.get("maxAge"))
+            if min_age is not None:
+                boundaries.add(min_age)
+            if max_age is not None:
+                boundaries.add(max_age + 1)
+    return sorted(countries), sorted(boundaries)
+
+
+def cohort_of(user_ctx: Dict[str, Any], countries: List[str], boundaries: List[int]) -> Cohort:
+    country = user_ctx.get("country")
+    age = user_ctx.get("age")
+    band = None if age is None else boundaries[max(0, bisect_right(boundaries, age) - 1)]
+    return bool(user_ctx.get("is_child")), country if country in countries else None, band
+
+
+def _default(rows: List[Dict[str, Any]], user_ctx: Dict[str, Any]):
+    # Resolution uses the first row of a key (scope order), as get_managed_preference does.
+    if not rows:
+        return None
+    resolved = _resolve_single_default(rows[0], user_ctx)
+    return (resolved["value"], resolved["source"]) if resolved else None
+
+
+def affected_cohorts(delta) -> Set[Cohort]:
+    countries, boundaries = cohort_dimensions(delta)
+    affected = set()
+    for is_child in (False, True):
+        for country in countries + [None]:
+            for band in boundaries + [None]:
+                user_ctx = {"is_child": is_child, "country": country, "age": band, "user": {}}
+                if any(_default(before, user_ctx) != _default(after, user_ctx) for before, after in delta.values()):
+                    affected.add((is_child, country, band))
+    return affected
@@ -0,0 +1,160 @@
+"""
+Version stamp for ManagedPreferenceSchema.
+
+The stamp is a single item in the schema table itself
+(``preferenceKey="#schema"``, ``scope="#version"``) holding a counter that every
+schema write bumps *after* the rows are written. Readers compare the counter with
+the one they loaded the schema at and only rescan when it moved; the counter is
+also what ``/default-preferences`` ETags are derived from.
+
+Every ``write_schema_items`` call also stores a change record with the rows it
+replaced and wrote in SCHEMA_CHANGES_TABLE (``stream="schema"``,
+``changeId=<version>``), which ``jobs.propagate_schema_change`` uses to recompute
+only the users the change affects. The records live outside the schema table so
+the resolvers' full scans never read them; records an older release left in the
+schema table (``preferenceKey="#change"``) are deleted by the next publish. Materialized effective preferences resolved at an older
+version stay valid from the stamp's ``viewFloor`` on; a bump removes the floor
+(every older view is stale) and the propagation job restores it once the
+affected users are recomputed.
+"""
+
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from boto3.dynamodb.conditions import Key
+
+from lib.ddb_metrics import instrument_table
+
+SCHEMA_STAMP_KEY = {"preferenceKey": "#schema", "scope": "#version"}
+CHANGE_STREAM = "schema"
+# Partition of the change records older releases kept in the schema table.
+LEGACY_CHANGE_KEY = "#change"
+
+
+def open_schema_changes_table(dynamodb):
+    return instrument_table(dynamodb.Table(os.environ["SCHEMA_CHANGES_TABLE"]))
+
+
+def _change_id(version: int) -> str:
+    return f"{version:010d}"
+
+
+def is_schema_stamp(item: Dict[str, Any]) -> bool:
+    return str(item.get("preferenceKey") or "").startswith("#")
+
+
+def read_schema_stamp(table) -> Dict[str, Optional[int]]:
+    """``{"version", "viewFloor"}`` of the stamp (None when absent)."""
+    item = table.get_item(Key=SCHEMA_STAMP_KEY).get("Item") or {}
+    return {
+        "version": int(item["version"]) if "version" in item else None,
+        "viewFloor": int(item["viewFloor"]) if "viewFloor" in item else None,
+    }
+
+
+def read_schema_version(table) -> Optional[int]:
+    return read_schema_stamp(table)["version"]
+
+
+def bump_schema_version(table) -> int:
+    response = table.update_item(
+        Key=SCHEMA_STAMP_KEY,
+        UpdateExpression="ADD #v :one SET updatedAt = :now REMOVE viewFloor",
+        ExpressionAttributeNames={"#v": "version"},
+        ExpressionAttributeValues={
+            ":one": 1,
+            ":now": datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+        },
+        ReturnValues="UPDATED_NEW",
+    )
+    return int(response["Attributes"]["version"])
+
+
+def set_view_floor(table, version: int, floor: Optional[int]) -> bool:
+    """Marks views resolved at ``floor``.. as valid at ``version``; False if the stamp moved on."""
+    if floor is None or floor >= version:
+        return False
+    try:
+        table.update_item(
+            Key=SCHEMA_STAMP_KEY,
+            UpdateExpression="SET viewFloor = :floor",
+            ConditionExpression="#v = :version",
+            ExpressionAttributeNames={"#v": "version"},
+            ExpressionAttributeValues={":floor": floor, ":version": version},
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def _legacy_change_keys(table) -> List[Dict[str, str]]:
+    params = {
+        "KeyConditionExpression": Key("preferenceKey").eq(LEGACY_CHANGE_KEY),
+        "ProjectionExpression": "preferenceKey, #scope",
+        "ExpressionAttributeNames": {"#scope": "scope"},
+    }
+    keys = []
+    while True:
+        response = table.query(**params)
+        keys.extend(response.get("Items", []))
+        if not response.get("LastEvaluatedKey"):
+            return keys
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def write_schema_items(
+    table,
+    changes_table,
+    items: Iterable[Dict[str, Any]],
+    deletes: Iterable[Dict[str, str]] = (),
+) -> int:
+    """
+    Puts / deletes schema rows, then bumps the stamp and records the change in
+    ``changes_table``; returns the new version.
+    """
+    items, deletes = list(items), list(deletes)
+    for item in items:
+        if is_schema_stamp(item):
+            raise ValueError("Schema rows may not use the reserved '#' key prefix")
+
+    stamp = read_schema_stamp(table)
+    keys = [{"preferenceKey": item["preferenceKey"], "scope": item["scope"]} for item in items] + list(deletes)
+    before = [row for row in (table.get_item(Key=key).get("Item") for key in keys) if row]
+
+    with table.batch_writer(overwrite_by_pkeys=["preferenceKey", "scope"]) as batch:
+        for item in items:
+            batch.put_item(Item=item)
+        for key in deletes + _legacy_change_keys(table):
+            batch.delete_item(Key=key)
+    version = bump_schema_version(table)
+
+    previous = stamp["version"]
+    changes_table.put_item(
+        Item={
+            "stream": CHANGE_STREAM,
+            "changeId": _change_id(version),
+            "version": version,
+            "before": before,
+            "after": items,
+            "deleted": deletes,
+            # Oldest view version still valid before this change.
+            **({"previousFloor": stamp["viewFloor"] or previous} if previous is not None else {}),
+        }
+    )
+    return version
+
+
+def read_schema_changes(changes_table, from_version: int, to_version: int) -> List[Dict[str, Any]]:
+    """Change records of versions ``from_version`` (exclusive) .. ``to_version``, oldest first."""
+    params = {
+        "KeyConditionExpression": Key("stream").eq(CHANGE_STREAM)
+        & Key("changeId").between(_change_id(from_version + 1), _change_id(to_version)),
+    }
+    changes = []
+    while True:
+        response = changes_table.query(**params)
+        changes.extend(response.get("Items", []))
+        if not response.get("LastEvaluatedKey"):
+            return changes
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
@@ -0,0 +1,239 @@
+"""
+Lightweight stage-level tracing.
+
+Spans follow the OpenTelemetry data model (trace/span ids, parent ids, unix-nano
+timestamps, typed attributes, status) and are exported as OTLP/JSON so they can be
+loaded into any OTel-compatible backend. Tracing is off unless TRACING_ENABLED is set;
+when disabled, ``span()`` returns a shared no-op object and ``traced`` adds a single
+boolean check per call.
+
+Environment:
+    TRACING_ENABLED   "1"/"true" to record spans
+    TRACE_EXPORT      "stdout" (default) or a file path; traces are appended one per line
+    TRACE_FORMAT      "otlp" (default, OTLP/JSON) or "tree" (indented human-readable tree)
+"""
+
+import contextvars
+import functools
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "user-preferences-service")
+
+
+def _env_enabled() -> bool:
+    return os.environ.get("TRACING_ENABLED", "").lower() in ("1", "true", "yes", "on")
+
+
+_enabled = _env_enabled()
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def set_enabled(value: bool):
+    global _enabled
+    _enabled = bool(value)
+
+
+def _otel_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Span:
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_span_id",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "status_code",
+        "status_message",
+        "_trace",
+        "_token",
+    )
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent.span_id if parent else None
+        self.attributes = dict(attributes)
+        self.start_ns = 0
+        self.end_ns = 0
+        self.status_code = "STATUS_CODE_UNSET"
+        self.status_message = ""
+        self._trace: List["Span"] = parent._trace if parent else []
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        if exc is not None:
+            self.status_code = "STATUS_CODE_ERROR"
+            self.status_message = f"{exc_type.__name__}: {exc}"
+        elif self.status_code == "STATUS_CODE_UNSET":
+            self.status_code = "STATUS_CODE_OK"
+        _current_span.reset(self._token)
+        self._trace.append(self)
+        if self.parent_span_id is None:
+            _exporter.export(list(self._trace))
+        return False
+
+    def to_otel(self) -> Dict[str, Any]:
+        data = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": "SPAN_KIND_INTERNAL" if self.parent_span_id else "SPAN_KIND_SERVER",
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [
+                {"key": key, "value": _otel_value(value)} for key, value in self.attributes.items()
+            ],
+            "status": {"code": self.status_code},
+        }
+        if self.parent_span_id:
+            data["parentSpanId"] = self.parent_span_id
+        if self.status_message:
+            data["status"]["message"] = self.status_message
+        return data
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+_current_span: contextvars.ContextVar = contextvars.ContextVar("tracing_current_span", default=None)
+
+
+def span(name: str, **attributes):
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, _current_span.get(), attributes)
+
+
+def traced(name: str):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with Span(name, _current_span.get(), {}):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def to_otlp(spans: List[Span]) -> Dict[str, Any]:
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {"key": "service.name", "value": {"stringValue": SERVICE_NAME}},
+                    ]
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": "lib.tracing"},
+                        "spans": [s.to_otel() for s in sorted(spans, key=lambda s: s.start_ns)],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+def render_tree(spans: List[Span]) -> str:
+    children: Dict[Optional[str], List[Span]] = {}
+    for s in spans:
+        children.setdefault(s.parent_span_id, []).append(s)
+
+    lines = []
+
+    def walk(parent_id: Optional[str], depth: int):
+        for s in sorted(children.get(parent_id, []), key=lambda item: item.start_ns):
+            duration_ms = (s.end_ns - s.start_ns) / 1e6
+            attrs = " ".join(f"{k}={v}" for k, v in s.attributes.items())
+            status = " ERROR" if s.status_code == "STATUS_CODE_ERROR" else ""
+            lines.append(f"{'  ' * depth}{s.name} {duration_ms:.3f}ms{status}{(' ' + attrs) if attrs else ''}")
+            walk(s.span_id, depth + 1)
+
+    walk(None, 0)
+    return "\n".join(lines)
+
+
+class LocalSpanExporter:
+    """Writes each finished trace to stdout or appends it to a file."""
+
+    def __init__(self, destination: str = "stdout", fmt: str = "otlp"):
+        self.destination = destination
+        self.fmt = fmt
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span]):
+        if self.fmt == "tree":
+            payload = f"trace {spans[0].trace_id}\n{render_tree(spans)}\n"
+        else:
+            payload = json.dumps(to_otlp(spans)) + "\n"
+        with self._lock:
+            if self.destination in ("", "stdout", "-"):
+                sys.stdout.write(payload)
+                sys.stdout.flush()
+            else:
+                with open(self.destination, "a", encoding="utf-8") as fh:
+                    fh.write(payload)
+
+
+class InMemorySpanExporter:
+    def __init__(self):
+        self.traces: List[List[Span]] = []
+
+    def export(self, spans: List[Span]):
+        self.traces.append(spans)
+
+
+_exporter: Any = LocalSpanExporter(
+    os.environ.get("TRACE_EXPORT", "stdout"),
+    os.environ.get("TRACE_FORMAT", "otlp"),
+)
+
+
+def set_exporter(exporter) -> Any:
+    global _exporter
+    previous, _exporter = _exporter, exporter
+    return previous
@@ -0,0 +1,186 @@
+"""
+Cold tier of PreferenceVersions.
+
+``jobs.archive_preference_versions`` compacts a user's version rows into one gzip
+NDJSON blob per calendar month (``versions/<userId>/<YYYY-MM>.ndjson.gz``) in the
+object store at VERSION_ARCHIVE_LOCATION, then marks the rows with ``archivedAt``
+and an ``expiresAt`` TTL of VERSION_RETENTION_DAYS after they were written (never
+earlier than the moment they were archived), so DynamoDB only deletes rows that
+already live in the archive.
+
+Readers treat rows carrying ``archivedAt`` as cold: hot queries filter them out and
+the same rows are served from the month blobs instead, which keeps the two tiers
+free of duplicates while TTL deletion catches up.
+
+Next to the month blobs each user has a small index (``versions/<userId>/_index.json.gz``)
+listing the sort keys of every month, so a single version is found by reading the
+index and one month instead of every blob the user has.
+"""
+
+import gzip
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from boto3.dynamodb.conditions import Attr
+
+from lib.object_store import open_object_store
+from lib.preference_versions import _UPPER_SENTINEL
+
+ARCHIVE_PREFIX = "versions"
+RETENTION_DAYS = int(os.environ.get("VERSION_RETENTION_DAYS", "90"))
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value % 1 == 0 else float(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def month_of(timestamp: str) -> str:
+    return timestamp[:7]
+
+
+def months_between(from_ts: Optional[str], to_ts: Optional[str], months: Iterable[str]) -> List[str]:
+    """The subset of ``months`` that can hold rows with ``from_ts <= timestamp <= to_ts``."""
+    return [
+        month
+        for month in months
+        if (not from_ts or month >= month_of(from_ts)) and (not to_ts or month <= month_of(to_ts))
+    ]
+
+
+def not_archived():
+    return Attr("archivedAt").not_exists()
+
+
+def expires_at(timestamp: str, retention_days: int = RETENTION_DAYS, now: Optional[datetime] = None) -> int:
+    """TTL epoch seconds: ``retention_days`` after ``timestamp``, but not before ``now``."""
+    now = now or datetime.now(timezone.utc)
+    written = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    return int(max(written + timedelta(days=retention_days), now).timestamp())
+
+
+class VersionArchive:
+    def __init__(self, store):
+        self.store = store
+
+    @staticmethod
+    def key(user_id: str, month: str) -> str:
+        return f"{ARCHIVE_PREFIX}/{user_id}/{month}.ndjson.gz"
+
+    @staticmethod
+    def index_key(user_id: str) -> str:
+        return f"{ARCHIVE_PREFIX}/{user_id}/_index.json.gz"
+
+    def read_index(self, user_id: str) -> Dict[str, List[str]]:
+        """Sort keys of each indexed month (``{month: [preferenceKey_ts, ...]}``)."""
+        data = self.store.get_bytes(self.index_key(user_id))
+        return json.loads(gzip.decompress(data).decode("utf-8")) if data else {}
+
+    def months(self, user_id: str) -> List[str]:
+        prefix = f"{ARCHIVE_PREFIX}/{user_id}/"
+        return sorted(
+            key[len(prefix) : -len(".ndjson.gz")] for key in self.store.list(prefix) if key.endswith(".ndjson.gz")
+        )
+
+    def read_month(self, user_id: str, month: str) -> List[Dict[str, Any]]:
+        """Rows of one month, newest first."""
+        data = self.store.get_bytes(self.key(user_id, month))
+        if not data:
+            return []
+        rows = [json.loads(line) for line in gzip.decompress(data).decode("utf-8").splitlines() if line]
+        rows.sort(key=lambda row: (row["timestamp"], row["preferenceKey_ts"]), reverse=True)
+        return rows
+
+    def write_month(self, user_id: str, month: str, rows: Iterable[Dict[str, Any]]) -> int:
+        """Merges ``rows`` into the month blob (by sort key) and returns its row count."""
+        merged = {row["preferenceKey_ts"]: row for row in self.read_month(user_id, month)}
+        for row in rows:
+            merged[row["preferenceKey_ts"]] = {
+                name: value for name, value in row.items() if name not in ("archivedAt", "expiresAt")
+            }
+        ordered = sorted(merged.values(), key=lambda row: (row["timestamp"], row["preferenceKey_ts"]))
+        body = "".join(json.dumps(row, default=_json_default) + "\n" for row in ordered)
+        self.store.put_bytes(self.key(user_id, month), gzip.compress(body.encode("utf-8")))
+        index = self.read_index(user_id)
+        index[month] = [row["preferenceKey_ts"] for row in ordered]
+        data = json.dumps(index, sort_keys=True).encode("utf-8")
+        self.store.put_bytes(self.index_key(user_id), gzip.compress(data))
+        return len(ordered)
+
+    def _month_rows(self, user_id, month, from_ts, to_ts, predicate) -> List[Dict[str, Any]]:
+        upper = f"{to_ts}{_UPPER_SENTINEL}" if to_ts else None
+        return [
+            row
+            for row in self.read_month(user_id, month)
+            if (not from_ts or row["timestamp"] >= from_ts)
+            and (not upper or row["timestamp"] <= upper)
+            and (predicate is None or predicate(row))
+        ]
+
+    def rows(
+        self,
+        user_id: str,
+        from_ts: Optional[str] = None,
+        to_ts: Optional[str] = None,
+        predicate: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    ) -> Iterable[Dict[str, Any]]:
+        """Archived rows of ``user_id`` in the time range, newest first."""
+        for month in reversed(months_between(from_ts, to_ts, self.months(user_id))):
+            yield from self._month_rows(user_id, month, from_ts, to_ts, predicate)
+
+    def page(
+        self,
+        user_id: str,
+        limit: int,
+        cursor: Optional[Dict[str, Any]] = None,
+        from_ts: Optional[str] = None,
+        to_ts: Optional[str] = None,
+        predicate: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        One page of ``rows`` plus the cursor of the next one (``{"month", "offset"}``,
+        None at the end). An empty cursor starts from the newest month.
+        """
+        cursor = cursor or {}
+        months = list(reversed(months_between(from_ts, to_ts, self.months(user_id))))
+        if cursor.get("month"):
+            months = [month for month in months if month <= cursor["month"]]
+        items: List[Dict[str, Any]] = []
+        for position, month in enumerate(months):
+            offset = cursor.get("offset", 0) if month == cursor.get("month") else 0
+            rows = self._month_rows(user_id, month, from_ts, to_ts, predicate)[offset:]
+            room = limit - len(items)
+            items.extend(rows[:room])
+            if len(rows) > room:
+                return items, {"month": month, "offset": offset + room}
+            if len(items) >= limit:
+                later = months[position + 1 :]
+                return items, ({"month": later[0], "offset": 0} if later else None)
+        return items, None
+
+    def find(self, user_id: str, sort_key: str) -> Optional[Dict[str, Any]]:
+        """
+        Looks a single row up by sort key through the user's index. Months archived
+        before the index existed are not in it and are searched blob by blob.
+        """
+        index = self.read_index(user_id)
+        month = next((month for month, sort_keys in index.items() if sort_key in sort_keys), None)
+        if month:
+            return next((row for row in self.read_month(user_id, month) if row["preferenceKey_ts"] == sort_key), None)
+        for month in reversed([month for month in self.months(user_id) if month not in index]):
+            for row in self.read_month(user_id, month):
+                if row["preferenceKey_ts"] == sort_key:
+                    return row
+        return None
+
+
+def open_version_archive(location: Optional[str] = None) -> Optional[VersionArchive]:
+    """The archive at ``location`` or VERSION_ARCHIVE_LOCATION; None when tiering is off."""
+    location = location or os.environ.get("VERSION_ARCHIVE_LOCATION")
+    if not location:
+        return None
+    return VersionArchive(open_object_store(location))
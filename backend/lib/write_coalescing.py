@@ -0,0 +1,128 @@
+"""
+Coalescing window for rapid successive updates to one key (PENDING_WRITES_TABLE).
+
+Sliders and toggles send ``Prefer: coalesce``. Such an update only overwrites a
+pending row per (user, key):
+
+    {"userId", "preferenceKey", "value", "actorId", "firstAt", "lastAt", "lastNs", "updates"}
+
+The update that creates the row opens the window. It queues a flush message on
+the write queue (``lib.write_queue``), delayed by PREFERENCE_COALESCE_WINDOW_MS.
+The worker (``lib.queued_writes``) applies the pending row as one change: only
+the final value is written, with one version row from the value stored before
+the window to the last one. The row is then deleted, provided no update
+arrived in the meantime. If one did, the row stays and a new flush is queued.
+
+Until the flush, reads return the value from before the window.
+``jobs.drain_write_queue --sweep-pending`` queues flushes for rows whose flush
+message was lost.
+"""
+
+import math
+import os
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from lib.ddb_metrics import instrument_table
+from lib.scan_engine import scan_items
+
+DEFAULT_COALESCE_WINDOW_MS = 1000
+
+
+def flush_message(user_id: str, keys: List[str], delay_seconds: int) -> Dict[str, Any]:
+    return {
+        "messageId": uuid.uuid4().hex,
+        "kind": "flush",
+        "userId": user_id,
+        "preferenceKeys": sorted(keys),
+        "acceptedNs": time.time_ns(),
+        "delaySeconds": delay_seconds,
+    }
+
+
+class WriteCoalescer:
+    def __init__(self, table, queue, window_ms: int = DEFAULT_COALESCE_WINDOW_MS):
+        self.table = table
+        self.queue = queue
+        self.window_ms = window_ms
+
+    @property
+    def delay_seconds(self) -> int:
+        # SQS delays are whole seconds, at most 15 minutes.
+        return min(900, math.ceil(self.window_ms / 1000))
+
+    def stage(self, user_id: str, actor_id: Optional[str], changes: Iterable[Tuple[str, Any]], now: str) -> List[str]:
+        """Overwrites the pending value of each key; returns the keys whose window this opened."""
+        opened = []
+        for key, value in changes:
+            response = self.table.update_item(
+                Key={"userId": user_id, "preferenceKey": key},
+                UpdateExpression=(
+                    "SET #v = :v, actorId = :actor, lastAt = :now, lastNs = :ns,"
+                    " firstAt = if_not_exists(firstAt, :now) ADD updates :one"
+                ),
+                ExpressionAttributeNames={"#v": "value"},
+                ExpressionAttributeValues={
+                    ":v": str(value) if value is not None else "",
+                    ":actor": actor_id or "unknown",
+                    ":now": now,
+                    ":ns": time.time_ns(),
+                    ":one": 1,
+                },
+                ReturnValues="ALL_OLD",
+            )
+            if not response.get("Attributes"):
+                opened.append(key)
+        if opened:
+            self.queue.send([flush_message(user_id, opened, self.delay_seconds)])
+        return opened
+
+    def pending(self, client, pairs: Iterable[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """The pending rows of ``(userId, preferenceKey)`` pairs (BatchGetItem via the resource client)."""
+        keys = [{"userId": user_id, "preferenceKey": key} for user_id, key in dict.fromkeys(pairs)]
+        rows = []
+        for start in range(0, len(keys), 100):
+            request = {self.table.table_name: {"Keys": keys[start : start + 100], "ConsistentRead": True}}
+            while request:
+                response = client.batch_get_item(RequestItems=request)
+                rows += response.get("Responses", {}).get(self.table.table_name, [])
+                request = response.get("UnprocessedKeys") or None
+        return rows
+
+    def settle(self, rows: Iterable[Dict[str, Any]]) -> int:
+        """
+        Deletes flushed rows that did not change since they were read, and queues
+        another flush for the others. Returns the number of re-queued keys.
+        """
+        requeue: Dict[str, List[str]] = {}
+        for row in rows:
+            try:
+                self.table.delete_item(
+                    Key={"userId": row["userId"], "preferenceKey": row["preferenceKey"]},
+                    ConditionExpression="lastNs = :ns",
+                    ExpressionAttributeValues={":ns": row["lastNs"]},
+                )
+            except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+                requeue.setdefault(row["userId"], []).append(row["preferenceKey"])
+        if requeue:
+            self.queue.send([flush_message(user_id, keys, self.delay_seconds) for user_id, keys in requeue.items()])
+        return sum(len(keys) for keys in requeue.values())
+
+    def sweep(self) -> int:
+        """Queues an immediate flush for every pending row; returns the number of keys."""
+        by_user: Dict[str, List[str]] = {}
+        for row in scan_items(self.table, projection=("userId", "preferenceKey")):
+            by_user.setdefault(row["userId"], []).append(row["preferenceKey"])
+        if by_user:
+            self.queue.send([flush_message(user_id, keys, 0) for user_id, keys in by_user.items()])
+        return sum(len(keys) for keys in by_user.values())
+
+
+def open_write_coalescer(dynamodb, queue) -> Optional[WriteCoalescer]:
+    """The coalescer over PENDING_WRITES_TABLE, or None when it or the write queue is not configured."""
+    table_name = os.environ.get("PENDING_WRITES_TABLE")
+    if not table_name or queue is None:
+        return None
+    window_ms = int(os.environ.get("PREFERENCE_COALESCE_WINDOW_MS") or DEFAULT_COALESCE_WINDOW_MS)
+    return WriteCoalescer(instrument_table(dynamodb.Table(table_name)), queue, window_ms)
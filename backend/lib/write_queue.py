@@ -0,0 +1,125 @@
+"""
+Queue for accepted-but-not-yet-applied preference writes (PREFERENCE_WRITE_QUEUE).
+
+``SqsWriteQueue`` is used in AWS, where a queue URL is configured.
+``LocalWriteQueue`` has the same interface over a directory, holding one JSON
+file per message, and serves as the stand-in locally and in tests.
+``open_write_queue`` picks one from a location string (an ``https://sqs...``
+queue URL or a directory path).
+
+A message is one accepted request:
+
+    {"messageId", "userId", "actorId", "acceptedAt", "acceptedNs",
+     "preferences": [{"preferenceKey", "value"}, ...]}
+
+``acceptedNs`` orders messages that were accepted within the same millisecond.
+Flush messages of the coalescing window (``lib.write_coalescing``) carry
+``"kind": "flush"`` and a ``delaySeconds`` before which they are not delivered.
+"""
+
+import json
+import os
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+
+import boto3
+
+from lib.object_store import LocalObjectStore
+
+SQS_BATCH = 10
+
+
+def new_message(user_id: str, actor_id: Optional[str], accepted_at: str, preferences: List[Dict[str, Any]]):
+    return {
+        "messageId": uuid.uuid4().hex,
+        "userId": user_id,
+        "actorId": actor_id,
+        "acceptedAt": accepted_at,
+        "acceptedNs": time.time_ns(),
+        "preferences": [{"preferenceKey": p["preferenceKey"], "value": p.get("value")} for p in preferences],
+    }
+
+
+class LocalWriteQueue:
+    """A directory of ``<acceptedNs>-<messageId>.json`` files; received in name order."""
+
+    def __init__(self, root: str):
+        self.store = LocalObjectStore(root)
+
+    def send(self, messages: Iterable[Dict[str, Any]]):
+        for message in messages:
+            name = f"{message['acceptedNs']:020d}-{message['messageId']}.json"
+            self.store.put_bytes(name, json.dumps(message).encode("utf-8"))
+
+    def receive(self, max_messages: int = 100) -> List[Dict[str, Any]]:
+        """Up to ``max_messages`` due messages as ``{"receipt", "body"}``; they stay queued until acked."""
+        received = []
+        now_ns = time.time_ns()
+        for name in sorted(self.store.list()):
+            if len(received) >= max_messages:
+                break
+            data = self.store.get_bytes(name)
+            if data is None:
+                continue
+            body = json.loads(data)
+            if body["acceptedNs"] + int(body.get("delaySeconds") or 0) * 1_000_000_000 > now_ns:
+                continue
+            received.append({"receipt": name, "body": body})
+        return received
+
+    def ack(self, receipts: Iterable[str]):
+        for receipt in receipts:
+            try:
+                os.remove(self.store.url(receipt))
+            except FileNotFoundError:
+                pass
+
+
+class SqsWriteQueue:
+    def __init__(self, queue_url: str, client=None):
+        self.queue_url = queue_url
+        self.client = client or boto3.client("sqs")
+
+    def send(self, messages: Iterable[Dict[str, Any]]):
+        messages = list(messages)
+        for start in range(0, len(messages), SQS_BATCH):
+            entries = [
+                {"Id": str(i), "MessageBody": json.dumps(message), "DelaySeconds": int(message.get("delaySeconds") or 0)}
+                for i, message in enumerate(messages[start : start + SQS_BATCH])
+            ]
+            response = self.client.send_message_batch(QueueUrl=self.queue_url, Entries=entries)
+            if response.get("Failed"):
+                raise RuntimeError(f"SQS rejected {len(response['Failed'])} write message(s)")
+
+    def receive(self, max_messages: int = 100) -> List[Dict[str, Any]]:
+        received = []
+        while len(received) < max_messages:
+            response = self.client.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=min(SQS_BATCH, max_messages - len(received)),
+                WaitTimeSeconds=1,
+            )
+            messages = response.get("Messages") or []
+            if not messages:
+                break
+            received += [{"receipt": m["ReceiptHandle"], "body": json.loads(m["Body"])} for m in messages]
+        return received
+
+    def ack(self, receipts: Iterable[str]):
+        receipts = list(receipts)
+        for start in range(0, len(receipts), SQS_BATCH):
+            entries = [{"Id": str(i), "ReceiptHandle": r} for i, r in enumerate(receipts[start : start + SQS_BATCH])]
+            self.client.delete_message_batch(QueueUrl=self.queue_url, Entries=entries)
+
+
+def open_write_queue(location: Optional[str] = None):
+    """The queue at ``location`` or PREFERENCE_WRITE_QUEUE; None when async writes are off."""
+    location = location or os.environ.get("PREFERENCE_WRITE_QUEUE")
+    if not location:
+        return None
+    if location.startswith("https://"):
+        return SqsWriteQueue(location)
+    if location.startswith("file://"):
+        location = location[len("file://") :]
+    return LocalWriteQueue(location)
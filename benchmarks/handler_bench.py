@@ -0,0 +1,217 @@
+"""
+Local benchmark for every handler in ``backend/handlers``.
+
+Runs each endpoint scenario against the moto DynamoDB stand-in and prints a JSON
+report with per-endpoint throughput, latency percentiles and DynamoDB calls per
+invocation.
+
+    python -m benchmarks.handler_bench --schema-rows 50 --prefs-per-user 20 \
+        --version-depth 100 --children-per-adult 3 --iterations 200 --output bench.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from benchmarks import local_dynamodb
+from benchmarks.local_dynamodb import Dataset, claims
+from benchmarks.stats import latency_summary
+
+Scenario = Tuple[str, str, Callable[[int], Dict[str, Any]]]
+
+
+def build_scenarios(dataset: Dataset) -> List[Scenario]:
+    adults = dataset.adults
+    keys = dataset.preference_keys or ["language"]
+
+    def adult(i):
+        return adults[i % len(adults)]
+
+    def child_of(i):
+        adult_id = adult(i)
+        children = dataset.children.get(adult_id) or [adult_id]
+        return adult_id, children[i % len(children)]
+
+    def get_self(i):
+        return {"rawPath": "/me/preferences", "requestContext": claims(adult(i))}
+
+    def get_path(i):
+        return {"pathParameters": {"userId": adult(i)}}
+
+    def get_child(i):
+        adult_id, child_id = child_of(i)
+        return {"pathParameters": {"childId": child_id}, "requestContext": claims(adult_id)}
+
+    def put_single(i):
+        return {
+            "httpMethod": "PUT",
+            "requestContext": claims(adult(i)),
+            "body": json.dumps({"preferenceKey": keys[i % len(keys)], "value": f"bench-{i}"}),
+        }
+
+    def put_batch(i):
+        body = {key: f"bench-{i}" for key in keys[:10]}
+        return {"httpMethod": "PUT", "requestContext": claims(adult(i)), "body": json.dumps(body)}
+
+    def delete(i):
+        return {
+            "httpMethod": "DELETE",
+            "pathParameters": {"preferenceKey": keys[i % len(keys)]},
+            "requestContext": claims(adult(i)),
+        }
+
+    def list_versions(i):
+        return {"pathParameters": {"userId": adult(i), "preferenceKey": keys[0]}}
+
+    def revert(i):
+        user_id = adult(i)
+        version_keys = dataset.version_keys.get(user_id) or [f"{keys[0]}#missing"]
+        return {
+            "httpMethod": "POST",
+            "body": json.dumps(
+                {
+                    "userId": user_id,
+                    "preferenceKey": keys[0],
+                    "versionKey": version_keys[i % len(version_keys)],
+                }
+            ),
+        }
+
+    def list_children(i):
+        return {"requestContext": claims(adult(i))}
+
+    def defaults(i):
+        return {"requestContext": claims(adult(i))}
+
+    def get_user(i):
+        return {"pathParameters": {"userId": adult(i)}}
+
+    return [
+        ("GET /users/{userId}", "get_user_lambda", get_user),
+        ("GET /me/preferences", "get_user_preferences_lambda", get_self),
+        ("GET /preferences/{userId}", "get_user_preferences_lambda", get_path),
+        ("GET /children/{childId}/preferences", "get_user_preferences_lambda", get_child),
+        ("PUT /me/preferences (single)", "set_user_preferences_lambda", put_single),
+        ("PUT /me/preferences (batch)", "set_user_preferences_lambda", put_batch),
+        ("DELETE /me/preferences/{preferenceKey}", "delete_user_preference_lambda", delete),
+        ("GET /preference-versions/{userId}/{preferenceKey}", "list_preference_versions_lambda", list_versions),
+        ("POST /preferences/revert", "revert_preference_lambda", revert),
+        ("GET /children", "list_children_lambda", list_children),
+        ("GET /default-preferences", "default_preferences_lambda", defaults),
+    ]
+
+
+def run_scenario(handler, build_event, iterations: int, warmup: int, sink) -> Dict[str, Any]:
+    devnull = io.StringIO()
+    for i in range(warmup):
+        with contextlib.redirect_stdout(devnull):
+            handler(build_event(i), None)
+        devnull.seek(0)
+        devnull.truncate()
+
+    sink.clear()
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for i in range(iterations):
+        event = build_event(warmup + i)
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(devnull):
+            response = handler(event, None)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        devnull.seek(0)
+        devnull.truncate()
+        if not isinstance(response, dict) or response.get("statusCode", 500) >= 500:
+            errors += 1
+    elapsed = time.perf_counter() - started
+
+    return {
+        "iterations": iterations,
+        "errors": errors,
+        "throughputPerSec": round(iterations / elapsed, 2) if elapsed else None,
+        "latencyMs": latency_summary(latencies),
+        "ddbCallsPerInvocation": round(sink.calls() / iterations, 2) if iterations else 0,
+    }
+
+
+def run(args) -> Dict[str, Any]:
+    with local_dynamodb.local_dynamodb() as dynamodb:
+        dataset = local_dynamodb.seed(
+            dynamodb,
+            adults=args.adults,
+            children_per_adult=args.children_per_adult,
+            schema_rows=args.schema_rows,
+            prefs_per_user=args.prefs_per_user,
+            version_depth=args.version_depth,
+        )
+        handlers = local_dynamodb.load_handlers()
+
+        from lib import ddb_metrics
+
+        sink = ddb_metrics.InMemorySink()
+        previous_sink = ddb_metrics.set_sink(sink)
+        try:
+            endpoints = {}
+            for name, module_name, build_event in build_scenarios(dataset):
+                if args.only and not any(token in name for token in args.only):
+                    continue
+                endpoints[name] = run_scenario(
+                    handlers[module_name].handler, build_event, args.iterations, args.warmup, sink
+                )
+                print(f"{name}: p50={endpoints[name]['latencyMs'].get('p50')}ms", file=sys.stderr)
+        finally:
+            ddb_metrics.set_sink(previous_sink)
+
+    return {
+        "params": {
+            "adults": args.adults,
+            "childrenPerAdult": args.children_per_adult,
+            "schemaRows": args.schema_rows,
+            "prefsPerUser": args.prefs_per_user,
+            "versionDepth": args.version_depth,
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": "moto",
+        },
+        "endpoints": endpoints,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--adults", type=int, default=20)
+    parser.add_argument("--children-per-adult", type=int, default=2)
+    parser.add_argument("--schema-rows", type=int, default=25)
+    parser.add_argument("--prefs-per-user", type=int, default=10)
+    parser.add_argument("--version-depth", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--only", action="append", help="run only endpoints whose name contains this text")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ.setdefault("DDB_METRICS", "on")
+    report = run(args)
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            fh.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Open-loop load generator built from the ``infra/event*.json`` invocation fixtures.
+
+The fixtures are used as templates: the caller identity, path parameters and
+preference values are rewritten for a pool of synthetic users, and requests are
+dispatched at a target rate across a worker pool against the local DynamoDB
+stand-in. Latency is measured from the scheduled send time, so queueing caused by
+saturated workers shows up in the percentiles instead of being hidden.
+
+    python -m benchmarks.load_generator --rate 200 --duration 30 --concurrency 16 \
+        --users 500 --mix get_me=80,put_me=15,children=3,versions=2
+"""
+
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+from benchmarks import local_dynamodb
+from benchmarks.local_dynamodb import Dataset, claims
+from benchmarks.stats import latency_summary
+
+INFRA_DIR = os.path.join(local_dynamodb.REPO_ROOT, "infra")
+
+DEFAULT_MIX = "get_me=80,put_me=15,children=3,versions=2"
+
+PUT_VALUES = {
+    "language": ("en", "fr", "uk", "de", "pl"),
+    "voice_chat_enabled": ("true", "false"),
+}
+
+
+def load_templates(infra_dir: str = INFRA_DIR) -> Dict[str, List[Dict[str, Any]]]:
+    def read(name):
+        with open(os.path.join(infra_dir, name), encoding="utf-8") as fh:
+            return json.load(fh)
+
+    return {
+        "get_me": [read("event.json"), read("event-me-get.json")],
+        "put_me": [read("event-me-put.json"), read("event-me-put-lang.json"), read("event-me-put-voice.json")],
+        "put_path": [read("event-set.json")],
+        "delete_me": [read("event-me-delete.json")],
+    }
+
+
+def parse_mix(spec: str) -> List[Tuple[str, float]]:
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if not weight:
+            raise ValueError(f"Invalid mix entry {part!r}, expected name=weight")
+        mix.append((name.strip(), float(weight)))
+    total = sum(weight for _, weight in mix)
+    if total <= 0:
+        raise ValueError("Traffic mix weights must sum to a positive number")
+    return [(name, weight / total) for name, weight in mix]
+
+
+def _with_caller(template: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+    event = copy.deepcopy(template)
+    event["requestContext"] = claims(user_id)
+    return event
+
+
+def _randomize_body(event: Dict[str, Any], rng: random.Random):
+    body = json.loads(event.get("body") or "{}")
+    key = body.get("preferenceKey")
+    if key:
+        choices = PUT_VALUES.get(key)
+        body["value"] = rng.choice(choices) if choices else f"v{rng.randint(0, 9999)}"
+        event["body"] = json.dumps(body)
+
+
+class EventFactory:
+    """Synthesizes (handler module, event) pairs for each operation in the mix."""
+
+    def __init__(self, templates: Dict[str, List[Dict[str, Any]]], dataset: Dataset, seed: int):
+        self.templates = templates
+        self.dataset = dataset
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.builders: Dict[str, Callable[[], Tuple[str, Dict[str, Any]]]] = {
+            "get_me": self._get_me,
+            "put_me": self._put_me,
+            "put_path": self._put_path,
+            "delete_me": self._delete_me,
+            "children": self._children,
+            "versions": self._versions,
+        }
+
+    def build(self, operation: str) -> Tuple[str, Dict[str, Any]]:
+        with self._lock:
+            return self.builders[operation]()
+
+    def _user(self) -> str:
+        return self.rng.choice(self.dataset.adults)
+
+    def _get_me(self):
+        template = self.rng.choice(self.templates["get_me"])
+        return "get_user_preferences_lambda", _with_caller(template, self._user())
+
+    def _put_me(self):
+        event = _with_caller(self.rng.choice(self.templates["put_me"]), self._user())
+        _randomize_body(event, self.rng)
+        return "set_user_preferences_lambda", event
+
+    def _put_path(self):
+        event = copy.deepcopy(self.rng.choice(self.templates["put_path"]))
+        event["pathParameters"] = {"userId": self._user()}
+        _randomize_body(event, self.rng)
+        return "set_user_preferences_lambda", event
+
+    def _delete_me(self):
+        return "delete_user_preference_lambda", _with_caller(
+            self.rng.choice(self.templates["delete_me"]), self._user()
+        )
+
+    def _children(self):
+        adult_id = self._user()
+        children = self.dataset.children.get(adult_id) or []
+        if not children:
+            return "list_children_lambda", {"requestContext": claims(adult_id)}
+        event = _with_caller(self.rng.choice(self.templates["get_me"]), adult_id)
+        event["rawPath"] = "/children/{childId}/preferences"
+        event["pathParameters"] = {"childId": self.rng.choice(children)}
+        return "get_user_preferences_lambda", event
+
+    def _versions(self):
+        user_id = self._user()
+        params = {"userId": user_id}
+        if self.dataset.preference_keys and self.rng.random() < 0.5:
+            params["preferenceKey"] = self.dataset.preference_keys[0]
+        return "list_preference_versions_lambda", {
+            "rawPath": "/preference-versions/{userId}",
+            "pathParameters": params,
+        }
+
+
+class _Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.status: Dict[str, Dict[str, int]] = {}
+
+    def record(self, operation: str, latency_ms: float, status_code: int):
+        bucket = "5xx" if status_code >= 500 else "4xx" if status_code >= 400 else "2xx"
+        with self._lock:
+            self.latencies.setdefault(operation, []).append(latency_ms)
+            counts = self.status.setdefault(operation, {"2xx": 0, "4xx": 0, "5xx": 0})
+            counts[bucket] += 1
+
+
+def _invoke(handlers, module_name, event, operation, scheduled_at, results: _Results):
+    try:
+        response = handlers[module_name].handler(event, None)
+        status_code = int(response.get("statusCode", 500)) if isinstance(response, dict) else 500
+    except Exception:
+        status_code = 500
+    results.record(operation, (time.perf_counter() - scheduled_at) * 1000, status_code)
+
+
+def generate_load(handlers, factory: EventFactory, mix, rate: float, duration: float, concurrency: int) -> Dict[str, Any]:
+    results = _Results()
+    operations = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    picker = random.Random(factory.rng.random())
+    interval = 1.0 / rate
+    total = int(rate * duration)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for index in range(total):
+            scheduled_at = started + index * interval
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            operation = picker.choices(operations, weights)[0]
+            module_name, event = factory.build(operation)
+            pool.submit(_invoke, handlers, module_name, event, operation, scheduled_at, results)
+    elapsed = time.perf_counter() - started
+
+    all_latencies: List[float] = []
+    totals = {"2xx": 0, "4xx": 0, "5xx": 0}
+    per_operation = {}
+    for operation, latencies in results.latencies.items():
+        counts = results.status[operation]
+        requests = sum(counts.values())
+        all_latencies.extend(latencies)
+        for bucket, count in counts.items():
+            totals[bucket] += count
+        per_operation[operation] = {
+            "requests": requests,
+            "status": counts,
+            "errorRate": round(counts["5xx"] / requests, 4) if requests else 0.0,
+            "latencyMs": latency_summary(latencies),
+        }
+
+    completed = sum(totals.values())
+    return {
+        "targetRate": rate,
+        "durationSec": round(elapsed, 3),
+        "requests": completed,
+        "throughputPerSec": round(completed / elapsed, 2) if elapsed else None,
+        "status": totals,
+        "errorRate": round(totals["5xx"] / completed, 4) if completed else 0.0,
+        "latencyMs": latency_summary(all_latencies),
+        "operations": per_operation,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=100.0, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of traffic to generate")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=200, help="number of synthetic adult users")
+    parser.add_argument("--children-per-adult", type=int, default=2)
+    parser.add_argument("--schema-rows", type=int, default=25)
+    parser.add_argument("--prefs-per-user", type=int, default=10)
+    parser.add_argument("--version-depth", type=int, default=20)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"operation=weight list (default {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    mix = parse_mix(args.mix)
+    templates = load_templates()
+
+    with local_dynamodb.local_dynamodb() as dynamodb:
+        dataset = local_dynamodb.seed(
+            dynamodb,
+            adults=args.users,
+            children_per_adult=args.children_per_adult,
+            schema_rows=args.schema_rows,
+            prefs_per_user=args.prefs_per_user,
+            version_depth=args.version_depth,
+        )
+        handlers = local_dynamodb.load_handlers()
+
+        from lib import ddb_metrics
+
+        previous_sink = ddb_metrics.set_sink(ddb_metrics.InMemorySink())
+        factory = EventFactory(templates, dataset, args.seed)
+        unknown = [name for name, _ in mix if name not in factory.builders]
+        if unknown:
+            raise SystemExit(f"Unknown operations in mix: {', '.join(unknown)}")
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                report = generate_load(handlers, factory, mix, args.rate, args.duration, args.concurrency)
+        finally:
+            ddb_metrics.set_sink(previous_sink)
+
+    report["mix"] = {name: round(weight, 4) for name, weight in mix}
+    report["users"] = args.users
+    report["concurrency"] = args.concurrency
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            fh.write(payload + "\n")
+    else:
+        print(payload)
+    print(
+        f"{report['requests']} requests, {report['throughputPerSec']} req/s, "
+        f"p99={report['latencyMs'].get('p99')}ms, errors={report['errorRate']:.2%}",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
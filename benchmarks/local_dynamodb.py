@@ -0,0 +1,270 @@
+"""
+In-memory DynamoDB stand-in (moto) with the same tables as ``infra/infra_stack.py``.
+
+Used by the local benchmark, load generator and call-budget tests so that handlers
+in ``backend/handlers`` can run without a deployed stack.
+"""
+
+import importlib
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(REPO_ROOT, "backend")
+
+# env var -> (table name, partition key, sort key)
+TABLES = {
+    "USERS_TABLE": ("Users", "userId", None),
+    "PREFERENCES_TABLE": ("Preferences", "userId", "preferenceKey"),
+    "PREFERENCE_DOCUMENTS_TABLE": ("PreferenceDocuments", "userId", None),
+    "EFFECTIVE_PREFERENCES_TABLE": ("EffectivePreferences", "userId", None),
+    "IDEMPOTENCY_TABLE": ("IdempotencyKeys", "idempotencyKey", None),
+    "PENDING_WRITES_TABLE": ("PendingPreferenceWrites", "userId", "preferenceKey"),
+    "PREFERENCE_OUTBOX_TABLE": ("PreferenceOutbox", "shard", "eventId"),
+    "MANAGED_PREFERENCES_TABLE": ("ManagedPreferenceSchema", "preferenceKey", "scope"),
+    "SCHEMA_CHANGES_TABLE": ("ManagedPreferenceSchemaChanges", "stream", "changeId"),
+    "PREFERENCE_VERSIONS_TABLE": ("PreferenceVersions", "userId", "preferenceKey_ts"),
+    "CHILD_LINKS_TABLE": ("ChildLinks", "adultId", "childId"),
+    "AGE_THRESHOLDS_TABLE": ("AgeThresholds", "regionCode", None),
+}
+
+# env var -> [(index name, partition key, sort key)]; mirrors the GSIs in infra/infra_stack.py
+INDEXES = {
+    "PREFERENCE_VERSIONS_TABLE": [
+        ("userId-timestamp-index", "userId", "timestamp"),
+        ("preferenceKey-timestamp-index", "preferenceKey", "timestamp"),
+        ("userAction-timestamp-index", "userAction", "timestamp"),
+        ("keyAction-timestamp-index", "keyAction", "timestamp"),
+        ("userKey-timestamp-index", "userKey", "timestamp"),
+    ],
+}
+
+HANDLER_MODULES = (
+    "get_user_lambda",
+    "get_user_preferences_lambda",
+    "set_user_preferences_lambda",
+    "delete_user_preference_lambda",
+    "list_preference_versions_lambda",
+    "get_preferences_as_of_lambda",
+    "get_preference_diff_lambda",
+    "revert_preference_lambda",
+    "list_children_lambda",
+    "default_preferences_lambda",
+)
+
+COUNTRIES = ("UA", "US", "DE", "PL", "GB")
+AGE_THRESHOLDS = {"UA": 13, "US": 13, "DE": 16, "PL": 16, "DEFAULT": 13}
+
+
+def configure_environment():
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-north-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+    for env_var, (table_name, _, _) in TABLES.items():
+        os.environ[env_var] = table_name
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+
+def _create_table(dynamodb, table_name: str, partition_key: str, sort_key: Optional[str], indexes=()):
+    key_schema = [{"AttributeName": partition_key, "KeyType": "HASH"}]
+    attributes = {partition_key}
+    if sort_key:
+        key_schema.append({"AttributeName": sort_key, "KeyType": "RANGE"})
+        attributes.add(sort_key)
+    params = {}
+    if indexes:
+        params["GlobalSecondaryIndexes"] = [
+            {
+                "IndexName": index_name,
+                "KeySchema": [
+                    {"AttributeName": index_pk, "KeyType": "HASH"},
+                    {"AttributeName": index_sk, "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            }
+            for index_name, index_pk, index_sk in indexes
+        ]
+        for _, index_pk, index_sk in indexes:
+            attributes.update((index_pk, index_sk))
+    dynamodb.create_table(
+        TableName=table_name,
+        KeySchema=key_schema,
+        AttributeDefinitions=[{"AttributeName": name, "AttributeType": "S"} for name in sorted(attributes)],
+        BillingMode="PAY_PER_REQUEST",
+        **params,
+    )
+
+
+@contextmanager
+def local_dynamodb():
+    """Starts moto, creates every service table and yields the boto3 resource."""
+    configure_environment()
+    import boto3
+    from moto import mock_aws
+
+    with mock_aws():
+        dynamodb = boto3.resource("dynamodb")
+        for env_var, (table_name, partition_key, sort_key) in TABLES.items():
+            _create_table(dynamodb, table_name, partition_key, sort_key, INDEXES.get(env_var, ()))
+        yield dynamodb
+
+
+# Modules that bind boto3 tables at import time; reloaded so they pick up the
+# local credentials and table names even if something imported them earlier.
+_TABLE_BINDING_MODULES = ("lib.preferences_resolver", "lib.preferences_utils")
+
+
+def _import_fresh(module_name: str):
+    if module_name in sys.modules:
+        return importlib.reload(sys.modules[module_name])
+    return importlib.import_module(module_name)
+
+
+def load_handlers(modules=HANDLER_MODULES) -> Dict[str, Any]:
+    """Imports handler modules bound to the stand-in; must be called inside ``local_dynamodb``."""
+    configure_environment()
+    for module_name in _TABLE_BINDING_MODULES:
+        _import_fresh(module_name)
+    return {name: _import_fresh(f"handlers.{name}") for name in modules}
+
+
+def load_job(module_name: str):
+    """Imports ``backend/jobs/<module_name>`` bound to the stand-in."""
+    configure_environment()
+    for name in _TABLE_BINDING_MODULES:
+        _import_fresh(name)
+    return _import_fresh(f"jobs.{module_name}")
+
+
+def _iso(dt: datetime) -> str:
+    return dt.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class Dataset:
+    """Ids of the seeded entities, used to build events."""
+
+    def __init__(self):
+        self.adults: List[str] = []
+        self.children: Dict[str, List[str]] = {}
+        self.preference_keys: List[str] = []
+        self.schema_keys: List[str] = []
+        self.version_keys: Dict[str, List[str]] = {}
+
+    @property
+    def all_users(self) -> List[str]:
+        users = list(self.adults)
+        for child_ids in self.children.values():
+            users.extend(child_ids)
+        return users
+
+
+def seed(
+    dynamodb,
+    adults: int = 20,
+    children_per_adult: int = 2,
+    schema_rows: int = 25,
+    prefs_per_user: int = 10,
+    version_depth: int = 20,
+) -> Dataset:
+    dataset = Dataset()
+    now = datetime.now(timezone.utc)
+
+    with dynamodb.Table(TABLES["AGE_THRESHOLDS_TABLE"][0]).batch_writer() as batch:
+        for region, threshold in AGE_THRESHOLDS.items():
+            batch.put_item(Item={"regionCode": region, "ageThreshold": threshold})
+
+    with dynamodb.Table(TABLES["MANAGED_PREFERENCES_TABLE"][0]).batch_writer() as batch:
+        for index in range(schema_rows):
+            key = f"managed_pref_{index:03d}"
+            item = {
+                "preferenceKey": key,
+                "scope": "GLOBAL",
+                "baseDefault": f"default-{index}",
+                "countryOverrides": {COUNTRIES[index % len(COUNTRIES)]: f"country-{index}"},
+            }
+            if index % 3 == 0:
+                item["childOverride"] = "locked" if index % 6 == 0 else f"child-{index}"
+            if index % 5 == 0:
+                item["minAge"] = 16
+            batch.put_item(Item=item)
+            dataset.schema_keys.append(key)
+
+    from lib.schema_version import bump_schema_version
+
+    bump_schema_version(dynamodb.Table(TABLES["MANAGED_PREFERENCES_TABLE"][0]))
+
+    dataset.preference_keys = [f"pref_{index:03d}" for index in range(prefs_per_user)]
+
+    users_table = dynamodb.Table(TABLES["USERS_TABLE"][0])
+    links_table = dynamodb.Table(TABLES["CHILD_LINKS_TABLE"][0])
+    with users_table.batch_writer() as users, links_table.batch_writer() as links:
+        for adult_index in range(adults):
+            adult_id = f"adult-{adult_index:05d}"
+            dataset.adults.append(adult_id)
+            users.put_item(
+                Item={
+                    "userId": adult_id,
+                    "role": "Adult",
+                    "country": COUNTRIES[adult_index % len(COUNTRIES)],
+                    "birthDate": "1985-04-12",
+                }
+            )
+            dataset.children[adult_id] = []
+            for child_index in range(children_per_adult):
+                child_id = f"child-{adult_index:05d}-{child_index:02d}"
+                dataset.children[adult_id].append(child_id)
+                users.put_item(
+                    Item={
+                        "userId": child_id,
+                        "role": "Child",
+                        "country": COUNTRIES[adult_index % len(COUNTRIES)],
+                        "birthDate": "2015-09-01",
+                    }
+                )
+                links.put_item(Item={"adultId": adult_id, "childId": child_id})
+
+    from lib.preference_versions import build_version_item, counter_key
+
+    prefs_table = dynamodb.Table(TABLES["PREFERENCES_TABLE"][0])
+    versions_table = dynamodb.Table(TABLES["PREFERENCE_VERSIONS_TABLE"][0])
+    with prefs_table.batch_writer() as prefs, versions_table.batch_writer() as versions:
+        for user_id in dataset.all_users:
+            for key in dataset.preference_keys:
+                prefs.put_item(
+                    Item={
+                        "userId": user_id,
+                        "preferenceKey": key,
+                        "value": f"{key}-value",
+                        "updatedAt": _iso(now),
+                    }
+                )
+            if not dataset.preference_keys:
+                continue
+            history_key = dataset.preference_keys[0]
+            keys = []
+            for depth in range(version_depth):
+                timestamp = _iso(now - timedelta(minutes=version_depth - depth))
+                item = build_version_item(
+                    user_id,
+                    history_key,
+                    f"{history_key}-v{depth}",
+                    f"{history_key}-v{depth + 1}",
+                    "UPSERT",
+                    depth + 1,
+                    timestamp,
+                )
+                keys.append(item["preferenceKey_ts"])
+                versions.put_item(Item=item)
+            if version_depth:
+                versions.put_item(Item={**counter_key(user_id, history_key), "sequence": version_depth})
+            dataset.version_keys[user_id] = keys
+
+    return dataset
+
+
+def claims(user_id: str) -> Dict[str, Any]:
+    return {"authorizer": {"jwt": {"claims": {"sub": user_id}}}}
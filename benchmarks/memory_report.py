@@ -0,0 +1,288 @@
+"""
+Peak-memory measurement and Lambda memory right-sizing.
+
+Every handler is measured in its own interpreter so that imports and caches of one
+function do not inflate another. For each function the report records
+
+  * runtimeBaseMiB   RSS of an interpreter with boto3 loaded (the Lambda runtime floor)
+  * importMiB        RSS growth caused by importing the handler and ``lib``
+  * peakTracedMiB    tracemalloc peak while serving representative heavy payloads
+                     (large preference sets, wide batch PUTs, deep version pages)
+  * topAllocations   allocation hot spots (file:line) at the traced peak
+
+and recommends ``memorySize`` = estimate * headroom rounded up to 64 MB (min 128).
+The recommendations are written to ``infra/lambda_memory.json``, which
+``infra/infra_stack.py`` reads when synthesizing the functions.
+
+    python -m benchmarks.memory_report --prefs-per-user 500 --version-depth 1000
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import subprocess
+import sys
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+from benchmarks import local_dynamodb
+from benchmarks.local_dynamodb import claims
+
+OUTPUT_PATH = os.path.join(local_dynamodb.REPO_ROOT, "infra", "lambda_memory.json")
+
+# handler module -> CDK construct id in infra/infra_stack.py
+FUNCTIONS = {
+    "get_user_lambda": "GetUserFunction",
+    "get_user_preferences_lambda": "GetUserPreferencesFunction",
+    "default_preferences_lambda": "DefaultPreferencesFunction",
+    "set_user_preferences_lambda": "SetUserPreferencesFunction",
+    "delete_user_preference_lambda": "DeleteUserPreferenceFunction",
+    "list_preference_versions_lambda": "ListPreferenceVersionsFunction",
+    "get_preferences_as_of_lambda": "GetPreferencesAsOfFunction",
+    "get_preference_diff_lambda": "GetPreferenceDiffFunction",
+    "list_children_lambda": "ListChildrenFunction",
+    "revert_preference_lambda": "RevertPreferenceFunction",
+}
+
+MIN_MEMORY_MB = 128
+MAX_MEMORY_MB = 10240
+
+
+def _rss_mib() -> float:
+    try:
+        with open("/proc/self/statm", encoding="utf-8") as fh:
+            resident_pages = int(fh.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _short_path(filename: str) -> str:
+    if filename.startswith(local_dynamodb.REPO_ROOT + os.sep):
+        return os.path.relpath(filename, local_dynamodb.REPO_ROOT)
+    parts = filename.split(os.sep)
+    if "site-packages" in parts:
+        return os.sep.join(parts[parts.index("site-packages") + 1 :])
+    return os.sep.join(parts[-2:])
+
+
+def heavy_events(module_name: str, dataset, batch_size: int) -> List[Dict[str, Any]]:
+    adult = dataset.adults[0]
+    child = dataset.children[adult][0] if dataset.children.get(adult) else adult
+    keys = dataset.preference_keys
+    history_key = keys[0]
+
+    if module_name == "get_user_lambda":
+        return [{"pathParameters": {"userId": adult}}]
+    if module_name == "get_user_preferences_lambda":
+        return [
+            {"requestContext": claims(adult)},
+            {"pathParameters": {"childId": child}, "requestContext": claims(adult)},
+        ]
+    if module_name == "default_preferences_lambda":
+        return [{"requestContext": claims(child)}]
+    if module_name == "set_user_preferences_lambda":
+        body = {key: f"memory-{index}" for index, key in enumerate(keys[:batch_size])}
+        return [{"requestContext": claims(adult), "body": json.dumps(body)}]
+    if module_name == "delete_user_preference_lambda":
+        return [
+            {"pathParameters": {"preferenceKey": keys[-1]}, "requestContext": claims(adult)},
+        ]
+    if module_name == "list_preference_versions_lambda":
+        return [
+            {"pathParameters": {"userId": adult}, "queryStringParameters": {"limit": "200"}},
+            {
+                "pathParameters": {"userId": adult, "preferenceKey": history_key},
+                "queryStringParameters": {"limit": "200"},
+            },
+        ]
+    if module_name == "get_preferences_as_of_lambda":
+        return [{"pathParameters": {"userId": adult}, "queryStringParameters": {"at": "2999-12-31"}}]
+    if module_name == "get_preference_diff_lambda":
+        return [{"pathParameters": {"userId": adult}, "queryStringParameters": {"from": "2000-01-01", "to": "2999-12-31"}}]
+    if module_name == "list_children_lambda":
+        return [{"requestContext": claims(adult)}]
+    if module_name == "revert_preference_lambda":
+        version_key = dataset.version_keys[adult][0]
+        return [
+            {
+                "body": json.dumps(
+                    {"userId": adult, "preferenceKey": history_key, "versionKey": version_key}
+                )
+            }
+        ]
+    raise ValueError(f"No payloads defined for {module_name}")
+
+
+def measure_in_process(args) -> Dict[str, Any]:
+    """Runs in a child interpreter; measures a single handler module."""
+    import boto3
+
+    boto3.resource("dynamodb", region_name=os.environ.get("AWS_DEFAULT_REGION", "eu-north-1"))
+    runtime_baseline = _rss_mib()
+
+    with local_dynamodb.local_dynamodb() as dynamodb:
+        dataset = local_dynamodb.seed(
+            dynamodb,
+            adults=2,
+            children_per_adult=args.children_per_adult,
+            schema_rows=args.schema_rows,
+            prefs_per_user=args.prefs_per_user,
+            version_depth=args.version_depth,
+        )
+        from lib import ddb_metrics
+
+        ddb_metrics.set_sink(ddb_metrics.InMemorySink())
+
+        before_import = _rss_mib()
+        module = local_dynamodb.load_handlers()[args.child]
+        import_mib = max(0.0, _rss_mib() - before_import)
+
+        events = heavy_events(args.child, dataset, args.batch_size)
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        peak_snapshot = None
+        peak_bytes = 0
+        statuses = []
+        for _ in range(args.repeat):
+            for event in events:
+                tracemalloc.reset_peak()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    response = module.handler(json.loads(json.dumps(event)), None)
+                statuses.append(response.get("statusCode"))
+                _, peak = tracemalloc.get_traced_memory()
+                if peak >= peak_bytes:
+                    peak_bytes = peak
+                    peak_snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+    top_allocations = []
+    if peak_snapshot is not None:
+        snapshot = peak_snapshot.filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen *>"))
+        )
+        for stat in snapshot.statistics("lineno")[: args.top]:
+            frame = stat.traceback[0]
+            top_allocations.append(
+                {
+                    "location": f"{_short_path(frame.filename)}:{frame.lineno}",
+                    "sizeKiB": round(stat.size / 1024, 1),
+                    "count": stat.count,
+                }
+            )
+
+    return {
+        "handler": args.child,
+        "statusCodes": sorted(set(statuses)),
+        "runtimeBaseMiB": round(runtime_baseline, 1),
+        "importMiB": round(import_mib, 1),
+        "peakTracedMiB": round(peak_bytes / (1024 * 1024), 2),
+        "topAllocations": top_allocations,
+    }
+
+
+def recommend_memory(estimate_mib: float, headroom: float) -> int:
+    target = estimate_mib * headroom
+    rounded = int(math.ceil(target / 64.0) * 64)
+    return max(MIN_MEMORY_MB, min(MAX_MEMORY_MB, rounded))
+
+
+def _child_command(args, module_name: str) -> List[str]:
+    return [
+        sys.executable,
+        "-m",
+        "benchmarks.memory_report",
+        "--child",
+        module_name,
+        "--schema-rows",
+        str(args.schema_rows),
+        "--prefs-per-user",
+        str(args.prefs_per_user),
+        "--version-depth",
+        str(args.version_depth),
+        "--children-per-adult",
+        str(args.children_per_adult),
+        "--batch-size",
+        str(args.batch_size),
+        "--repeat",
+        str(args.repeat),
+        "--top",
+        str(args.top),
+    ]
+
+
+def run(args) -> Dict[str, Any]:
+    functions = {}
+    for module_name, construct_id in FUNCTIONS.items():
+        if args.only and module_name not in args.only:
+            continue
+        completed = subprocess.run(
+            _child_command(args, module_name),
+            cwd=local_dynamodb.REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        measurement = json.loads(completed.stdout.strip().splitlines()[-1])
+        estimate = (
+            measurement["runtimeBaseMiB"] + measurement["importMiB"] + measurement["peakTracedMiB"]
+        )
+        measurement["estimatedPeakMiB"] = round(estimate, 1)
+        measurement["memorySize"] = recommend_memory(estimate, args.headroom)
+        functions[construct_id] = measurement
+        print(
+            f"{construct_id}: estimated {estimate:.1f} MiB -> memorySize {measurement['memorySize']} MB",
+            file=sys.stderr,
+        )
+
+    return {
+        "generatedAt": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "params": {
+            "schemaRows": args.schema_rows,
+            "prefsPerUser": args.prefs_per_user,
+            "versionDepth": args.version_depth,
+            "childrenPerAdult": args.children_per_adult,
+            "batchSize": args.batch_size,
+            "headroom": args.headroom,
+        },
+        "functions": functions,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--schema-rows", type=int, default=100)
+    parser.add_argument("--prefs-per-user", type=int, default=300)
+    parser.add_argument("--version-depth", type=int, default=500)
+    parser.add_argument("--children-per-adult", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=50, help="preferences per PUT body")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="allocation hot spots to report")
+    parser.add_argument("--headroom", type=float, default=1.5)
+    parser.add_argument("--only", action="append", help="measure only this handler module")
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        print(json.dumps(measure_in_process(args)))
+        return
+
+    report = run(args)
+    with open(args.output, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2)
+        fh.write("\n")
+    print(f"Wrote {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,55 @@
+import json
+import os
+
 from aws_cdk import (
+    Duration,
     Stack,
     aws_cognito as cognito,
     aws_dynamodb as dynamodb,
+    aws_events as events,
+    aws_events_targets as events_targets,
     aws_lambda as _lambda,
+    aws_lambda_event_sources as lambda_event_sources,
     aws_apigateway as apigw,
+    aws_s3 as s3,
+    aws_sqs as sqs,
 )
 from constructs import Construct
 
+# Written by `python -m benchmarks.memory_report`; functions without an entry keep
+# the Lambda default memory size.
+LAMBDA_MEMORY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lambda_memory.json")
+
+# PreferenceVersions GSIs: (index name, partition key, sort key).
+PREFERENCE_VERSION_INDEXES = (
+    ("userId-timestamp-index", "userId", "timestamp"),
+    ("preferenceKey-timestamp-index", "preferenceKey", "timestamp"),
+    ("userAction-timestamp-index", "userAction", "timestamp"),
+    ("keyAction-timestamp-index", "keyAction", "timestamp"),
+    ("userKey-timestamp-index", "userKey", "timestamp"),
+)
+
+
+def load_memory_recommendations(path: str = LAMBDA_MEMORY_FILE) -> dict:
+    try:
+        with open(path, encoding="utf-8") as fh:
+            report = json.load(fh)
+    except FileNotFoundError:
+        return {}
+    return {
+        construct_id: int(entry["memorySize"])
+        for construct_id, entry in (report.get("functions") or {}).items()
+        if entry.get("memorySize")
+    }
+
 
 class InfraStack(Stack):
 
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        memory_sizes = load_memory_recommendations()
+
         # -------- DynamoDB tables --------
 
         # Users table
@@ -25,6 +62,8 @@ class InfraStack(Stack):
                 type=dynamodb.AttributeType.STRING,
             ),
             billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            # Feeds RefreshEffectivePreferencesFunction (country / birthDate / role changes).
+            stream=dynamodb.StreamViewType.NEW_AND_OLD_IMAGES,
         )
 
         # Preferences table
@@ -43,6 +82,79 @@ class InfraStack(Stack):
             billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
         )
 
+        # PreferenceDocuments table – one item per user for PREFERENCE_STORAGE_MODE=dual/document
+        # (backend/lib/preference_store.py)
+        self.preference_documents_table = dynamodb.Table(
+            self,
+            "PreferenceDocumentsTable",
+            table_name="PreferenceDocuments",
+            partition_key=dynamodb.Attribute(
+                name="userId",
+                type=dynamodb.AttributeType.STRING,
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+        )
+
+        # EffectivePreferences table – materialized GET /me/preferences per user
+        # (backend/lib/effective_preferences.py)
+        self.effective_preferences_table = dynamodb.Table(
+            self,
+            "EffectivePreferencesTable",
+            table_name="EffectivePreferences",
+            partition_key=dynamodb.Attribute(
+                name="userId",
+                type=dynamodb.AttributeType.STRING,
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+        )
+
+        # IdempotencyKeys table – stored responses of retried mutations (backend/lib/idempotency.py)
+        self.idempotency_table = dynamodb.Table(
+            self,
+            "IdempotencyKeysTable",
+            table_name="IdempotencyKeys",
+            partition_key=dynamodb.Attribute(
+                name="idempotencyKey",
+                type=dynamodb.AttributeType.STRING,
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expiresAt",
+        )
+
+        # PendingPreferenceWrites table – values held for the coalescing window
+        # (backend/lib/write_coalescing.py)
+        self.pending_writes_table = dynamodb.Table(
+            self,
+            "PendingPreferenceWritesTable",
+            table_name="PendingPreferenceWrites",
+            partition_key=dynamodb.Attribute(
+                name="userId",
+                type=dynamodb.AttributeType.STRING,
+            ),
+            sort_key=dynamodb.Attribute(
+                name="preferenceKey",
+                type=dynamodb.AttributeType.STRING,
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+        )
+
+        # PreferenceOutbox table – change events awaiting publication (backend/lib/outbox.py)
+        self.preference_outbox_table = dynamodb.Table(
+            self,
+            "PreferenceOutboxTable",
+            table_name="PreferenceOutbox",
+            partition_key=dynamodb.Attribute(
+                name="shard",
+                type=dynamodb.AttributeType.STRING,
+            ),
+            sort_key=dynamodb.Attribute(
+                name="eventId",
+                type=dynamodb.AttributeType.STRING,
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            stream=dynamodb.StreamViewType.NEW_IMAGE,
+        )
+
         # ManagedPreferenceSchema table – схема керованих вподобань
         self.managed_prefs_table = dynamodb.Table(
             self,
@@ -59,6 +171,23 @@ class InfraStack(Stack):
             billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
         )
 
+        # ManagedPreferenceSchemaChanges table – per-version schema change records written by
+        # jobs.publish_schema and read by jobs.propagate_schema_change (backend/lib/schema_version.py)
+        self.schema_changes_table = dynamodb.Table(
+            self,
+            "ManagedPreferenceSchemaChangesTable",
+            table_name="ManagedPreferenceSchemaChanges",
+            partition_key=dynamodb.Attribute(
+                name="stream",
+                type=dynamodb.AttributeType.STRING,
+            ),
+            sort_key=dynamodb.Attribute(
+                name="changeId",
+                type=dynamodb.AttributeType.STRING,
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+        )
+
         # PreferenceVersions table – історія змін вподобань
         self.preference_versions_table = dynamodb.Table(
             self,
@@ -73,8 +202,55 @@ class InfraStack(Stack):
                 type=dynamodb.AttributeType.STRING,
             ),
             billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            # Set by jobs.archive_preference_versions once a row is in the archive.
+            time_to_live_attribute="expiresAt",
         )
 
+        # Cold tier of PreferenceVersions: per-user, per-month gzip NDJSON (backend/lib/version_archive.py).
+        self.version_archive_bucket = s3.Bucket(
+            self,
+            "VersionArchiveBucket",
+            encryption=s3.BucketEncryption.S3_MANAGED,
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+        )
+        version_archive_location = f"s3://{self.version_archive_bucket.bucket_name}/versions-archive"
+
+        # Writes accepted with `Prefer: respond-async` (backend/lib/write_queue.py).
+        self.write_dead_letter_queue = sqs.Queue(
+            self,
+            "PreferenceWriteDeadLetterQueue",
+            retention_period=Duration.days(14),
+        )
+        self.write_queue = sqs.Queue(
+            self,
+            "PreferenceWriteQueue",
+            visibility_timeout=Duration.seconds(180),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=5, queue=self.write_dead_letter_queue),
+        )
+
+        # Published `PreferencesChanged` events (source "user-preferences").
+        self.preference_event_bus = events.EventBus(self, "PreferenceEventBus")
+
+        # `Prefer: coalesce` window; flushes are SQS-delayed, so it is rounded up to whole seconds.
+        coalesce_window_ms = str(self.node.try_get_context("coalesceWindowMs") or 1000)
+
+        # items (default) -> dual -> document; see jobs.migrate_preference_documents.
+        preference_storage_mode = self.node.try_get_context("preferenceStorageMode") or "items"
+
+        # Time-range / cross-user / per-action history queries (backend/lib/preference_versions.py).
+        # CloudFormation creates at most one GSI per table update: on an existing stack deploy
+        # with -c versionIndexCount=N, N+1, ... first, then run jobs.backfill_version_indexes.
+        version_index_count = int(
+            self.node.try_get_context("versionIndexCount") or len(PREFERENCE_VERSION_INDEXES)
+        )
+        for index_name, index_pk, index_sk in PREFERENCE_VERSION_INDEXES[:version_index_count]:
+            self.preference_versions_table.add_global_secondary_index(
+                index_name=index_name,
+                partition_key=dynamodb.Attribute(name=index_pk, type=dynamodb.AttributeType.STRING),
+                sort_key=dynamodb.Attribute(name=index_sk, type=dynamodb.AttributeType.STRING),
+                projection_type=dynamodb.ProjectionType.ALL,
+            )
+
         # ChildLinks table – зв’язки дорослий ↔ дитина
         self.child_links_table = dynamodb.Table(
             self,
@@ -135,6 +311,7 @@ class InfraStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_11,
             handler="handlers.get_user_lambda.handler",
             code=_lambda.Code.from_asset("../backend"),
+            memory_size=memory_sizes.get("GetUserFunction"),
             environment={
                 "USERS_TABLE": self.users_table.table_name,
                 "AGE_THRESHOLDS_TABLE": self.age_thresholds_table.table_name,
@@ -149,8 +326,12 @@ class InfraStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_11,
             handler="handlers.get_user_preferences_lambda.handler",
             code=_lambda.Code.from_asset("../backend"),
+            memory_size=memory_sizes.get("GetUserPreferencesFunction"),
             environment={
                 "PREFERENCES_TABLE": self.preferences_table.table_name,
+                "PREFERENCE_DOCUMENTS_TABLE": self.preference_documents_table.table_name,
+                "PREFERENCE_STORAGE_MODE": preference_storage_mode,
+                "EFFECTIVE_PREFERENCES_TABLE": self.effective_preferences_table.table_name,
                 "USERS_TABLE": self.users_table.table_name,
                 "MANAGED_PREFERENCES_TABLE": self.managed_prefs_table.table_name,
                 "AGE_THRESHOLDS_TABLE": self.age_thresholds_table.table_name,
@@ -166,6 +347,7 @@ class InfraStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_11,
             handler="handlers.default_preferences_lambda.handler",
             code=_lambda.Code.from_asset("../backend"),
+            memory_size=memory_sizes.get("DefaultPreferencesFunction"),
             environment={
                 "USERS_TABLE": self.users_table.table_name,
                 "MANAGED_PREFERENCES_TABLE": self.managed_prefs_table.table_name,
@@ -181,8 +363,17 @@ class InfraStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_11,
             handler="handlers.set_user_preferences_lambda.handler",
             code=_lambda.Code.from_asset("../backend"),
+            memory_size=memory_sizes.get("SetUserPreferencesFunction"),
             environment={
                 "PREFERENCES_TABLE": self.preferences_table.table_name,
+                "PREFERENCE_DOCUMENTS_TABLE": self.preference_documents_table.table_name,
+                "PREFERENCE_STORAGE_MODE": preference_storage_mode,
+                "EFFECTIVE_PREFERENCES_TABLE": self.effective_preferences_table.table_name,
+                "IDEMPOTENCY_TABLE": self.idempotency_table.table_name,
+                "PREFERENCE_WRITE_QUEUE": self.write_queue.queue_url,
+                "PENDING_WRITES_TABLE": self.pending_writes_table.table_name,
+                "PREFERENCE_COALESCE_WINDOW_MS": coalesce_window_ms,
+                "PREFERENCE_OUTBOX_TABLE": self.preference_outbox_table.table_name,
                 "PREFERENCE_VERSIONS_TABLE": self.preference_versions_table.table_name,
                 "CHILD_LINKS_TABLE": self.child_links_table.table_name,
                 "USERS_TABLE": self.users_table.table_name,
@@ -199,8 +390,14 @@ class InfraStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_11,
             handler="handlers.delete_user_preference_lambda.handler",
             code=_lambda.Code.from_asset("../backend"),
+            memory_size=memory_sizes.get("DeleteUserPreferenceFunction"),
             environment={
                 "PREFERENCES_TABLE": self.preferences_table.table_name,
+                "PREFERENCE_DOCUMENTS_TABLE": self.preference_documents_table.table_name,
+                "PREFERENCE_STORAGE_MODE": preference_storage_mode,
+                "EFFECTIVE_PREFERENCES_TABLE": self.effective_preferences_table.table_name,
+                "IDEMPOTENCY_TABLE": self.idempotency_table.table_name,
+                "PREFERENCE_OUTBOX_TABLE": self.preference_outbox_table.table_name,
                 "PREFERENCE_VERSIONS_TABLE": self.preference_versions_table.table_name,
                 "CHILD_LINKS_TABLE": self.child_links_table.table_name,
                 "USERS_TABLE": self.users_table.table_name,
@@ -209,6 +406,103 @@ class InfraStack(Stack):
             },
         )
 
+        # -------- Lambda: Users stream -> EffectivePreferences --------
+
+        refresh_effective_preferences_lambda = _lambda.Function(
+            self,
+            "RefreshEffectivePreferencesFunction",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            handler="handlers.refresh_effective_preferences_lambda.handler",
+            code=_lambda.Code.from_asset("../backend"),
+            memory_size=memory_sizes.get("RefreshEffectivePreferencesFunction"),
+            environment={
+                "PREFERENCES_TABLE": self.preferences_table.table_name,
+                "PREFERENCE_DOCUMENTS_TABLE": self.preference_documents_table.table_name,
+                "PREFERENCE_STORAGE_MODE": preference_storage_mode,
+                "EFFECTIVE_PREFERENCES_TABLE": self.effective_preferences_table.table_name,
+                "USERS_TABLE": self.users_table.table_name,
+                "MANAGED_PREFERENCES_TABLE": self.managed_prefs_table.table_name,
+                "AGE_THRESHOLDS_TABLE": self.age_thresholds_table.table_name,
+            },
+        )
+        refresh_effective_preferences_lambda.add_event_source(
+            lambda_event_sources.DynamoEventSource(
+                self.users_table,
+                starting_position=_lambda.StartingPosition.LATEST,
+                batch_size=100,
+                retry_attempts=3,
+                report_batch_item_failures=True,
+            )
+        )
+
+        # -------- Lambda: PreferenceWriteQueue -> Preferences / PreferenceVersions --------
+
+        apply_queued_writes_lambda = _lambda.Function(
+            self,
+            "ApplyQueuedWritesFunction",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            handler="handlers.apply_queued_writes_lambda.handler",
+            code=_lambda.Code.from_asset("../backend"),
+            memory_size=memory_sizes.get("ApplyQueuedWritesFunction"),
+            timeout=Duration.seconds(60),
+            environment={
+                "PREFERENCES_TABLE": self.preferences_table.table_name,
+                "PREFERENCE_DOCUMENTS_TABLE": self.preference_documents_table.table_name,
+                "PREFERENCE_STORAGE_MODE": preference_storage_mode,
+                "EFFECTIVE_PREFERENCES_TABLE": self.effective_preferences_table.table_name,
+                "PREFERENCE_OUTBOX_TABLE": self.preference_outbox_table.table_name,
+                "PREFERENCE_VERSIONS_TABLE": self.preference_versions_table.table_name,
+                "PREFERENCE_WRITE_QUEUE": self.write_queue.queue_url,
+                "PENDING_WRITES_TABLE": self.pending_writes_table.table_name,
+                "PREFERENCE_COALESCE_WINDOW_MS": coalesce_window_ms,
+                "USERS_TABLE": self.users_table.table_name,
+                "MANAGED_PREFERENCES_TABLE": self.managed_prefs_table.table_name,
+                "AGE_THRESHOLDS_TABLE": self.age_thresholds_table.table_name,
+            },
+        )
+        apply_queued_writes_lambda.add_event_source(
+            lambda_event_sources.SqsEventSource(
+                self.write_queue,
+                batch_size=100,
+                max_batching_window=Duration.seconds(5),
+                report_batch_item_failures=True,
+            )
+        )
+
+        # -------- Lambda: PreferenceOutbox stream / schedule -> event bus --------
+
+        publish_outbox_lambda = _lambda.Function(
+            self,
+            "PublishOutboxFunction",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            handler="handlers.publish_outbox_lambda.handler",
+            code=_lambda.Code.from_asset("../backend"),
+            memory_size=memory_sizes.get("PublishOutboxFunction"),
+            timeout=Duration.seconds(60),
+            environment={
+                "PREFERENCE_OUTBOX_TABLE": self.preference_outbox_table.table_name,
+                "PREFERENCE_EVENT_SINK": f"eventbridge://{self.preference_event_bus.event_bus_name}",
+            },
+        )
+        publish_outbox_lambda.add_event_source(
+            lambda_event_sources.DynamoEventSource(
+                self.preference_outbox_table,
+                starting_position=_lambda.StartingPosition.LATEST,
+                batch_size=100,
+                max_batching_window=Duration.seconds(1),
+                retry_attempts=3,
+                report_batch_item_failures=True,
+                filters=[_lambda.FilterCriteria.filter({"eventName": _lambda.FilterRule.is_equal("INSERT")})],
+            )
+        )
+        # Catches up rows a stream batch could not deliver.
+        events.Rule(
+            self,
+            "PublishOutboxSchedule",
+            schedule=events.Schedule.rate(Duration.minutes(5)),
+            targets=[events_targets.LambdaFunction(publish_outbox_lambda)],
+        )
+
         # -------- Lambda: GET /preference-versions* --------
 
         list_preference_versions_lambda = _lambda.Function(
@@ -217,13 +511,47 @@ class InfraStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_11,
             handler="handlers.list_preference_versions_lambda.handler",
             code=_lambda.Code.from_asset("../backend"),
+            memory_size=memory_sizes.get("ListPreferenceVersionsFunction"),
             environment={
                 "PREFERENCE_VERSIONS_TABLE": self.preference_versions_table.table_name,
+                "VERSION_ARCHIVE_LOCATION": version_archive_location,
                 "MANAGED_PREFERENCES_TABLE": self.managed_prefs_table.table_name,
                 "AGE_THRESHOLDS_TABLE": self.age_thresholds_table.table_name,
             },
         )
 
+        # -------- Lambda: GET /preferences-as-of/{userId} --------
+
+        get_preferences_as_of_lambda = _lambda.Function(
+            self,
+            "GetPreferencesAsOfFunction",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            handler="handlers.get_preferences_as_of_lambda.handler",
+            code=_lambda.Code.from_asset("../backend"),
+            memory_size=memory_sizes.get("GetPreferencesAsOfFunction"),
+            environment={
+                "PREFERENCE_VERSIONS_TABLE": self.preference_versions_table.table_name,
+                "VERSION_ARCHIVE_LOCATION": version_archive_location,
+            },
+        )
+
+        # -------- Lambda: GET /preference-diffs/{userId}, /children/{childId}/preference-diff --------
+
+        get_preference_diff_lambda = _lambda.Function(
+            self,
+            "GetPreferenceDiffFunction",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            handler="handlers.get_preference_diff_lambda.handler",
+            code=_lambda.Code.from_asset("../backend"),
+            memory_size=memory_sizes.get("GetPreferenceDiffFunction"),
+            environment={
+                "PREFERENCE_VERSIONS_TABLE": self.preference_versions_table.table_name,
+                "VERSION_ARCHIVE_LOCATION": version_archive_location,
+                "USERS_TABLE": self.users_table.table_name,
+                "CHILD_LINKS_TABLE": self.child_links_table.table_name,
+            },
+        )
+
         # -------- Lambda: POST /preferences/revert --------
         # -------- Lambda: GET /children --------
 
@@ -233,6 +561,7 @@ class InfraStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_11,
             handler="handlers.list_children_lambda.handler",
             code=_lambda.Code.from_asset("../backend"),
+            memory_size=memory_sizes.get("ListChildrenFunction"),
             environment={
                 "CHILD_LINKS_TABLE": self.child_links_table.table_name,
                 "USERS_TABLE": self.users_table.table_name,
@@ -247,9 +576,16 @@ class InfraStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_11,
             handler="handlers.revert_preference_lambda.handler",
             code=_lambda.Code.from_asset("../backend"),
+            memory_size=memory_sizes.get("RevertPreferenceFunction"),
             environment={
                 "PREFERENCES_TABLE": self.preferences_table.table_name,
+                "PREFERENCE_DOCUMENTS_TABLE": self.preference_documents_table.table_name,
+                "PREFERENCE_STORAGE_MODE": preference_storage_mode,
+                "EFFECTIVE_PREFERENCES_TABLE": self.effective_preferences_table.table_name,
+                "IDEMPOTENCY_TABLE": self.idempotency_table.table_name,
+                "PREFERENCE_OUTBOX_TABLE": self.preference_outbox_table.table_name,
                 "PREFERENCE_VERSIONS_TABLE": self.preference_versions_table.table_name,
+                "VERSION_ARCHIVE_LOCATION": version_archive_location,
                 "MANAGED_PREFERENCES_TABLE": self.managed_prefs_table.table_name,
                 "USERS_TABLE": self.users_table.table_name,
                 "AGE_THRESHOLDS_TABLE": self.age_thresholds_table.table_name,
@@ -284,8 +620,50 @@ class InfraStack(Stack):
         self.preference_versions_table.grant_write_data(set_user_preferences_lambda)
         self.preference_versions_table.grant_write_data(delete_user_preference_lambda)
         self.preference_versions_table.grant_read_data(list_preference_versions_lambda)
+        self.preference_versions_table.grant_read_data(get_preferences_as_of_lambda)
         self.preference_versions_table.grant_read_write_data(revert_preference_lambda)
+        self.version_archive_bucket.grant_read(list_preference_versions_lambda)
+        self.version_archive_bucket.grant_read(get_preferences_as_of_lambda)
+        self.version_archive_bucket.grant_read(revert_preference_lambda)
+        self.preference_versions_table.grant_read_data(get_preference_diff_lambda)
+        self.version_archive_bucket.grant_read(get_preference_diff_lambda)
+        self.users_table.grant_read_data(get_preference_diff_lambda)
+        self.child_links_table.grant_read_data(get_preference_diff_lambda)
         self.preferences_table.grant_read_write_data(revert_preference_lambda)
+        self.preference_documents_table.grant_read_data(get_user_preferences_lambda)
+        self.preference_documents_table.grant_read_write_data(set_user_preferences_lambda)
+        self.preference_documents_table.grant_read_write_data(delete_user_preference_lambda)
+        self.preference_documents_table.grant_read_write_data(revert_preference_lambda)
+        self.preference_documents_table.grant_read_data(refresh_effective_preferences_lambda)
+        self.preferences_table.grant_read_data(refresh_effective_preferences_lambda)
+        self.users_table.grant_read_data(refresh_effective_preferences_lambda)
+        self.managed_prefs_table.grant_read_data(refresh_effective_preferences_lambda)
+        self.age_thresholds_table.grant_read_data(refresh_effective_preferences_lambda)
+        self.effective_preferences_table.grant_read_write_data(get_user_preferences_lambda)
+        self.effective_preferences_table.grant_read_write_data(set_user_preferences_lambda)
+        self.effective_preferences_table.grant_read_write_data(delete_user_preference_lambda)
+        self.effective_preferences_table.grant_read_write_data(revert_preference_lambda)
+        self.effective_preferences_table.grant_read_write_data(refresh_effective_preferences_lambda)
+        self.idempotency_table.grant_read_write_data(set_user_preferences_lambda)
+        self.idempotency_table.grant_read_write_data(delete_user_preference_lambda)
+        self.idempotency_table.grant_read_write_data(revert_preference_lambda)
+        self.write_queue.grant_send_messages(set_user_preferences_lambda)
+        self.write_queue.grant_send_messages(apply_queued_writes_lambda)
+        self.pending_writes_table.grant_read_write_data(set_user_preferences_lambda)
+        self.pending_writes_table.grant_read_write_data(apply_queued_writes_lambda)
+        self.preferences_table.grant_read_write_data(apply_queued_writes_lambda)
+        self.preference_documents_table.grant_read_write_data(apply_queued_writes_lambda)
+        self.preference_versions_table.grant_read_write_data(apply_queued_writes_lambda)
+        self.effective_preferences_table.grant_write_data(apply_queued_writes_lambda)
+        self.users_table.grant_read_data(apply_queued_writes_lambda)
+        self.managed_prefs_table.grant_read_data(apply_queued_writes_lambda)
+        self.age_thresholds_table.grant_read_data(apply_queued_writes_lambda)
+        self.preference_outbox_table.grant_write_data(set_user_preferences_lambda)
+        self.preference_outbox_table.grant_write_data(delete_user_preference_lambda)
+        self.preference_outbox_table.grant_write_data(revert_preference_lambda)
+        self.preference_outbox_table.grant_write_data(apply_queued_writes_lambda)
+        self.preference_outbox_table.grant_read_write_data(publish_outbox_lambda)
+        self.preference_event_bus.grant_put_events_to(publish_outbox_lambda)
 
         # -------- API Gateway --------
 
@@ -295,6 +673,8 @@ class InfraStack(Stack):
             "X-Amz-Date",
             "X-Api-Key",
             "X-Amz-Security-Token",
+            "Idempotency-Key",
+            "Prefer",
         ]
         cors_allowed_origin = "http://localhost:5173"
 
@@ -442,6 +822,10 @@ class InfraStack(Stack):
             "PUT",
             apigw.LambdaIntegration(set_user_preferences_lambda),
         )
+        child_by_id.add_resource("preference-diff").add_method(
+            "GET",
+            apigw.LambdaIntegration(get_preference_diff_lambda),
+        )
         child_preference_key = child_preferences.add_resource("{preferenceKey}")
         child_preference_key.add_method(
             "DELETE",
@@ -467,6 +851,22 @@ class InfraStack(Stack):
             apigw.LambdaIntegration(list_preference_versions_lambda),
         )
 
+        # /preference-diffs/{userId}?from=&to= (or fromVersion= / toVersion=)
+        preference_diffs = api.root.add_resource("preference-diffs")
+        preference_diffs_by_user = preference_diffs.add_resource("{userId}")
+        preference_diffs_by_user.add_method(
+            "GET",
+            apigw.LambdaIntegration(get_preference_diff_lambda),
+        )
+
+        # /preferences-as-of/{userId}?at=<timestamp>
+        preferences_as_of = api.root.add_resource("preferences-as-of")
+        preferences_as_of_by_user = preferences_as_of.add_resource("{userId}")
+        preferences_as_of_by_user.add_method(
+            "GET",
+            apigw.LambdaIntegration(get_preferences_as_of_lambda),
+        )
+
         # /default-preferences
         default_preferences = api.root.add_resource("default-preferences")
         default_preferences.add_method(
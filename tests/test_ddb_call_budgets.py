@@ -0,0 +1,240 @@
+"""
+DynamoDB call budgets per handler scenario.
+
+Each handler declares ``DDB_CALL_BUDGETS``; every scenario below runs the handler
+twice against the moto stand-in (cold, then warm) and fails if the warm invocation
+makes more table calls than the handler's budget allows.
+
+A call is what ``lib.ddb_metrics`` records: one per table a request touches, not
+one per round trip. A TransactWriteItems or BatchGetItem spanning the preferences,
+versions and outbox tables is a single round trip but counts three times, so the
+budgets are upper bounds on per-table calls and overstate the round trips of
+handlers that write transactionally.
+"""
+
+import contextlib
+import io
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("moto")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import local_dynamodb  # noqa: E402
+from benchmarks.local_dynamodb import claims  # noqa: E402
+
+# Adult #4 lives in a country without its own AgeThresholds row, which forces the
+# DEFAULT fallback lookup: the worst case for context building.
+_ADULT_INDEX = 4
+
+
+def _scenarios(dataset):
+    adult = dataset.adults[_ADULT_INDEX]
+    child = dataset.children[adult][0]
+    keys = dataset.preference_keys
+
+    return {
+        ("get_user_lambda", "by_id"): {"pathParameters": {"userId": adult}},
+        ("get_user_preferences_lambda", "self"): {"requestContext": claims(adult)},
+        ("get_user_preferences_lambda", "child"): {
+            "pathParameters": {"childId": child},
+            "requestContext": claims(adult),
+        },
+        ("get_user_preferences_lambda", "path"): {"pathParameters": {"userId": adult}},
+        ("set_user_preferences_lambda", "self"): {
+            "requestContext": claims(adult),
+            "body": json.dumps({"preferenceKey": keys[0], "value": "budget"}),
+        },
+        ("set_user_preferences_lambda", "child"): {
+            "pathParameters": {"childId": child},
+            "requestContext": claims(adult),
+            "body": json.dumps({"preferenceKey": keys[1], "value": "budget"}),
+        },
+        ("set_user_preferences_lambda", "batch"): {
+            "requestContext": claims(adult),
+            "body": json.dumps({key: "budget" for key in keys[:5]}),
+        },
+        ("set_user_preferences_lambda", "document_self"): {
+            "requestContext": claims(adult),
+            "body": json.dumps({"preferenceKey": keys[0], "value": "document"}),
+        },
+        ("set_user_preferences_lambda", "document_batch"): {
+            "requestContext": claims(adult),
+            "body": json.dumps({key: "document" for key in keys[:5]}),
+        },
+        ("delete_user_preference_lambda", "self"): {
+            "pathParameters": {"preferenceKey": keys[2]},
+            "requestContext": claims(adult),
+        },
+        ("delete_user_preference_lambda", "document_self"): {
+            "pathParameters": {"preferenceKey": keys[4]},
+            "requestContext": claims(adult),
+        },
+        ("delete_user_preference_lambda", "child"): {
+            "pathParameters": {"childId": child, "preferenceKey": keys[3]},
+            "requestContext": claims(adult),
+        },
+        ("list_preference_versions_lambda", "user"): {"pathParameters": {"userId": adult}},
+        ("list_preference_versions_lambda", "preference_key"): {
+            "pathParameters": {"userId": adult, "preferenceKey": keys[0]},
+        },
+        ("list_preference_versions_lambda", "user_range"): {
+            "pathParameters": {"userId": adult},
+            "queryStringParameters": {"from": "2000-01-01", "to": "2999-12-31"},
+        },
+        ("list_preference_versions_lambda", "user_action"): {
+            "pathParameters": {"userId": adult},
+            "queryStringParameters": {"action": "UPSERT"},
+        },
+        ("list_preference_versions_lambda", "key_across_users"): {
+            "queryStringParameters": {"preferenceKey": keys[0], "from": "2000-01-01"},
+        },
+        ("list_preference_versions_lambda", "version"): {
+            "pathParameters": {"userId": adult, "preferenceKey": keys[0]},
+            "queryStringParameters": {"version": "1"},
+        },
+        ("get_preferences_as_of_lambda", "as_of"): {
+            "pathParameters": {"userId": adult},
+            "queryStringParameters": {"at": "2999-12-31"},
+        },
+        ("get_preference_diff_lambda", "range"): {
+            "pathParameters": {"userId": adult},
+            "queryStringParameters": {"from": "2000-01-01", "to": "2999-12-31"},
+        },
+        ("get_preference_diff_lambda", "versions"): {
+            "pathParameters": {"userId": adult},
+            "queryStringParameters": {
+                "fromVersion": dataset.version_keys[adult][0],
+                "toVersion": dataset.version_keys[adult][-1],
+            },
+        },
+        ("get_preference_diff_lambda", "child"): {
+            "pathParameters": {"childId": child},
+            "requestContext": claims(adult),
+            "queryStringParameters": {"to": "2999-12-31"},
+        },
+        ("revert_preference_lambda", "revert"): {
+            "body": json.dumps(
+                {
+                    "userId": adult,
+                    "preferenceKey": keys[0],
+                    "versionKey": dataset.version_keys[adult][0],
+                }
+            ),
+        },
+        ("revert_preference_lambda", "bulk"): {
+            "body": json.dumps({"userId": adult, "at": "2000-01-01", "preferenceKeys": [keys[0]]}),
+        },
+        ("list_children_lambda", "adult"): {"requestContext": claims(adult)},
+        ("default_preferences_lambda", "self"): {"requestContext": claims(adult)},
+    }
+
+
+@pytest.fixture(scope="module")
+def budget_env():
+    with local_dynamodb.local_dynamodb() as dynamodb:
+        dataset = local_dynamodb.seed(
+            dynamodb,
+            adults=_ADULT_INDEX + 1,
+            children_per_adult=1,
+            schema_rows=10,
+            prefs_per_user=6,
+            version_depth=3,
+        )
+        handlers = local_dynamodb.load_handlers()
+        migration = local_dynamodb.load_job("migrate_preference_documents")
+        document_store = _document_store(dynamodb)
+        for user_id in dataset.all_users:
+            migration.migrate_user(document_store, user_id)
+
+        from lib import ddb_metrics
+
+        sink = ddb_metrics.InMemorySink()
+        previous = ddb_metrics.set_sink(sink)
+        try:
+            yield handlers, _scenarios(dataset), sink, document_store
+        finally:
+            ddb_metrics.set_sink(previous)
+
+
+def _document_store(dynamodb):
+    from lib.ddb_metrics import instrument_table
+    from lib.preference_store import PreferenceStore
+
+    return PreferenceStore(
+        instrument_table(dynamodb.Table(local_dynamodb.TABLES["PREFERENCES_TABLE"][0])),
+        instrument_table(dynamodb.Table(local_dynamodb.TABLES["PREFERENCE_DOCUMENTS_TABLE"][0])),
+        mode="document",
+    )
+
+
+def _measure(handler, event, sink):
+    with contextlib.redirect_stdout(io.StringIO()):
+        handler(dict(event), None)
+        sink.clear()
+        response = handler(dict(event), None)
+    return response, sink.calls(), sorted(
+        (doc["Table"], doc["Operation"], doc["Calls"]) for doc in sink.documents
+    )
+
+
+def test_every_handler_declares_budgets_for_its_scenarios(budget_env):
+    handlers, scenarios, _, _ = budget_env
+    covered = {}
+    for module_name, scenario in scenarios:
+        covered.setdefault(module_name, set()).add(scenario)
+
+    for module_name, module in handlers.items():
+        budgets = getattr(module, "DDB_CALL_BUDGETS", None)
+        assert budgets, f"{module_name} does not declare DDB_CALL_BUDGETS"
+        assert set(budgets) == covered.get(module_name, set()), module_name
+
+
+@pytest.mark.parametrize(
+    "module_name,scenario",
+    [
+        ("get_user_lambda", "by_id"),
+        ("get_user_preferences_lambda", "self"),
+        ("get_user_preferences_lambda", "child"),
+        ("get_user_preferences_lambda", "path"),
+        ("set_user_preferences_lambda", "self"),
+        ("set_user_preferences_lambda", "child"),
+        ("set_user_preferences_lambda", "batch"),
+        ("set_user_preferences_lambda", "document_self"),
+        ("set_user_preferences_lambda", "document_batch"),
+        ("delete_user_preference_lambda", "self"),
+        ("delete_user_preference_lambda", "child"),
+        ("delete_user_preference_lambda", "document_self"),
+        ("list_preference_versions_lambda", "user"),
+        ("list_preference_versions_lambda", "preference_key"),
+        ("list_preference_versions_lambda", "user_range"),
+        ("list_preference_versions_lambda", "user_action"),
+        ("list_preference_versions_lambda", "key_across_users"),
+        ("list_preference_versions_lambda", "version"),
+        ("get_preferences_as_of_lambda", "as_of"),
+        ("get_preference_diff_lambda", "range"),
+        ("get_preference_diff_lambda", "versions"),
+        ("get_preference_diff_lambda", "child"),
+        ("revert_preference_lambda", "revert"),
+        ("revert_preference_lambda", "bulk"),
+        ("list_children_lambda", "adult"),
+        ("default_preferences_lambda", "self"),
+    ],
+)
+def test_handler_stays_within_ddb_call_budget(budget_env, monkeypatch, module_name, scenario):
+    handlers, scenarios, sink, document_store = budget_env
+    module = handlers[module_name]
+    budget = module.DDB_CALL_BUDGETS[scenario]
+    if scenario.startswith("document_"):
+        monkeypatch.setattr(module, "preference_store", document_store)
+
+    response, calls, breakdown = _measure(module.handler, scenarios[(module_name, scenario)], sink)
+
+    assert response["statusCode"] == 200, response
+    assert calls <= budget, (
+        f"{module_name}[{scenario}] made {calls} DynamoDB calls, budget is {budget}: {breakdown}"
+    )
@@ -0,0 +1,72 @@
+from lib import ddb_metrics
+from lib.observability import instrument_handler
+
+
+class _FakeTable:
+    name = "Preferences"
+
+    def __init__(self):
+        self.calls = []
+
+    def get_item(self, **kwargs):
+        self.calls.append(("get_item", kwargs))
+        return {
+            "Item": {"userId": "u1"},
+            "ConsumedCapacity": {"TableName": self.name, "CapacityUnits": 0.5},
+        }
+
+    def put_item(self, **kwargs):
+        self.calls.append(("put_item", kwargs))
+        return {"ConsumedCapacity": {"TableName": self.name, "CapacityUnits": 1.0}}
+
+
+def test_instrumented_table_requests_consumed_capacity_and_emits_emf():
+    sink = ddb_metrics.InMemorySink()
+    previous = ddb_metrics.set_sink(sink)
+    fake = _FakeTable()
+    table = ddb_metrics.instrument_table(fake)
+
+    @instrument_handler("unit_test")
+    def handler(event, context):
+        table.get_item(Key={"userId": "u1"})
+        table.get_item(Key={"userId": "u2"})
+        table.put_item(Item={"userId": "u1"})
+        return {"statusCode": 200}
+
+    try:
+        assert handler({}, None) == {"statusCode": 200}
+    finally:
+        ddb_metrics.set_sink(previous)
+
+    assert all(kwargs["ReturnConsumedCapacity"] == "TOTAL" for _, kwargs in fake.calls)
+    assert table.name == "Preferences"
+
+    by_operation = {doc["Operation"]: doc for doc in sink.documents}
+    assert by_operation["get_item"]["Calls"] == 2
+    assert by_operation["get_item"]["ConsumedRCU"] == 1.0
+    assert by_operation["put_item"]["ConsumedWCU"] == 1.0
+    assert sink.calls(function="unit_test") == 3
+
+    emf = by_operation["get_item"]["_aws"]["CloudWatchMetrics"][0]
+    assert ["Function", "Table", "Operation"] in emf["Dimensions"]
+    assert {"Name": "Calls", "Unit": "Count"} in emf["Metrics"]
+
+
+def test_invocations_do_not_leak_counts_into_each_other():
+    sink = ddb_metrics.InMemorySink()
+    previous = ddb_metrics.set_sink(sink)
+    table = ddb_metrics.instrument_table(_FakeTable())
+
+    @instrument_handler("unit_test")
+    def handler(event, context):
+        for _ in range(event["calls"]):
+            table.get_item(Key={"userId": "u1"})
+
+    try:
+        handler({"calls": 3}, None)
+        sink.clear()
+        handler({"calls": 1}, None)
+    finally:
+        ddb_metrics.set_sink(previous)
+
+    assert sink.calls() == 1
@@ -0,0 +1,127 @@
+import contextlib
+import io
+import json
+import os
+import sys
+from datetime import date
+
+import pytest
+
+pytest.importorskip("moto")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import local_dynamodb  # noqa: E402
+from benchmarks.local_dynamodb import claims  # noqa: E402
+
+
+@pytest.fixture
+def view_env():
+    with local_dynamodb.local_dynamodb() as dynamodb:
+        local_dynamodb.configure_environment()
+        from lib.schema_version import bump_schema_version
+
+        schema = dynamodb.Table("ManagedPreferenceSchema")
+        schema.put_item(
+            Item={
+                "preferenceKey": "theme",
+                "scope": "GLOBAL",
+                "baseDefault": "light",
+                "countryOverrides": {"FI": "dark"},
+            }
+        )
+        bump_schema_version(schema)
+        dynamodb.Table("Users").put_item(
+            Item={"userId": "alice", "role": "Adult", "country": "UA", "birthDate": "1990-06-15"}
+        )
+        handlers = local_dynamodb.load_handlers(
+            local_dynamodb.HANDLER_MODULES + ("refresh_effective_preferences_lambda",)
+        )
+        yield dynamodb, handlers
+
+
+def _call(handler, event):
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = handler(event, None)
+    assert response["statusCode"] == 200, response
+    return json.loads(response["body"])
+
+
+def _me(handlers):
+    body = _call(handlers["get_user_preferences_lambda"].handler, {"requestContext": claims("alice")})
+    return {item["preferenceKey"]: item["value"] for item in body}
+
+
+def test_writes_maintain_the_view_and_reads_use_it(view_env):
+    dynamodb, handlers = view_env
+    view = dynamodb.Table("EffectivePreferences")
+
+    assert _me(handlers) == {"theme": "light"}
+    stored = view.get_item(Key={"userId": "alice"})["Item"]
+    assert stored["country"] == "UA" and stored["validUntil"] > date.today().isoformat()
+
+    _call(
+        handlers["set_user_preferences_lambda"].handler,
+        {"requestContext": claims("alice"), "body": json.dumps({"language": "fi"})},
+    )
+    assert {item["preferenceKey"] for item in view.get_item(Key={"userId": "alice"})["Item"]["preferences"]} == {
+        "language",
+        "theme",
+    }
+
+    # A write that bypasses the handlers is not visible until the view goes stale.
+    dynamodb.Table("Preferences").put_item(
+        Item={"userId": "alice", "preferenceKey": "language", "value": "sv", "updatedAt": "2030-01-01T00:00:00.000Z"}
+    )
+    assert _me(handlers)["language"] == "fi"
+
+    from lib import preferences_resolver
+    from lib.schema_version import bump_schema_version
+
+    bump_schema_version(dynamodb.Table("ManagedPreferenceSchema"))
+    preferences_resolver._schema_cache["checked_at"] = 0.0
+    assert _me(handlers) == {"language": "sv", "theme": "light"}
+
+
+def test_user_stream_recomputes_on_context_change(view_env):
+    dynamodb, handlers = view_env
+    from boto3.dynamodb.types import TypeSerializer
+
+    serializer = TypeSerializer()
+    old = {"userId": "alice", "role": "Adult", "country": "UA", "birthDate": "1990-06-15"}
+    new = dict(old, country="FI")
+    dynamodb.Table("Users").put_item(Item=new)
+
+    def record(event_name, old_image, new_image, sequence):
+        images = {}
+        if old_image:
+            images["OldImage"] = {k: serializer.serialize(v) for k, v in old_image.items()}
+        if new_image:
+            images["NewImage"] = {k: serializer.serialize(v) for k, v in new_image.items()}
+        return {
+            "eventName": event_name,
+            "dynamodb": {"Keys": {"userId": {"S": "alice"}}, "SequenceNumber": sequence, **images},
+        }
+
+    refresh = handlers["refresh_effective_preferences_lambda"].handler
+    with contextlib.redirect_stdout(io.StringIO()):
+        unchanged = refresh({"Records": [record("MODIFY", old, dict(old, nickname="A"), "1")]}, None)
+        changed = refresh({"Records": [record("MODIFY", old, new, "2")]}, None)
+    assert unchanged == changed == {"batchItemFailures": []}
+
+    stored = dynamodb.Table("EffectivePreferences").get_item(Key={"userId": "alice"})["Item"]
+    assert stored["country"] == "FI" and stored["preferences"][0]["value"] == "dark"
+    assert _me(handlers) == {"theme": "dark"}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        refresh({"Records": [record("REMOVE", new, None, "3")]}, None)
+    assert "Item" not in dynamodb.Table("EffectivePreferences").get_item(Key={"userId": "alice"})
+
+
+def test_next_birthday_bounds_the_view():
+    local_dynamodb.configure_environment()
+    from lib.effective_preferences import next_birthday
+
+    assert next_birthday("2000-02-29", today=date(2025, 1, 10)) == "2025-03-01"
+    assert next_birthday("1990-06-15", today=date(2025, 6, 15)) == "2026-06-15"
+    assert next_birthday(None) is None
@@ -0,0 +1,71 @@
+import contextlib
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("moto")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import local_dynamodb  # noqa: E402
+
+
+@pytest.fixture
+def export_env():
+    with local_dynamodb.local_dynamodb() as dynamodb:
+        dataset = local_dynamodb.seed(
+            dynamodb, adults=6, children_per_adult=1, schema_rows=0, prefs_per_user=7, version_depth=0
+        )
+        yield dataset, local_dynamodb.load_job("export_preferences")
+
+
+def _export(job, *args):
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        job.main(list(args))
+    return json.loads(out.getvalue())
+
+
+def test_segmented_export_writes_every_row_once(export_env, tmp_path):
+    dataset, job = export_env
+    report = _export(
+        job, str(tmp_path), "--segments", "3", "--workers", "3", "--format", "csv",
+        "--page-size", "5", "--rows-per-shard", "10",
+    )
+
+    rows = []
+    for shard in sorted(tmp_path.glob("part-*.csv.gz")):
+        with gzip.open(shard, "rt", newline="") as fh:
+            rows.extend(csv.DictReader(fh))
+    expected = {(user, key) for user in dataset.all_users for key in dataset.preference_keys}
+    assert sorted((row["userId"], row["preferenceKey"]) for row in rows) == sorted(expected)
+    assert report["rows"] == len(expected)
+    manifest = json.loads((tmp_path / "_manifest.json").read_text())
+    assert sum(shard["rows"] for shard in manifest["shards"]) == len(expected)
+
+
+def test_resume_skips_finished_segments(export_env, tmp_path):
+    _, job = export_env
+    first = _export(job, str(tmp_path), "--segments", "2")
+    with pytest.raises(SystemExit):
+        _export(job, str(tmp_path), "--segments", "2")
+
+    resumed = _export(job, str(tmp_path), "--segments", "2", "--resume")
+    assert resumed["rows"] == first["rows"]
+    assert resumed["consumedRCU"] == 0
+
+
+def test_max_rcu_throttles_with_metrics_off(export_env, tmp_path, monkeypatch):
+    _, job = export_env
+    monkeypatch.setenv("DDB_METRICS", "off")
+    waits = []
+    monkeypatch.setattr(job.time, "sleep", waits.append)
+
+    report = _export(job, str(tmp_path), "--segments", "2", "--workers", "2", "--page-size", "5", "--max-rcu", "1")
+
+    assert report["consumedRCU"] > 1
+    assert waits and all(wait > 0 for wait in waits)
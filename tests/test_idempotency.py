@@ -0,0 +1,90 @@
+import contextlib
+import io
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("moto")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import local_dynamodb  # noqa: E402
+from benchmarks.local_dynamodb import claims  # noqa: E402
+
+
+@pytest.fixture
+def idempotency_env():
+    with local_dynamodb.local_dynamodb() as dynamodb:
+        local_dynamodb.configure_environment()
+        dynamodb.Table("Users").put_item(
+            Item={"userId": "alice", "role": "Adult", "country": "UA", "birthDate": "1990-06-15"}
+        )
+        yield dynamodb, local_dynamodb.load_handlers()
+
+
+def _put(handlers, body, key=None):
+    event = {"requestContext": claims("alice"), "body": json.dumps(body)}
+    if key:
+        event["headers"] = {"Idempotency-Key": key}
+    with contextlib.redirect_stdout(io.StringIO()):
+        return handlers["set_user_preferences_lambda"].handler(event, None)
+
+
+def _versions(dynamodb):
+    items = dynamodb.Table("PreferenceVersions").scan()["Items"]
+    return [item for item in items if not item["preferenceKey_ts"].startswith("#")]
+
+
+def test_retries_replay_the_first_response(idempotency_env):
+    dynamodb, handlers = idempotency_env
+
+    first = _put(handlers, {"language": "fi"}, key="k-1")
+    assert first["statusCode"] == 200 and "Idempotent-Replayed" not in first["headers"]
+
+    # The durable record answers even when the container cache is cold.
+    handlers["set_user_preferences_lambda"].idempotency_store._cache.clear()
+    retry = _put(handlers, {"language": "fi"}, key="k-1")
+    assert retry["headers"]["Idempotent-Replayed"] == "true"
+    assert json.loads(retry["body"]) == json.loads(first["body"])
+    assert _put(handlers, {"language": "fi"}, key="k-1")["headers"]["Idempotent-Replayed"] == "true"
+    assert len(_versions(dynamodb)) == 1
+
+    assert _put(handlers, {"language": "sv"}, key="k-1")["statusCode"] == 422
+    assert _put(handlers, {"language": "sv"}, key="k-2")["statusCode"] == 200
+    assert _put(handlers, {"language": "sv"})["statusCode"] == 200
+    assert len(_versions(dynamodb)) == 3
+
+
+def test_in_progress_and_failed_attempts(idempotency_env):
+    _, handlers = idempotency_env
+    store = handlers["set_user_preferences_lambda"].idempotency_store
+    record_key = "set_user_preferences#alice#k-3"
+
+    assert store.begin(record_key, "fp") is None
+    assert store.begin(record_key, "fp")["statusCode"] == 409
+
+    # A 5xx / 409 outcome releases the key, so the next retry runs again.
+    store.complete(record_key, "fp", {"statusCode": 500, "body": "{}"})
+    assert store.begin(record_key, "fp") is None
+
+
+def test_response_is_returned_when_storing_it_fails(idempotency_env, monkeypatch):
+    dynamodb, handlers = idempotency_env
+    store = handlers["set_user_preferences_lambda"].idempotency_store
+    put_item = store.table.put_item
+
+    def failing_put_item(**kwargs):
+        if kwargs["Item"]["status"] == "COMPLETED":
+            raise RuntimeError("throttled")
+        return put_item(**kwargs)
+
+    monkeypatch.setattr(store.table, "put_item", failing_put_item, raising=False)
+
+    first = _put(handlers, {"language": "fi"}, key="k-4")
+    assert first["statusCode"] == 200
+    # The same container still replays it from its cache.
+    retry = _put(handlers, {"language": "fi"}, key="k-4")
+    assert retry["headers"]["Idempotent-Replayed"] == "true"
+    assert len(_versions(dynamodb)) == 1
@@ -0,0 +1,104 @@
+import contextlib
+import io
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("moto")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import local_dynamodb  # noqa: E402
+
+
+@pytest.fixture
+def import_env():
+    with local_dynamodb.local_dynamodb() as dynamodb:
+        dataset = local_dynamodb.seed(
+            dynamodb, adults=2, children_per_adult=1, schema_rows=7, prefs_per_user=0, version_depth=0
+        )
+        yield dynamodb, dataset, local_dynamodb.load_job("import_preferences")
+
+
+def _stored(dynamodb, user_id):
+    from boto3.dynamodb.conditions import Key
+
+    items = dynamodb.Table("Preferences").query(KeyConditionExpression=Key("userId").eq(user_id))["Items"]
+    return {item["preferenceKey"]: item["value"] for item in items}
+
+
+def test_import_validates_rows_and_writes_versions(import_env, tmp_path):
+    dynamodb, dataset, job = import_env
+    adult = dataset.adults[0]
+    child = dataset.children[adult][0]
+    source = tmp_path / "prefs.csv"
+    source.write_text(
+        "userId,preferenceKey,value\n"
+        f"{adult},theme,dark\n"
+        f"{child},managed_pref_000,on\n"  # childOverride == "locked"
+        f"{child},theme,light\n"
+        f"{adult},theme,dim\n"
+    )
+    rejects = tmp_path / "rejects.ndjson"
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        job.main([str(source), "--write-versions", "--rejects", str(rejects)])
+
+    assert _stored(dynamodb, adult) == {"theme": "dim"}
+    assert _stored(dynamodb, child) == {"theme": "light"}
+    rejected = [json.loads(line) for line in rejects.read_text().splitlines()]
+    assert [(row["line"], row["reason"]) for row in rejected] == [(3, "Preference is locked for children")]
+    versions = [item for item in dynamodb.Table("PreferenceVersions").scan()["Items"] if "action" in item]
+    assert {item["action"] for item in versions} == {"IMPORT"}
+    assert sorted(int(item["version"]) for item in versions if item["userId"] == adult) == [1, 2]
+    checkpoint = json.loads((tmp_path / "prefs.csv.checkpoint.json").read_text())
+    assert checkpoint["done"] and checkpoint["committedLine"] == 5
+
+
+def test_resume_skips_committed_lines(import_env, tmp_path):
+    dynamodb, dataset, job = import_env
+    users = dataset.adults
+    source = tmp_path / "prefs.ndjson"
+    source.write_text(
+        "\n".join(json.dumps({"userId": users[i % 2], "preferenceKey": f"k{i}", "value": i}) for i in range(6))
+    )
+    checkpoint = tmp_path / "ckpt.json"
+    checkpoint.write_text(
+        json.dumps({"source": str(source.resolve()), "committedLine": 4, "stats": {"read": 4, "imported": 4}})
+    )
+
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        job.main([str(source), "--checkpoint", str(checkpoint), "--resume"])
+
+    report = json.loads(out.getvalue())
+    assert report["resumedAfterLine"] == 4 and report["read"] == 6
+    assert _stored(dynamodb, users[0]) == {"k4": "4"}
+    assert _stored(dynamodb, users[1]) == {"k5": "5"}
+
+
+def test_resume_reuses_version_numbers_of_rewritten_rows(import_env, tmp_path):
+    dynamodb, dataset, job = import_env
+    users = dataset.adults
+    source = tmp_path / "prefs.ndjson"
+    source.write_text(
+        "\n".join(json.dumps({"userId": users[i % 2], "preferenceKey": f"k{i}", "value": i}) for i in range(6))
+    )
+    checkpoint = tmp_path / "ckpt.json"
+    with contextlib.redirect_stdout(io.StringIO()):
+        job.main([str(source), "--checkpoint", str(checkpoint), "--write-versions"])
+
+    # As if the run died after the batch with lines 5-6 was written but before it was committed.
+    state = json.loads(checkpoint.read_text())
+    assert state["sequences"] == {}
+    state.update(committedLine=4, done=False, sequences={"5": 1, "6": 1})
+    checkpoint.write_text(json.dumps(state))
+    with contextlib.redirect_stdout(io.StringIO()):
+        job.main([str(source), "--checkpoint", str(checkpoint), "--write-versions", "--resume"])
+
+    rows = [item for item in dynamodb.Table("PreferenceVersions").scan()["Items"] if "action" in item]
+    assert sorted((item["preferenceKey"], int(item["version"])) for item in rows) == [(f"k{i}", 1) for i in range(6)]
+    counters = [item for item in dynamodb.Table("PreferenceVersions").scan()["Items"] if "action" not in item]
+    assert {int(item["sequence"]) for item in counters} == {1}
+    assert json.loads(checkpoint.read_text())["sequences"] == {}
@@ -0,0 +1,85 @@
+import contextlib
+import io
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("moto")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import local_dynamodb  # noqa: E402
+from benchmarks.local_dynamodb import claims  # noqa: E402
+
+
+@pytest.fixture
+def outbox_env():
+    with local_dynamodb.local_dynamodb() as dynamodb:
+        local_dynamodb.configure_environment()
+        dynamodb.Table("Users").put_item(
+            Item={"userId": "alice", "role": "Adult", "country": "UA", "birthDate": "1990-06-15"}
+        )
+        yield dynamodb, local_dynamodb.load_handlers()
+
+
+def _call(handlers, name, event):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return handlers[name].handler(event, None)
+
+
+def _outbox_rows(dynamodb):
+    return dynamodb.Table("PreferenceOutbox").scan(ConsistentRead=True)["Items"]
+
+
+class _RejectingSink:
+    def publish(self, events):
+        return []
+
+
+def test_mutations_record_events_that_the_publisher_drains(outbox_env, tmp_path):
+    dynamodb, handlers = outbox_env
+    put = {"requestContext": claims("alice"), "body": json.dumps({"language": "fi", "theme": "dark"})}
+    assert _call(handlers, "set_user_preferences_lambda", put)["statusCode"] == 200
+    put = {"requestContext": claims("alice"), "body": json.dumps({"language": "en"})}
+    assert _call(handlers, "set_user_preferences_lambda", put)["statusCode"] == 200
+    delete = {"requestContext": claims("alice"), "pathParameters": {"preferenceKey": "theme"}}
+    assert _call(handlers, "delete_user_preference_lambda", delete)["statusCode"] == 200
+
+    rows = sorted(_outbox_rows(dynamodb), key=lambda row: row["eventId"])
+    assert [(row["action"], row["changes"]) for row in rows] == [
+        (
+            "UPSERT",
+            [{"preferenceKey": "language", "newValue": "fi"}, {"preferenceKey": "theme", "newValue": "dark"}],
+        ),
+        ("UPSERT", [{"preferenceKey": "language", "oldValue": "fi", "newValue": "en"}]),
+        ("DELETE", [{"preferenceKey": "theme", "oldValue": "dark"}]),
+    ]
+    assert {row["shard"] for row in rows} == {rows[0]["shard"]}
+
+    from lib.outbox import FileSink, OutboxPublisher
+
+    table = dynamodb.Table("PreferenceOutbox")
+    kept = OutboxPublisher(table, _RejectingSink()).drain(batch_size=2)
+    assert kept == {"batches": 1, "published": 0, "failed": 2}
+    assert len(_outbox_rows(dynamodb)) == 3
+
+    sink_path = tmp_path / "events.ndjson"
+    report = OutboxPublisher(table, FileSink(str(sink_path))).drain(batch_size=2)
+    assert report == {"batches": 2, "published": 3, "failed": 0}
+    published = [json.loads(line) for line in sink_path.read_text().splitlines()]
+    assert [event["detail"]["eventId"] for event in published] == [row["eventId"] for row in rows]
+    assert published[0]["detail-type"] == "PreferencesChanged" and published[0]["detail"]["userId"] == "alice"
+    assert _outbox_rows(dynamodb) == []
+
+
+def test_rejected_write_records_no_event(outbox_env):
+    dynamodb, handlers = outbox_env
+    dynamodb.Table("ManagedPreferenceSchema").put_item(
+        Item={"preferenceKey": "voice_chat_enabled", "scope": "GLOBAL", "baseDefault": "false", "minAge": 16}
+    )
+    dynamodb.Table("Users").put_item(Item={"userId": "kid", "role": "Child", "country": "UA", "birthDate": "2016-01-01"})
+    put = {"requestContext": claims("kid"), "body": json.dumps({"voice_chat_enabled": "true"})}
+    assert _call(handlers, "set_user_preferences_lambda", put)["statusCode"] == 403
+    assert _outbox_rows(dynamodb) == []
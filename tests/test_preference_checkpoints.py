@@ -0,0 +1,238 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("moto")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import local_dynamodb  # noqa: E402
+
+HISTORY = [
+    ("theme", "UPSERT", None, "dark", "2024-05-01T09:00:00.000Z"),
+    ("language", "UPSERT", None, "fi", "2024-05-01T10:00:00.000Z"),
+    ("theme", "UPSERT", "dark", "light", "2024-05-02T09:00:00.000Z"),
+    ("language", "DELETE", "fi", None, "2024-05-03T09:00:00.000Z"),
+    ("theme", "REVERT", "light", "dark", "2024-05-04T09:00:00.000Z"),
+]
+
+
+@pytest.fixture
+def as_of_env():
+    with local_dynamodb.local_dynamodb() as dynamodb:
+        local_dynamodb.configure_environment()
+        from lib.preference_versions import build_version_item, counter_key
+
+        dynamodb.Table("Users").put_item(Item={"userId": "alice", "role": "Adult", "country": "UA"})
+        table = dynamodb.Table("PreferenceVersions")
+        sequences = {}
+        for key, action, old, new, timestamp in HISTORY:
+            sequences[key] = sequences.get(key, 0) + 1
+            table.put_item(Item=build_version_item("alice", key, old, new, action, sequences[key], timestamp))
+        for key, sequence in sequences.items():
+            table.put_item(Item={**counter_key("alice", key), "sequence": sequence})
+        handlers = local_dynamodb.load_handlers()
+        yield dynamodb, handlers, local_dynamodb.load_job("checkpoint_preference_versions")
+
+
+def _as_of(handlers, at):
+    handler = handlers["get_preferences_as_of_lambda"].handler
+    event = {"pathParameters": {"userId": "alice"}, "queryStringParameters": {"at": at}}
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = handler(event, None)
+    body = json.loads(response["body"])
+    if response["statusCode"] != 200:
+        return response["statusCode"]
+    return {item["preferenceKey"]: item["value"] for item in body["preferences"]}, body["checkpoint"], body["replayed"]
+
+
+def test_reconstructs_state_at_timestamp(as_of_env):
+    _, handlers, _ = as_of_env
+    assert _as_of(handlers, "2024-04-30") == ({}, None, 0)
+    assert _as_of(handlers, "2024-05-01") == ({"theme": "dark", "language": "fi"}, None, 2)
+    assert _as_of(handlers, "2024-05-02T09:00:00.000Z") == ({"theme": "light", "language": "fi"}, None, 3)
+    assert _as_of(handlers, "2024-05-03") == ({"theme": "light"}, None, 4)
+    assert _as_of(handlers, "yesterday") == 400
+
+
+def test_checkpoint_bounds_the_replayed_tail(as_of_env):
+    dynamodb, handlers, job = as_of_env
+    users = dynamodb.Table("Users")
+    versions = dynamodb.Table("PreferenceVersions")
+
+    report = job.run(users, versions, total_segments=2, workers=2, lag_seconds=0)
+    assert (report["users"], report["checkpoints"], report["replayed"]) == (1, 1, 5)
+    assert job.run(users, versions, total_segments=2, workers=2, lag_seconds=0)["checkpoints"] == 0
+
+    from lib.preference_versions import record_version
+
+    time.sleep(0.01)  # versions at the checkpoint's own millisecond belong to it
+    record_version(versions, "alice", "sound", None, "off", "UPSERT")
+    preferences, checkpoint, replayed = _as_of(handlers, "2999-12-31")
+    assert preferences == {"theme": "dark", "sound": "off"}
+    assert checkpoint == report["asOf"] and replayed == 1
+    # Points in time before the checkpoint still replay from the history.
+    assert _as_of(handlers, "2024-05-03") == ({"theme": "light"}, None, 4)
+
+
+def test_bulk_revert_restores_keys_changed_since(as_of_env):
+    dynamodb, handlers, _ = as_of_env
+    preferences = dynamodb.Table("Preferences")
+    for key, value, updated_at in [
+        ("theme", "dark", "2024-05-04T09:00:00.000Z"),
+        ("sound", "on", "2024-06-01T00:00:00.000Z"),
+        ("legacy", "x", "2020-01-01T00:00:00.000Z"),
+    ]:
+        preferences.put_item(Item={"userId": "alice", "preferenceKey": key, "value": value, "updatedAt": updated_at})
+
+    def bulk(**payload):
+        event = {"body": json.dumps({"userId": "alice", "at": "2024-05-02T12:00", **payload})}
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = handlers["revert_preference_lambda"].handler(event, None)
+        assert response["statusCode"] == 200, response
+        body = json.loads(response["body"])
+        return [(c["preferenceKey"], c["from"], c["to"], c["version"]) for c in body["reverted"]], {
+            item["preferenceKey"]: item["value"] for item in body["items"]
+        }
+
+    assert bulk(preferenceKeys=["theme"]) == (
+        [("theme", "dark", "light", 4)],
+        {"legacy": "x", "sound": "on", "theme": "light"},
+    )
+    assert bulk() == (
+        [("language", None, "fi", 3), ("sound", "on", None, 1)],
+        {"language": "fi", "legacy": "x", "theme": "light"},
+    )
+    assert bulk()[0] == []
+
+    stored = {item["preferenceKey"]: item["value"] for item in preferences.scan()["Items"]}
+    assert stored == {"language": "fi", "legacy": "x", "theme": "light"}
+    revert_rows = [
+        item for item in dynamodb.Table("PreferenceVersions").scan()["Items"] if item.get("action") == "REVERT"
+    ]
+    assert sorted(item["preferenceKey_ts"] for item in revert_rows) == [
+        "language#v000000000003",
+        "sound#v000000000001",
+        "theme#v000000000003",  # seeded
+        "theme#v000000000004",
+    ]
+
+
+def test_diff_between_points_in_time(as_of_env):
+    _, handlers, _ = as_of_env
+
+    def diff(**query):
+        event = {"pathParameters": {"userId": "alice"}, "queryStringParameters": query}
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = handlers["get_preference_diff_lambda"].handler(event, None)
+        body = json.loads(response["body"])
+        if response["statusCode"] != 200:
+            return response["statusCode"]
+        return [(c["preferenceKey"], c["before"], c["after"], c["changes"]) for c in body["changes"]]
+
+    assert diff(**{"from": "2024-05-01", "to": "2024-05-03"}) == [
+        ("language", "fi", None, 1),
+        ("theme", "dark", "light", 1),
+    ]
+    # theme went dark -> light -> dark and drops out of the diff.
+    assert diff(**{"from": "2024-05-01", "to": "2024-05-04"}) == [("language", "fi", None, 1)]
+    assert diff(to="2024-05-02", preferenceKeys="theme") == [("theme", None, "light", 2)]
+    assert diff(fromVersion="theme#v000000000001", toVersion="theme#v000000000002") == [
+        ("language", None, "fi", 1),
+        ("theme", "dark", "light", 1),
+    ]
+    assert diff(fromVersion="theme#v000000000009", to="2024-05-04") == 404
+    assert diff(**{"from": "2024-05-04", "to": "2024-05-01"}) == 400
+
+
+def test_diff_of_named_keys_reads_only_their_versions(as_of_env, monkeypatch):
+    _, handlers, _ = as_of_env
+    from lib.preference_checkpoints import MAX_KEYS_PER_DIFF
+
+    module = handlers["get_preference_diff_lambda"]
+    queries = []
+
+    class RecordingTable:
+        def __init__(self, table):
+            self._table = table
+
+        def query(self, **kwargs):
+            queries.append(kwargs["IndexName"])
+            return self._table.query(**kwargs)
+
+        def __getattr__(self, name):
+            return getattr(self._table, name)
+
+    monkeypatch.setattr(module, "versions_table", RecordingTable(module.versions_table))
+
+    def diff(keys):
+        query = {"to": "2024-05-04", "preferenceKeys": keys}
+        event = {"pathParameters": {"userId": "alice"}, "queryStringParameters": query}
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = module.handler(event, None)
+        return response["statusCode"], json.loads(response["body"])
+
+    # language has versions in the window too, but only theme's are read.
+    status, body = diff("theme,theme")
+    assert status == 200 and body["versionsRead"] == 3
+    assert [change["preferenceKey"] for change in body["changes"]] == ["theme"]
+    assert queries == ["userKey-timestamp-index"]
+
+    status, body = diff(",".join(f"key{n}" for n in range(MAX_KEYS_PER_DIFF + 1)))
+    assert status == 400 and "preferenceKeys" in body["error"]
+
+
+def test_bulk_revert_conflict_on_the_document_is_409(as_of_env, monkeypatch):
+    dynamodb, handlers, _ = as_of_env
+    from lib.preference_store import PreferenceStore
+
+    module = handlers["revert_preference_lambda"]
+    store = PreferenceStore(dynamodb.Table("Preferences"), dynamodb.Table("PreferenceDocuments"), mode="document")
+    store.merge_document(
+        "alice", [{"preferenceKey": "theme", "value": "dark", "updatedAt": "2024-05-04T09:00:00.000Z"}]
+    )
+    monkeypatch.setattr(module, "preference_store", store)
+    plan = module.revert_plan
+
+    def plan_then_concurrent_write(*args, **kwargs):
+        changes = plan(*args, **kwargs)
+        session = store.session("alice")
+        session.current("theme")
+        session.put({"preferenceKey": "theme", "value": "dim", "updatedAt": "2024-06-01T00:00:00.000Z"})
+        session.commit()
+        return changes
+
+    monkeypatch.setattr(module, "revert_plan", plan_then_concurrent_write)
+    event = {"body": json.dumps({"userId": "alice", "at": "2024-05-02T12:00"})}
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = module.handler(event, None)
+
+    assert response["statusCode"] == 409, response
+    assert [item["value"] for item in store.session("alice").items()] == ["dim"]
+
+
+def test_bulk_revert_in_chunks_creates_the_document_once(as_of_env, monkeypatch):
+    dynamodb, handlers, _ = as_of_env
+    from lib.preference_store import PreferenceStore
+
+    module = handlers["revert_preference_lambda"]
+    store = PreferenceStore(dynamodb.Table("Preferences"), dynamodb.Table("PreferenceDocuments"), mode="document")
+    monkeypatch.setattr(module, "preference_store", store)
+    monkeypatch.setattr(module, "BULK_CHANGES_PER_TRANSACTION", 1)
+
+    # alice has no document yet; theme and language land in separate transactions.
+    event = {"body": json.dumps({"userId": "alice", "at": "2024-05-01"})}
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = module.handler(event, None)
+
+    assert response["statusCode"] == 200, response
+    assert [change["preferenceKey"] for change in json.loads(response["body"])["reverted"]] == ["language", "theme"]
+    assert {item["preferenceKey"]: item["value"] for item in store.session("alice").items()} == {
+        "language": "fi",
+        "theme": "dark",
+    }
@@ -0,0 +1,101 @@
+import contextlib
+import io
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("moto")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import local_dynamodb  # noqa: E402
+
+
+@pytest.fixture
+def store_env(monkeypatch):
+    monkeypatch.setenv("PREFERENCE_STORAGE_MODE", "dual")
+    with local_dynamodb.local_dynamodb() as dynamodb:
+        dynamodb.Table("Users").put_item(Item={"userId": "alice", "role": "Adult", "country": "UA"})
+        dynamodb.Table("Preferences").put_item(
+            Item={"userId": "alice", "preferenceKey": "theme", "value": "dark", "updatedAt": "2024-01-01T00:00:00.000Z"}
+        )
+        yield dynamodb, monkeypatch
+
+
+def _call(handler, event):
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = handler(event, None)
+    assert response["statusCode"] == 200, response
+    return json.loads(response["body"])
+
+
+def _stored(handlers):
+    items = _call(handlers["get_user_preferences_lambda"].handler, {"pathParameters": {"userId": "alice"}})
+    return {item["preferenceKey"]: item["value"] for item in items if "updatedAt" in item}
+
+
+def test_dual_mode_migration_then_document_mode(store_env):
+    dynamodb, monkeypatch = store_env
+    handlers = local_dynamodb.load_handlers()
+    set_handler = handlers["set_user_preferences_lambda"].handler
+
+    # Not migrated yet: writes go to the items, reads fall back to them.
+    _call(set_handler, {"pathParameters": {"userId": "alice"}, "body": json.dumps({"language": "fi"})})
+    assert dynamodb.Table("PreferenceDocuments").get_item(Key={"userId": "alice"}).get("Item") is None
+    assert _stored(handlers) == {"theme": "dark", "language": "fi"}
+
+    job = local_dynamodb.load_job("migrate_preference_documents")
+    store = handlers["set_user_preferences_lambda"].preference_store
+    assert job.run(dynamodb.Table("Users"), store, total_segments=1, workers=1)["keys"] == 2
+    assert job.run(dynamodb.Table("Users"), store, total_segments=1, workers=1, verify=True)["mismatched"] == 0
+
+    # Migrated: dual-mode writes keep the document in step with the items.
+    _call(set_handler, {"pathParameters": {"userId": "alice"}, "body": json.dumps({"theme": "light"})})
+    assert job.verify_user(store, "alice")
+
+    monkeypatch.setenv("PREFERENCE_STORAGE_MODE", "document")
+    handlers = local_dynamodb.load_handlers()
+    body = _call(
+        handlers["set_user_preferences_lambda"].handler,
+        {"pathParameters": {"userId": "alice"}, "body": json.dumps({"language": "en", "volume": "7"})},
+    )
+    assert [item["preferenceKey"] for item in body] == ["language", "theme", "volume"]
+    _call(
+        handlers["delete_user_preference_lambda"].handler,
+        {"pathParameters": {"userId": "alice", "preferenceKey": "theme"}},
+    )
+    assert _stored(handlers) == {"language": "en", "volume": "7"}
+
+    document = dynamodb.Table("PreferenceDocuments").get_item(Key={"userId": "alice"})["Item"]
+    assert sorted(document["prefs"]) == ["language", "volume"] and document["revision"] > 1
+    # Document mode no longer touches the items.
+    items = dynamodb.Table("Preferences").scan()["Items"]
+    assert {item["preferenceKey"]: item["value"] for item in items} == {"theme": "light", "language": "fi"}
+
+
+def test_document_writes_conflict_only_on_the_same_key(store_env):
+    dynamodb, _ = store_env
+    local_dynamodb.configure_environment()
+    from lib.preference_store import ConcurrentPreferenceUpdate, PreferenceStore
+
+    store = PreferenceStore(dynamodb.Table("Preferences"), dynamodb.Table("PreferenceDocuments"), mode="document")
+    store.merge_document("alice", PreferenceStore(store.preferences_table, mode="items").list("alice"))
+
+    first, second, third = store.session("alice"), store.session("alice"), store.session("alice")
+    for session in (first, second):
+        session.current("theme")
+        session.put({"preferenceKey": "theme", "value": "light", "updatedAt": "2024-02-01T00:00:00.000Z"})
+    third.current("language")
+    third.put({"preferenceKey": "language", "value": "fi", "updatedAt": "2024-02-01T00:00:01.000Z"})
+
+    first.commit()
+    with pytest.raises(ConcurrentPreferenceUpdate):
+        second.commit()
+    third.commit()
+
+    assert {item["preferenceKey"]: item["value"] for item in store.list("alice")} == {
+        "language": "fi",
+        "theme": "light",
+    }
@@ -0,0 +1,111 @@
+import contextlib
+import io
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("moto")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import local_dynamodb  # noqa: E402
+
+HISTORY = [
+    ("alice", "voice_chat", "UPSERT", "2024-05-01T09:00:00.000Z"),
+    ("alice", "voice_chat", "DELETE", "2024-05-01T18:30:00.000Z"),
+    ("alice", "language", "UPSERT", "2024-05-02T08:00:00.000Z"),
+    ("bob", "voice_chat", "UPSERT", "2024-05-01T12:00:00.000Z"),
+    ("bob", "language", "REVERT", "2024-05-03T07:00:00.000Z"),
+]
+
+
+@pytest.fixture(scope="module")
+def versions_handler():
+    with local_dynamodb.local_dynamodb() as dynamodb:
+        local_dynamodb.configure_environment()
+        from lib.preference_versions import build_version_item
+
+        table = dynamodb.Table("PreferenceVersions")
+        for sequence, (user_id, key, action, timestamp) in enumerate(HISTORY, start=1):
+            table.put_item(Item=build_version_item(user_id, key, "old", "new", action, sequence, timestamp))
+        yield local_dynamodb.load_handlers()["list_preference_versions_lambda"].handler
+
+
+def _list(handler, path=None, query=None):
+    event = {"pathParameters": path, "queryStringParameters": query}
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = handler(event, None)
+    body = json.loads(response["body"])
+    if response["statusCode"] != 200:
+        return response["statusCode"], body
+    return body["mode"], [(item["userId"], item["preferenceKey"], item["action"]) for item in body["items"]]
+
+
+@pytest.mark.parametrize(
+    "path,query,expected",
+    [
+        (
+            {"userId": "alice"},
+            {"from": "2024-05-01T12:00", "to": "2024-05-02"},
+            ("user_range", [("alice", "language", "UPSERT"), ("alice", "voice_chat", "DELETE")]),
+        ),
+        ({"userId": "alice"}, {"action": "delete"}, ("user_action", [("alice", "voice_chat", "DELETE")])),
+        (
+            None,
+            {"preferenceKey": "voice_chat", "to": "2024-05-01"},
+            (
+                "key_range",
+                [("alice", "voice_chat", "DELETE"), ("bob", "voice_chat", "UPSERT"), ("alice", "voice_chat", "UPSERT")],
+            ),
+        ),
+        (None, {"preferenceKey": "language", "action": "REVERT"}, ("key_action", [("bob", "language", "REVERT")])),
+        (
+            {"userId": "alice", "preferenceKey": "voice_chat"},
+            {"from": "2024-05-01T10"},
+            ("user_key", [("alice", "voice_chat", "DELETE")]),
+        ),
+        (
+            {"userId": "alice"},
+            {"from": "2024-05-01T12:00", "to": "2024-05-01"},
+            ("user_range", [("alice", "voice_chat", "DELETE")]),
+        ),
+    ],
+)
+def test_history_query_modes(versions_handler, path, query, expected):
+    assert _list(versions_handler, path, query) == expected
+
+
+def test_user_key_range_pages_are_not_emptied_by_other_keys(versions_handler):
+    # alice's newest row in the window is "language"; a page of one must still hold voice_chat.
+    assert _list(
+        versions_handler, {"userId": "alice", "preferenceKey": "voice_chat"}, {"from": "2024-05-01", "limit": "1"}
+    ) == ("user_key", [("alice", "voice_chat", "DELETE")])
+
+
+def test_invalid_filters_are_rejected(versions_handler):
+    assert _list(versions_handler, {"userId": "alice"}, {"from": "yesterday"})[0] == 400
+    assert _list(versions_handler, {"userId": "alice"}, {"action": "RENAME"})[0] == 400
+    assert _list(versions_handler, None, {"from": "2024-05-01"})[0] == 400
+
+
+def test_versions_are_numbered_per_key(versions_handler):
+    import boto3
+    from lib.preference_versions import record_version
+
+    table = boto3.resource("dynamodb").Table("PreferenceVersions")
+    first = record_version(table, "carol", "theme", None, "dark", "UPSERT")
+    second = record_version(table, "carol", "theme", "dark", "light", "UPSERT")
+    other = record_version(table, "carol", "language", None, "fi", "UPSERT")
+
+    assert (first["version"], second["version"], other["version"]) == (1, 2, 1)
+    assert _list(versions_handler, {"userId": "carol", "preferenceKey": "theme"}, {"version": "2"}) == (
+        "version",
+        [("carol", "theme", "UPSERT")],
+    )
+    assert _list(versions_handler, {"userId": "carol"}, None) == (
+        "user",
+        [("carol", "theme", "UPSERT"), ("carol", "theme", "UPSERT"), ("carol", "language", "UPSERT")],
+    )
+    assert _list(versions_handler, {"userId": "carol"}, {"version": "0"})[0] == 400
@@ -0,0 +1,41 @@
+import json
+
+from lib import profiling
+from lib.observability import instrument_handler
+
+
+def test_signed_header_enables_profiling(monkeypatch):
+    monkeypatch.setenv("PROFILE_SIGNING_SECRET", "s3cret")
+    monkeypatch.delenv("PROFILE_SAMPLE_RATE", raising=False)
+
+    valid = {"headers": {"X-Profile-Request": profiling.sign_profile_request("s3cret", "get_user")}}
+    wrong_function = {"headers": {"X-Profile-Request": profiling.sign_profile_request("s3cret", "other")}}
+    expired = {
+        "headers": {"X-Profile-Request": profiling.sign_profile_request("s3cret", "get_user", timestamp=1)}
+    }
+
+    assert profiling.should_profile(valid, "get_user")
+    assert not profiling.should_profile(wrong_function, "get_user")
+    assert not profiling.should_profile(expired, "get_user")
+    assert not profiling.should_profile({}, "get_user")
+
+
+def test_profiled_invocation_writes_top_n_summary(monkeypatch, tmp_path):
+    monkeypatch.setenv("PROFILE_SAMPLE_RATE", "1")
+    monkeypatch.setenv("PROFILE_OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setenv("PROFILE_TOP_N", "5")
+
+    @instrument_handler("profiled_test")
+    def handler(event, context):
+        blob = [str(i) * 10 for i in range(2000)]
+        return {"statusCode": 200, "body": json.dumps(len(blob))}
+
+    assert handler({}, None)["statusCode"] == 200
+
+    summaries = list(tmp_path.glob("profiled_test-*.json"))
+    assert len(summaries) == 1
+    assert list(tmp_path.glob("profiled_test-*.pstats"))
+    summary = json.loads(summaries[0].read_text())
+    assert summary["profile"] == "profiled_test"
+    assert summary["peakTracedMemoryKiB"] > 0
+    assert 0 < len(summary["top"]) <= 5
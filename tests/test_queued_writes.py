@@ -0,0 +1,139 @@
+import contextlib
+import io
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("moto")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import local_dynamodb  # noqa: E402
+from benchmarks.local_dynamodb import claims  # noqa: E402
+
+
+@pytest.fixture
+def queue_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("PREFERENCE_WRITE_QUEUE", str(tmp_path / "queue"))
+    monkeypatch.setenv("PREFERENCE_COALESCE_WINDOW_MS", "0")
+    with local_dynamodb.local_dynamodb() as dynamodb:
+        local_dynamodb.configure_environment()
+        dynamodb.Table("ManagedPreferenceSchema").put_item(
+            Item={"preferenceKey": "voice_chat_enabled", "scope": "GLOBAL", "baseDefault": "false", "minAge": 16}
+        )
+        with dynamodb.Table("Users").batch_writer() as batch:
+            batch.put_item(Item={"userId": "alice", "role": "Adult", "country": "UA", "birthDate": "1990-06-15"})
+            batch.put_item(Item={"userId": "kid", "role": "Child", "country": "UA", "birthDate": "2016-01-01"})
+        handlers = local_dynamodb.load_handlers()
+        yield dynamodb, handlers, local_dynamodb.load_job("drain_write_queue")
+
+
+def _put_async(handlers, user_id, body, prefer="respond-async"):
+    event = {"requestContext": claims(user_id), "headers": {"Prefer": prefer}, "body": json.dumps(body)}
+    with contextlib.redirect_stdout(io.StringIO()):
+        return handlers["set_user_preferences_lambda"].handler(event, None)
+
+
+def _drain(dynamodb, handlers, job):
+    set_module = handlers["set_user_preferences_lambda"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        return job.run(
+            set_module.write_queue,
+            set_module.preference_store,
+            dynamodb.meta.client,
+            set_module.versions_table,
+            effective_table_name="EffectivePreferences",
+            batch_size=10,
+            coalescer=set_module.write_coalescer,
+            outbox=set_module.outbox,
+        )
+
+
+def _versions(dynamodb):
+    items = dynamodb.Table("PreferenceVersions").scan()["Items"]
+    return [item for item in items if not item["preferenceKey_ts"].startswith("#")]
+
+
+def test_async_writes_are_coalesced_and_validated_by_the_worker(queue_env):
+    dynamodb, handlers, job = queue_env
+    set_module = handlers["set_user_preferences_lambda"]
+
+    for value in ("fi", "sv", "en"):
+        response = _put_async(handlers, "alice", {"language": value})
+        assert response["statusCode"] == 202
+        assert response["headers"]["Preference-Applied"] == "respond-async"
+    _put_async(handlers, "kid", {"voice_chat_enabled": "true", "language": "uk"})
+    assert dynamodb.Table("Preferences").scan()["Items"] == []
+
+    report = _drain(dynamodb, handlers, job)
+
+    assert report["batches"] == 1 and report["messages"] == 4 and report["updates"] == 5
+    assert report["written"] == 2 and report["blocked"] == 1
+    stored = {(i["userId"], i["preferenceKey"]): i["value"] for i in dynamodb.Table("Preferences").scan()["Items"]}
+    assert stored == {("alice", "language"): "en", ("kid", "language"): "uk"}
+    assert sorted((v["userId"], v["newValue"], v.get("oldValue")) for v in _versions(dynamodb)) == [
+        ("alice", "en", None),
+        ("kid", "uk", None),
+    ]
+    assert set_module.write_queue.receive() == []
+    events = dynamodb.Table("PreferenceOutbox").scan()["Items"]
+    assert sorted((e["userId"], e["action"], e["changes"][0]["newValue"]) for e in events) == [
+        ("alice", "UPSERT", "en"),
+        ("kid", "UPSERT", "uk"),
+    ]
+
+
+def test_coalescing_window_writes_the_final_value_once(queue_env):
+    dynamodb, handlers, job = queue_env
+    coalescer = handlers["set_user_preferences_lambda"].write_coalescer
+    with contextlib.redirect_stdout(io.StringIO()):
+        handlers["set_user_preferences_lambda"].handler(
+            {"requestContext": claims("alice"), "body": json.dumps({"language": "fi"})}, None
+        )
+
+    for value in ("sv", "en", "de", "uk"):
+        response = _put_async(handlers, "alice", {"language": value}, prefer="coalesce")
+        assert response["statusCode"] == 202 and json.loads(response["body"])["status"] == "coalescing"
+    assert len(coalescer.queue.receive()) == 1  # only the first update opened the window
+    assert dynamodb.Table("Preferences").get_item(Key={"userId": "alice", "preferenceKey": "language"})["Item"][
+        "value"
+    ] == "fi"
+
+    report = _drain(dynamodb, handlers, job)
+    assert report["flushed"] == 1 and report["written"] == 1 and report["requeued"] == 0
+    assert dynamodb.Table("Preferences").get_item(Key={"userId": "alice", "preferenceKey": "language"})["Item"][
+        "value"
+    ] == "uk"
+    latest = max(_versions(dynamodb), key=lambda v: v["version"])
+    assert (latest["oldValue"], latest["newValue"], latest["coalescedUpdates"]) == ("fi", "uk", 4)
+    assert dynamodb.Table("PendingPreferenceWrites").scan()["Items"] == []
+
+    # An update that lands while a flush is in progress keeps the row for the next flush.
+    coalescer.stage("alice", "alice", [("language", "pl")], "2030-01-01T00:00:00.000Z")
+    rows = coalescer.pending(dynamodb.meta.client, [("alice", "language")])
+    coalescer.stage("alice", "alice", [("language", "cs")], "2030-01-01T00:00:00.500Z")
+    assert coalescer.settle(rows) == 1
+    assert dynamodb.Table("PendingPreferenceWrites").scan()["Items"][0]["value"] == "cs"
+
+
+def test_document_mode_keeps_a_synchronous_write_made_after_acceptance(queue_env):
+    dynamodb, handlers, _ = queue_env
+    from lib.preference_store import PreferenceStore
+    from lib.queued_writes import apply_queued_writes
+
+    set_module = handlers["set_user_preferences_lambda"]
+    _put_async(handlers, "alice", {"language": "fi"})
+    store = PreferenceStore(dynamodb.Table("Preferences"), dynamodb.Table("PreferenceDocuments"), mode="document")
+    session = store.session("alice")
+    session.put({"userId": "alice", "preferenceKey": "language", "value": "en", "updatedAt": "2999-01-01T00:00:00.000Z"})
+    session.commit()
+
+    messages = [message["body"] for message in set_module.write_queue.receive()]
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = apply_queued_writes(messages, store, dynamodb.meta.client, set_module.versions_table)
+
+    assert report["superseded"] == 1 and report["written"] == 0
+    assert [item["value"] for item in store.session("alice").items()] == ["en"]
+    assert _versions(dynamodb) == []
@@ -0,0 +1,45 @@
+import contextlib
+import gzip
+import io
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("moto")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import local_dynamodb  # noqa: E402
+from benchmarks.local_dynamodb import claims  # noqa: E402
+
+
+def test_snapshots_match_get_preferences(tmp_path):
+    with local_dynamodb.local_dynamodb() as dynamodb:
+        dataset = local_dynamodb.seed(
+            dynamodb, adults=5, children_per_adult=2, schema_rows=12, prefs_per_user=3, version_depth=0
+        )
+        handlers = local_dynamodb.load_handlers()
+        job = local_dynamodb.load_job("resolve_effective_preferences")
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            report = job.run(str(tmp_path), total_segments=3, workers=1)
+            expected = {
+                user_id: json.loads(
+                    handlers["get_user_preferences_lambda"].handler({"requestContext": claims(user_id)}, None)["body"]
+                )
+                for user_id in dataset.all_users
+            }
+
+    snapshots = {}
+    for shard in report["shards"]:
+        with gzip.open(tmp_path / shard, "rt") as fh:
+            for line in fh:
+                row = json.loads(line)
+                snapshots[row["userId"]] = row["preferences"]
+
+    assert report["users"] == len(dataset.all_users)
+    assert snapshots == expected
+    # 5 countries x {adult, child} at most, shared by 15 users.
+    assert sum(segment["cohorts"] for segment in report["segments"]) < report["users"]
@@ -0,0 +1,121 @@
+import contextvars
+import threading
+
+import pytest
+
+from lib import scan_engine
+
+_marker = contextvars.ContextVar("marker", default=None)
+
+
+class FakeTable:
+    """Splits ``items`` round-robin into segments and pages them ``page_size`` at a time."""
+
+    name = "Fake"
+
+    def __init__(self, count, page_size=3, fail_segment=None):
+        self.items = [{"id": str(index), "payload": "x"} for index in range(count)]
+        self.page_size = page_size
+        self.fail_segment = fail_segment
+        self.requests = []
+        self.markers = set()
+        self._lock = threading.Lock()
+
+    def scan(self, **params):
+        with self._lock:
+            self.requests.append(params)
+            self.markers.add(_marker.get())
+        segment = params.get("Segment", 0)
+        total = params.get("TotalSegments", 1)
+        if segment == self.fail_segment:
+            raise RuntimeError("boom")
+        rows = [item for index, item in enumerate(self.items) if index % total == segment]
+        start = int(params.get("ExclusiveStartKey", {}).get("offset", 0))
+        page = rows[start : start + self.page_size]
+        if "ProjectionExpression" in params:
+            names = [params["ExpressionAttributeNames"][alias] for alias in params["ProjectionExpression"].split(", ")]
+            page = [{name: item[name] for name in names} for item in page]
+        response = {"Items": page}
+        if start + self.page_size < len(rows):
+            response["LastEvaluatedKey"] = {"offset": start + self.page_size}
+        return response
+
+
+def test_single_segment_runs_inline_without_segment_params():
+    table = FakeTable(7)
+    assert [item["id"] for item in scan_engine.scan_items(table)] == [str(i) for i in range(7)]
+    assert all("Segment" not in request for request in table.requests)
+
+
+def test_parallel_scan_yields_every_item_once_with_projection_and_context():
+    table = FakeTable(50)
+    _marker.set("invocation-1")
+    items = list(
+        scan_engine.scan_items(table, total_segments=4, max_workers=3, projection=["id"], max_buffered_pages=1)
+    )
+
+    assert sorted(item["id"] for item in items) == sorted(str(i) for i in range(50))
+    assert all(set(item) == {"id"} for item in items)
+    assert {request["Segment"] for request in table.requests} == {0, 1, 2, 3}
+    assert table.markers == {"invocation-1"}
+
+
+def test_resume_from_start_keys_and_error_propagation():
+    table = FakeTable(12)
+    pages = list(scan_engine.scan_pages(table, total_segments=2, segments=[1], start_keys={1: {"offset": 3}}))
+    assert [item["id"] for page in pages for item in page.items] == ["7", "9", "11"]
+    assert pages[-1].last_evaluated_key is None
+
+    with pytest.raises(RuntimeError, match="boom"):
+        list(scan_engine.scan_items(FakeTable(12, fail_segment=1), total_segments=3, max_workers=3))
+
+
+def test_boto3_tables_are_scanned_through_their_client():
+    fake = FakeTable(20)
+
+    class Client:
+        def scan(self, TableName, **params):
+            assert TableName == "Preferences"
+            return fake.scan(**params)
+
+    class Meta:
+        client = Client()
+
+    class Table:
+        name = "Preferences"
+        meta = Meta()
+
+        def scan(self, **params):
+            raise AssertionError("the shared resource must not be used from worker threads")
+
+    items = list(scan_engine.scan_items(Table(), total_segments=4, max_workers=4))
+    assert sorted(item["id"] for item in items) == sorted(str(i) for i in range(20))
+    assert all(request["ReturnConsumedCapacity"] == "TOTAL" for request in fake.requests)
+
+
+def test_thread_local_dynamodb_gives_each_thread_its_own_table(monkeypatch):
+    moto = pytest.importorskip("moto")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-north-1")
+    with moto.mock_aws():
+        dynamodb = scan_engine.ThreadLocalDynamoDB()
+        dynamodb.meta.client.create_table(
+            TableName="Users",
+            KeySchema=[{"AttributeName": "userId", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "userId", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        table = dynamodb.Table("Users")
+        handles = set()
+
+        def write(index):
+            table.put_item(Item={"userId": str(index)})
+            handles.add(id(dynamodb.thread_table("Users")))
+
+        threads = [threading.Thread(target=write, args=(index,)) for index in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(handles) == 3
+        assert sorted(item["userId"] for item in scan_engine.scan_items(table, total_segments=2)) == ["0", "1", "2"]
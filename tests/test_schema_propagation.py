@@ -0,0 +1,93 @@
+import contextlib
+import io
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("moto")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import local_dynamodb  # noqa: E402
+from benchmarks.local_dynamodb import claims  # noqa: E402
+
+USERS = [
+    {"userId": "alice", "role": "Adult", "country": "UA", "birthDate": "1990-06-15"},
+    {"userId": "bob", "role": "Adult", "country": "FI", "birthDate": "1985-01-20"},
+    {"userId": "carl", "role": "Child", "country": "FI", "birthDate": "2015-03-02"},
+]
+THEME = {"preferenceKey": "theme", "scope": "GLOBAL", "baseDefault": "light"}
+
+
+@pytest.fixture
+def propagation_env(monkeypatch):
+    monkeypatch.setenv("SCHEMA_VERSION_TTL_SECONDS", "0")
+    with local_dynamodb.local_dynamodb() as dynamodb:
+        local_dynamodb.configure_environment()
+        from lib.schema_version import write_schema_items
+
+        write_schema_items(
+            dynamodb.Table("ManagedPreferenceSchema"), dynamodb.Table("ManagedPreferenceSchemaChanges"), [THEME]
+        )
+        with dynamodb.Table("Users").batch_writer() as batch:
+            for user in USERS:
+                batch.put_item(Item=user)
+        job = local_dynamodb.load_job("propagate_schema_change")
+        yield dynamodb, local_dynamodb.load_handlers(), job
+
+
+def _me(handlers, user_id):
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = handlers["get_user_preferences_lambda"].handler({"requestContext": claims(user_id)}, None)
+    return {item["preferenceKey"]: item["value"] for item in json.loads(response["body"])}
+
+
+def test_only_affected_cohorts_are_recomputed(propagation_env):
+    dynamodb, handlers, job = propagation_env
+    from lib.schema_version import write_schema_items
+
+    view_table = dynamodb.Table("EffectivePreferences")
+    for user in USERS:
+        assert _me(handlers, user["userId"]) == {"theme": "light"}
+    computed = {item["userId"]: item["computedAt"] for item in view_table.scan()["Items"]}
+
+    write_schema_items(
+        dynamodb.Table("ManagedPreferenceSchema"),
+        dynamodb.Table("ManagedPreferenceSchemaChanges"),
+        [dict(THEME, countryOverrides={"FI": "dark"})],
+    )
+    view = handlers["get_user_preferences_lambda"].effective_view
+    assert view.read("alice") is None  # every view is stale until the change is propagated
+
+    progress = io.StringIO()
+    report = job.run(view, handlers["get_user_preferences_lambda"].preference_store,
+                     dynamodb.Table("ManagedPreferenceSchemaChanges"), total_segments=2, workers=2, batch_size=1, progress=job.Progress(progress))
+
+    assert report["keys"] == ["theme"] and report["fromVersion"] == 1 and report["toVersion"] == 2
+    assert {cohort["country"] for cohort in report["cohorts"]} == {"FI"}
+    assert report["recomputed"] == 2 and report["failed"] == 0 and report["viewFloorRestored"]
+    assert len(progress.getvalue().splitlines()) == report["batches"] == 2
+
+    stored = {item["userId"]: item for item in view_table.scan()["Items"]}
+    assert stored["alice"]["computedAt"] == computed["alice"]
+    assert {item["value"] for item in stored["bob"]["preferences"]} == {"dark"}
+    # alice's untouched view is fresh again; FI users see the override.
+    assert view.read("alice") == [dict(stored["alice"]["preferences"][0])]
+    assert _me(handlers, "carl") == {"theme": "dark"}
+
+
+def test_age_rule_changes_affect_only_the_age_band():
+    local_dynamodb.configure_environment()
+    from lib.schema_propagation import affected_cohorts, cohort_dimensions, cohort_of, schema_delta
+
+    change = {"before": [THEME], "after": [dict(THEME, minAge=16)], "deleted": []}
+    delta = schema_delta([change], [dict(THEME, minAge=16)])
+    countries, boundaries = cohort_dimensions(delta)
+    cohorts = affected_cohorts(delta)
+
+    assert countries == [] and boundaries == [0, 16]
+    assert cohorts == {(False, None, 0), (True, None, 0)}
+    assert cohort_of({"is_child": True, "country": "UA", "age": 12}, countries, boundaries) in cohorts
+    assert cohort_of({"is_child": False, "country": "UA", "age": 30}, countries, boundaries) not in cohorts
@@ -0,0 +1,107 @@
+import contextlib
+import io
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("moto")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import local_dynamodb  # noqa: E402
+from benchmarks.local_dynamodb import claims  # noqa: E402
+
+
+@pytest.fixture
+def schema_env(monkeypatch):
+    with local_dynamodb.local_dynamodb() as dynamodb:
+        dataset = local_dynamodb.seed(
+            dynamodb, adults=1, children_per_adult=1, schema_rows=4, prefs_per_user=0, version_depth=0
+        )
+        handlers = local_dynamodb.load_handlers()
+        from lib import ddb_metrics, preferences_resolver
+
+        monkeypatch.setattr(preferences_resolver, "SCHEMA_VERSION_TTL_SECONDS", 0)
+        sink = ddb_metrics.InMemorySink()
+        previous = ddb_metrics.set_sink(sink)
+        try:
+            yield dynamodb, dataset, handlers["default_preferences_lambda"].handler, sink
+        finally:
+            ddb_metrics.set_sink(previous)
+
+
+def _call(handler, user_id, etag=None):
+    event = {"requestContext": claims(user_id)}
+    if etag:
+        event["headers"] = {"If-None-Match": etag}
+    with contextlib.redirect_stdout(io.StringIO()):
+        return handler(event, None)
+
+
+def test_schema_is_rescanned_only_when_the_stamp_moves(schema_env):
+    dynamodb, dataset, handler, sink = schema_env
+    adult = dataset.adults[0]
+    _call(handler, adult)
+
+    sink.clear()
+    _call(handler, adult)
+    assert sink.calls(table="ManagedPreferenceSchema", operation="scan") == 0
+    assert sink.calls(table="ManagedPreferenceSchema", operation="get_item") == 1
+
+    from lib.schema_version import write_schema_items
+
+    write_schema_items(
+        dynamodb.Table("ManagedPreferenceSchema"),
+        dynamodb.Table("ManagedPreferenceSchemaChanges"),
+        [{"preferenceKey": "brand_new", "scope": "GLOBAL", "baseDefault": "on"}],
+    )
+    sink.clear()
+    body = json.loads(_call(handler, adult)["body"])
+    assert sink.calls(table="ManagedPreferenceSchema", operation="scan") == 1
+    assert any(item["preferenceKey"] == "brand_new" for item in body)
+    assert not any(item["preferenceKey"].startswith("#") for item in body)
+
+
+def test_resolver_scan_does_not_read_change_records(schema_env, monkeypatch):
+    dynamodb, dataset, handler, _ = schema_env
+    from lib import preferences_resolver
+    from lib.schema_version import LEGACY_CHANGE_KEY, read_schema_changes, write_schema_items
+
+    schema = dynamodb.Table("ManagedPreferenceSchema")
+    changes = dynamodb.Table("ManagedPreferenceSchemaChanges")
+    schema.put_item(Item={"preferenceKey": LEGACY_CHANGE_KEY, "scope": "0000000001", "before": [], "after": []})
+    for value in ("on", "off"):
+        write_schema_items(schema, changes, [{"preferenceKey": "brand_new", "scope": "GLOBAL", "baseDefault": value}])
+
+    scanned = []
+    scan_all = preferences_resolver.scan_all
+    monkeypatch.setattr(preferences_resolver, "scan_all", lambda table: scanned.extend(scan_all(table)) or scanned)
+    _call(handler, dataset.adults[0])
+
+    assert [row["preferenceKey"] for row in scanned if row["preferenceKey"].startswith("#")] == ["#schema"]
+    version = preferences_resolver.schema_snapshot()[0]
+    assert [change["version"] for change in read_schema_changes(changes, version - 2, version)] == [
+        version - 1,
+        version,
+    ]
+
+
+def test_default_preferences_etag_revalidation(schema_env):
+    dynamodb, dataset, handler, _ = schema_env
+    adult = dataset.adults[0]
+    child = dataset.children[adult][0]
+
+    first = _call(handler, adult)
+    etag = first["headers"]["ETag"]
+    assert first["statusCode"] == 200
+    assert _call(handler, adult, etag)["statusCode"] == 304
+    assert _call(handler, child, etag)["statusCode"] == 200
+
+    from lib.schema_version import bump_schema_version
+
+    bump_schema_version(dynamodb.Table("ManagedPreferenceSchema"))
+    refreshed = _call(handler, adult, etag)
+    assert refreshed["statusCode"] == 200
+    assert refreshed["headers"]["ETag"] != etag
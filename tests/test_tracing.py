@@ -0,0 +1,50 @@
+from lib import tracing
+
+
+def test_span_is_noop_when_tracing_disabled():
+    tracing.set_enabled(False)
+    exporter = tracing.InMemorySpanExporter()
+    previous = tracing.set_exporter(exporter)
+    try:
+        with tracing.span("handler.test") as root:
+            root.set_attribute("ignored", True)
+    finally:
+        tracing.set_exporter(previous)
+
+    assert exporter.traces == []
+
+
+def test_nested_spans_export_one_otlp_trace():
+    tracing.set_enabled(True)
+    exporter = tracing.InMemorySpanExporter()
+    previous = tracing.set_exporter(exporter)
+
+    @tracing.traced("resolver.build_user_context")
+    def build_context():
+        with tracing.span("ddb.get_item", table="Users"):
+            pass
+
+    try:
+        with tracing.span("handler.test"):
+            build_context()
+            with tracing.span("serialize"):
+                pass
+    finally:
+        tracing.set_exporter(previous)
+        tracing.set_enabled(False)
+
+    assert len(exporter.traces) == 1
+    spans = {s.name: s for s in exporter.traces[0]}
+    root = spans["handler.test"]
+    assert root.parent_span_id is None
+    assert spans["resolver.build_user_context"].parent_span_id == root.span_id
+    assert spans["ddb.get_item"].parent_span_id == spans["resolver.build_user_context"].span_id
+    assert len({s.trace_id for s in spans.values()}) == 1
+
+    otlp = tracing.to_otlp(exporter.traces[0])
+    exported = otlp["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert exported[0]["name"] == "handler.test"
+    assert {"key": "table", "value": {"stringValue": "Users"}} in next(
+        s for s in exported if s["name"] == "ddb.get_item"
+    )["attributes"]
+    assert "serialize" in tracing.render_tree(exporter.traces[0])
@@ -0,0 +1,128 @@
+import contextlib
+import io
+import json
+import os
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("moto")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import local_dynamodb  # noqa: E402
+
+HISTORY = [
+    ("theme", "UPSERT", None, "dark", "2024-03-05T09:00:00.000Z"),
+    ("theme", "UPSERT", "dark", "light", "2024-03-20T09:00:00.000Z"),
+    ("language", "UPSERT", None, "fi", "2024-04-02T10:00:00.000Z"),
+    ("theme", "DELETE", "light", None, "2024-05-03T09:00:00.000Z"),
+]
+
+
+@pytest.fixture
+def tiered_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("VERSION_ARCHIVE_LOCATION", str(tmp_path / "archive"))
+    with local_dynamodb.local_dynamodb() as dynamodb:
+        local_dynamodb.configure_environment()
+        from lib.preference_versions import build_version_item
+
+        dynamodb.Table("Users").put_item(Item={"userId": "alice", "role": "Adult", "country": "UA"})
+        table = dynamodb.Table("PreferenceVersions")
+        sequences = {}
+        for key, action, old, new, timestamp in HISTORY:
+            sequences[key] = sequences.get(key, 0) + 1
+            table.put_item(Item=build_version_item("alice", key, old, new, action, sequences[key], timestamp))
+        handlers = local_dynamodb.load_handlers()
+        yield dynamodb, handlers, local_dynamodb.load_job("archive_preference_versions")
+
+
+def _call(handler, path, query):
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = handler({"pathParameters": path, "queryStringParameters": query}, None)
+    assert response["statusCode"] == 200, response
+    return json.loads(response["body"])
+
+
+def _history(handlers, **query):
+    seen, token = [], None
+    while True:
+        page_query = dict(query, limit="2", **({"nextToken": token} if token else {}))
+        body = _call(handlers["list_preference_versions_lambda"].handler, {"userId": "alice"}, page_query)
+        seen.extend(item["preferenceKey_ts"] for item in body["items"])
+        token = body["nextToken"]
+        if not token:
+            return seen
+
+
+def test_completed_months_move_to_the_archive(tiered_env):
+    dynamodb, handlers, job = tiered_env
+    from lib.version_archive import open_version_archive
+
+    archive = open_version_archive()
+    versions = dynamodb.Table("PreferenceVersions")
+    before = sorted(_history(handlers))
+
+    job_now = datetime(2024, 5, 10, tzinfo=timezone.utc)
+    cutoff = job.archive_cutoff(1, now=job_now)
+    stats = job.archive_user(versions, archive, "alice", cutoff, retention_days=30)
+    assert cutoff == "2024-05-01T00:00:00.000Z" and stats == {"rows": 3, "months": 2}
+    assert archive.months("alice") == ["2024-03", "2024-04"]
+    assert job.archive_user(versions, archive, "alice", cutoff, retention_days=30) == {"rows": 0, "months": 0}
+
+    marked = [item for item in versions.scan()["Items"] if "archivedAt" in item]
+    assert len(marked) == 3 and all(int(item["expiresAt"]) > 0 for item in marked)
+    # Archived rows still in the table and the archive are listed once.
+    assert sorted(_history(handlers)) == before
+
+    for item in marked:  # what TTL eventually does
+        versions.delete_item(Key={"userId": "alice", "preferenceKey_ts": item["preferenceKey_ts"]})
+
+    assert sorted(_history(handlers)) == before
+    assert _history(handlers, **{"from": "2024-03-10", "to": "2024-04"}) == [
+        "language#v000000000001",
+        "theme#v000000000002",
+    ]
+    assert _history(handlers, action="UPSERT")[-1] == "theme#v000000000001"
+
+    single = _call(
+        handlers["list_preference_versions_lambda"].handler,
+        {"userId": "alice", "preferenceKey": "theme"},
+        {"version": "1"},
+    )
+    assert [item["newValue"] for item in single["items"]] == ["dark"]
+
+    as_of = _call(
+        handlers["get_preferences_as_of_lambda"].handler, {"userId": "alice"}, {"at": "2024-04-30"}
+    )
+    assert {item["preferenceKey"]: item["value"] for item in as_of["preferences"]} == {
+        "theme": "light",
+        "language": "fi",
+    }
+
+
+def test_find_reads_the_index_and_one_month(tmp_path):
+    from lib.object_store import open_object_store
+    from lib.version_archive import VersionArchive
+
+    store = open_object_store(str(tmp_path / "archive"))
+    archive = VersionArchive(store)
+    for month, sort_keys in [("2024-03", ["theme#v000000000001"]), ("2024-04", ["language#v000000000001"])]:
+        archive.write_month(
+            "alice", month, [{"preferenceKey_ts": key, "timestamp": f"{month}-05T09:00:00.000Z"} for key in sort_keys]
+        )
+
+    reads = []
+    get_bytes = store.get_bytes
+    store.get_bytes = lambda key: reads.append(key) or get_bytes(key)
+    assert archive.find("alice", "theme#v000000000001")["timestamp"] == "2024-03-05T09:00:00.000Z"
+    assert reads == [archive.index_key("alice"), archive.key("alice", "2024-03")]
+
+    reads.clear()
+    assert archive.find("alice", "theme#v000000000009") is None
+    assert reads == [archive.index_key("alice")]
+
+    # Months written before the index existed are still searched.
+    store.put_bytes(archive.index_key("alice"), b"")
+    assert archive.find("alice", "language#v000000000001")["timestamp"] == "2024-04-05T09:00:00.000Z"